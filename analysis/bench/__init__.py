@@ -0,0 +1,3 @@
+from .suite import run_suite
+from .history import compare_history
+from .synthetic import make_samples
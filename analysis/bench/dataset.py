@@ -0,0 +1,46 @@
+import os
+import json
+import logging
+
+from .synthetic import make_sample
+
+logger = logging.getLogger(__name__)
+
+SAMPLE = 'WtoLNu-2Jets_TuneCP5_13p6TeV_amcatnloFXFX-pythia8_Run3Summer22NanoAODv12-130X'
+
+# friends read by the benchmark weights and one column of each
+FRIEND_COLUMNS = {
+    'xsec': 'crossSectionPerEventWeight',
+    'pu': 'pog_puweight',
+    'ptweight': 'ptweight',
+    'sf': 'sf_id',
+}
+
+
+def make_dataset(out_dir, n_events=1000000, n_files=4, seed=42):
+    """
+    Write a fixed synthetic W sample with the production schema for the
+    benchmarks: ntuples in {out_dir}/ntuples and the correction friends
+    in {out_dir}/friends.
+    The dataset is only rewritten if the configuration changes.
+    Returns the list of ntuple files.
+    """
+    config = {'n_events': n_events, 'n_files': n_files, 'seed': seed}
+    basepath = os.path.join(out_dir, 'ntuples', '2022')
+    files = [
+        os.path.join(basepath, SAMPLE, 'mmet', f'{SAMPLE}_{i}.root') for i in range(n_files)
+    ]
+
+    config_file = os.path.join(out_dir, 'dataset.json')
+    if os.path.isfile(config_file):
+        with open(config_file, 'r') as f:
+            if json.load(f) == config and all(os.path.isfile(path) for path in files):
+                return files
+
+    logger.info(f"Writing synthetic dataset {config} to {out_dir}")
+    files = make_sample(SAMPLE, 'mmet', basepath, n_events, n_files, seed)
+
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+
+    return files
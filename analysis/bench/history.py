@@ -0,0 +1,118 @@
+import os
+import json
+import socket
+import datetime
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# relative changes which count as regression
+THRESHOLDS = {
+    'events_per_s': -0.1,
+    'peak_rss_mb': 0.2,
+    'jit': 0.2,
+    'event_loops': 0.,
+}
+
+
+def get_commit():
+    """
+    Current commit, marked as dirty if there are uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return commit + ('-dirty' if dirty else '')
+
+
+def load_history(history):
+    if not os.path.isfile(history):
+        return []
+
+    with open(history, 'r') as f:
+        return json.load(f)
+
+
+def append_record(history, results, n_events, label=''):
+    """
+    Append the results of a benchmark run to the history.
+    """
+    records = load_history(history)
+    records.append({
+        'commit': get_commit(),
+        'label': label,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'host': socket.gethostname(),
+        'n_events': n_events,
+        'results': results,
+    })
+
+    os.makedirs(os.path.dirname(history) or '.', exist_ok=True)
+    with open(history, 'w') as f:
+        json.dump(records, f, indent=4)
+
+    return
+
+
+def find_record(records, ref):
+    """
+    Find a record by commit (prefix) or label, the latest one wins.
+    """
+    for record in reversed(records):
+        if record['commit'].startswith(ref) or record['label'] == ref:
+            return record
+
+    raise ValueError(f"No benchmark record for {ref}.")
+
+
+def compare_history(history='output/benchmark/history.json', base=None, head=None):
+    """
+    Compare two benchmark records, by default the last two.
+    Prints the relative changes per point and returns the regressions
+    as [(point, metric, base value, head value)].
+    """
+    records = load_history(history)
+    if len(records) < 2 and not (base and head):
+        raise ValueError(f"Need at least two records in {history} to compare.")
+
+    base = find_record(records, base) if base else records[-2]
+    head = find_record(records, head) if head else records[-1]
+
+    if base['host'] != head['host']:
+        logger.warning(
+            f"Comparing runs of different hosts: {base['host']} and {head['host']}"
+        )
+
+    print(f"Comparing {base['commit']} ({base['date']}) to {head['commit']} ({head['date']})")
+    print(f"{'point':<40} {'metric':<14} {'base':>10} {'head':>10} {'change':>8}")
+
+    regressions = []
+    for point, result in head['results'].items():
+        if point not in base['results']:
+            continue
+
+        for metric, threshold in THRESHOLDS.items():
+            old, new = base['results'][point][metric], result[metric]
+            change = (new - old) / old if old else 0.
+
+            # throughput regresses when it drops, the others when they grow
+            regressed = change < threshold if threshold < 0 else change > threshold
+            flag = ' <-- regression' if regressed else ''
+            print(f"{point:<40} {metric:<14} {old:>10.2f} {new:>10.2f} {change:>+8.1%}{flag}")
+
+            if regressed:
+                regressions.append((point, metric, old, new))
+
+    print(f"{len(regressions)} regression(s).")
+
+    return regressions
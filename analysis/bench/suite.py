@@ -0,0 +1,150 @@
+import os
+import time
+import shutil
+import tempfile
+import itertools
+import resource
+import logging
+import multiprocessing
+
+from .dataset import make_dataset, FRIEND_COLUMNS
+from .history import append_record
+
+logger = logging.getLogger(__name__)
+
+# settings varied by the benchmark suite
+MATRIX = {
+    'weights': [1, 10, 50],
+    'friends': [0, 2, 4],
+    'nthreads': [1, 4],
+    'selections': [1, 4],
+}
+
+# small matrix for a quick check
+QUICK_MATRIX = {
+    'weights': [1, 10],
+    'friends': [0, 2],
+    'nthreads': [1],
+    'selections': [1],
+}
+
+HISTS = {
+    'pt_1': {'bins': [20, 25, 125], 'overflow': True},
+    'mt': {'bins': [20, 0, 120], 'overflow': True},
+}
+
+
+def get_points(matrix):
+    """
+    All combinations of the settings in the matrix.
+    """
+    keys = list(matrix.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*matrix.values())]
+
+
+def point_key(point):
+    return '_'.join(f'{k}{v}' for k, v in point.items())
+
+
+def get_friends(point):
+    return list(FRIEND_COLUMNS)[:point['friends']]
+
+
+def get_selections(point):
+    """
+    Selections of a benchmark point. Each weight reads all friends,
+    such that none of them is pruned, and one of the pdf weights.
+    """
+    factors = ''.join(f'*{FRIEND_COLUMNS[f]}' for f in get_friends(point))
+    weights = {
+        f'w{i}': f'genweight{factors}*LHEPdfWeight{i}' for i in range(point['weights'])
+    }
+
+    selections = {}
+    for k in range(point['selections']):
+        selections[f'sel{k}'] = {
+            'definitions': {
+                'mt': 'sqrt(2 * pt_1 * pfmet_uncorrected'
+                      ' * (1 - cos(phi_1 - pfmetphi_uncorrected)))',
+            },
+            'region_selection': {
+                'acceptance': f'pt_1 > {25 + k} && abs(eta_1) < 2.4',
+                'iso': 'iso_1 < 0.15',
+            },
+            'weights': weights,
+            'hists': HISTS,
+        }
+
+    return selections
+
+
+def run_point(point, files, out_dir):
+    """
+    Run the histogram production of one benchmark point.
+    Runs in a fresh process, such that the JIT time and the peak memory
+    are not affected by the other points.
+    """
+    from hist.hist_process import HistMaker
+
+    start = time.time()
+    cpu_start = time.process_time()
+
+    selections = get_selections(point)
+    hist = HistMaker(
+        files=files,
+        cat='bench',
+        proc='bench',
+        friends=get_friends(point),
+        process_selection=['q_1 != 0'],
+        nthreads=point['nthreads'],
+        selections=selections,
+        prune_branches=True
+    )
+    for name, sel in selections.items():
+        hist.make_hists(sel['hists'], name)
+    for name in selections:
+        hist.save_hists(os.path.join(out_dir, f'{name}.root'), 'recreate', name)
+
+    wall = time.time() - start
+    entries = hist.timing['entries']
+
+    return {
+        'wall': wall,
+        'cpu': time.process_time() - cpu_start,
+        'entries': entries,
+        'events_per_s': entries / wall,
+        'loop_events_per_s': entries / max(hist.timing['event_loop'], 1e-9),
+        'jit': hist.timing['jit'],
+        'event_loops': hist.n_event_loops(),
+        # kB on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_suite(matrix=MATRIX, n_events=1000000, data_dir='output/benchmark/data',
+              history='output/benchmark/history.json', label=''):
+    """
+    Run all points of the matrix on the synthetic dataset and append
+    the results to the history.
+    """
+    files = make_dataset(data_dir, n_events)
+    files = [os.path.abspath(f) for f in files]
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for point in get_points(matrix):
+        out_dir = tempfile.mkdtemp(prefix='bench')
+        with context.Pool(1) as pool:
+            results[point_key(point)] = pool.apply(run_point, (point, files, out_dir))
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+        result = results[point_key(point)]
+        logger.info(
+            f"{point_key(point)}: {result['events_per_s']:.0f} events/s,"
+            f" JIT {result['jit']:.2f} s, {result['peak_rss_mb']:.0f} MB,"
+            f" {result['event_loops']} event loop(s)"
+        )
+
+    append_record(history, results, n_events, label)
+
+    return results
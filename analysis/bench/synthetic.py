@@ -0,0 +1,471 @@
+import ROOT
+import os
+import logging
+
+import config as cfg
+
+logger = logging.getLogger(__name__)
+
+BASEPATH = 'output/synthetic/ntuples/2022/'
+
+# kinematics of the generated bosons: mass, width and cross section in pb
+KINDS = {
+    'Z': {'id': 0, 'mass': 91.19, 'width': 2.50, 'xsec': 6000.},
+    'W': {'id': 1, 'mass': 80.37, 'width': 2.09, 'xsec': 60000.},
+    'continuum': {'id': 2, 'mass': 0., 'width': 0., 'xsec': 100.},
+}
+
+SF_FACTORS = ['trk', 'sta', 'id', 'iso', 'trg', 'prefire', 'highiso_iso', 'highiso_trg']
+
+# variations of the muon momentum correction
+LEPTON_VARIATIONS = ['', '_up', '_dn', '_resolup', '_resoldn', '_scaleup', '_scaledn']
+MET_VARIATIONS = ['', '_resolup', '_resoldn', '_scaleup', '_scaledn']
+
+# friends read by the analysis under another name than the corrections
+# write them: {analysis name: corrections name}, linked to the written one
+LINKED_FRIENDS = {'xy': 'metxy'}
+
+ROOT.gInterpreter.Declare("""
+#ifndef SYNTHETIC_GENERATOR
+#define SYNTHETIC_GENERATOR
+namespace synthetic {
+using Vec = ROOT::Math::PtEtaPhiMVector;
+using Vec2 = ROOT::Math::XYVector;
+const double muon_mass = 0.10566;
+
+struct Event {
+    Vec boson, d1, d2;
+};
+
+double mass(int kind, double m, double width) {
+    if (kind == 2) return 12. + gRandom->Exp(50.);
+    double x = 0.;
+    while (x < 12.) x = gRandom->BreitWigner(m, width);
+    return x;
+}
+
+// boson with a falling pt spectrum, decayed isotropically in its rest frame
+Event decay(double m) {
+    double pt = gRandom->Exp(10.);
+    double rap = gRandom->Gaus(0., 1.8);
+    double phi = gRandom->Uniform(-M_PI, M_PI);
+    double mt = std::sqrt(m * m + pt * pt);
+    ROOT::Math::PxPyPzEVector b(
+        pt * std::cos(phi), pt * std::sin(phi), mt * std::sinh(rap), mt * std::cosh(rap)
+    );
+
+    double cost = gRandom->Uniform(-1., 1.), sint = std::sqrt(1. - cost * cost);
+    double phid = gRandom->Uniform(-M_PI, M_PI), p = m / 2.;
+    ROOT::Math::PxPyPzEVector d1(p * sint * std::cos(phid), p * sint * std::sin(phid), p * cost, p);
+    ROOT::Math::PxPyPzEVector d2(-d1.Px(), -d1.Py(), -d1.Pz(), p);
+    ROOT::Math::Boost boost(b.Px() / b.E(), b.Py() / b.E(), b.Pz() / b.E());
+
+    Event event;
+    event.boson = Vec(b.Pt(), b.Eta(), b.Phi(), b.M());
+    event.d1 = Vec(boost(d1).Pt(), boost(d1).Eta(), boost(d1).Phi(), muon_mass);
+    event.d2 = Vec(boost(d2).Pt(), boost(d2).Eta(), boost(d2).Phi(), muon_mass);
+    if (event.d2.Pt() > event.d1.Pt()) std::swap(event.d1, event.d2);
+    return event;
+}
+
+Vec2 transverse(double pt, double phi) {
+    return Vec2(pt * std::cos(phi), pt * std::sin(phi));
+}
+
+Vec2 visible(ROOT::RVecD pt, ROOT::RVecD phi) {
+    Vec2 vis;
+    for (size_t i = 0; i < pt.size(); i++) vis += transverse(pt[i], phi[i]);
+    return vis;
+}
+
+// missing transverse momentum after replacing the muon momenta
+// and scaling the hadronic recoil
+Vec2 met(double met, double metphi, ROOT::RVecD pt, ROOT::RVecD ptc, ROOT::RVecD phi, double scale) {
+    Vec2 recoil = -(transverse(met, metphi) + visible(pt, phi));
+    return -scale * recoil - visible(ptc, phi);
+}
+
+// recoil components parallel (1) and perpendicular (2) to the boson
+double recoil(double met, double metphi, ROOT::RVecD pt, ROOT::RVecD phi, double bphi, int component) {
+    Vec2 u = -(transverse(met, metphi) + visible(pt, phi));
+    Vec2 b = transverse(1., bphi);
+    return component == 1 ? u.Dot(b) : b.X() * u.Y() - b.Y() * u.X();
+}
+
+Vec dimuon(double pt1, double eta1, double phi1, double pt2, double eta2, double phi2) {
+    return Vec(pt1, eta1, phi1, muon_mass) + Vec(pt2, eta2, phi2, muon_mass);
+}
+}
+#endif
+""")
+
+
+def get_kind(sample, channel):
+    """
+    Generated kinematics of a sample.
+    """
+    if 'MLL-10to50' in sample:
+        return 'continuum'
+    if sample.startswith(('DYto2L', 'VBFto2L', 'ZZto')):
+        return 'Z'
+    if sample.startswith(('WtoLNu', 'VBFtoLNu')):
+        return 'W'
+    if 'Muon' in sample:
+        return 'Z' if channel == 'mm' else 'W'
+    return 'continuum'
+
+
+def get_sample_dirs():
+    """
+    Sample directories and channels of all processes in the config.
+    """
+    dirs = set()
+    for region in ['Z', 'Wp']:
+        channel = cfg.samples.get_channel(region)
+        for paths in cfg.samples.get_samples(region).values():
+            for path in paths:
+                dirs.add((path.split('/')[-3], channel))
+
+    return sorted(dirs)
+
+
+def define_event(rdf, kind, channel, is_data):
+    """
+    Generator level boson and reconstructed muons and missing
+    transverse momentum. In the mmet channel the second decay
+    product is the neutrino.
+    """
+    k = KINDS[kind]
+    rdf = rdf.Define('_event', f'synthetic::decay(synthetic::mass({k["id"]}, {k["mass"]}, {k["width"]}))')
+    rdf = rdf.Define('genbosonpt', 'float(_event.boson.Pt())')
+    rdf = rdf.Define('genbosonphi', 'float(_event.boson.Phi())')
+    rdf = rdf.Define('genbosonrapidity', 'float(_event.boson.Rapidity())')
+    rdf = rdf.Define('gen_m_vis', 'float(_event.boson.M())')
+
+    n_muons = 2 if channel == 'mm' else 1
+    for i in range(1, n_muons + 1):
+        rdf = rdf.Define(f'genmatch_pt_{i}', f'float(_event.d{i}.Pt())')
+        rdf = rdf.Define(f'genmatch_eta_{i}', f'float(_event.d{i}.Eta())')
+        rdf = rdf.Define(f'pt_{i}', f'float(genmatch_pt_{i} * gRandom->Gaus(1., 0.015))')
+        rdf = rdf.Define(f'eta_{i}', f'float(genmatch_eta_{i} + gRandom->Gaus(0., 0.001))')
+        rdf = rdf.Define(f'phi_{i}', f'float(_event.d{i}.Phi())')
+        rdf = rdf.Define(f'mass_{i}', 'float(synthetic::muon_mass)')
+        rdf = rdf.Define(f'tightId_{i}', 'gRandom->Rndm() < 0.97')
+        rdf = rdf.Define(f'trg_single_mu24_{i}', f'pt_{i} > 24 && gRandom->Rndm() < 0.9')
+
+    # non-prompt muons populate the anti-isolated region of the qcd estimate
+    non_prompt = 0.3 if is_data or kind == 'continuum' else 0.02
+    rdf = rdf.Define(
+        'iso_1',
+        f'float(gRandom->Rndm() < {non_prompt} ? gRandom->Uniform(0., 1.2) : gRandom->Exp(0.02))'
+    )
+    rdf = rdf.Define('q_1', 'gRandom->Rndm() < 0.5 ? 1 : -1')
+    if channel == 'mm':
+        rdf = rdf.Define('iso_2', 'float(gRandom->Exp(0.02))')
+        rdf = rdf.Define('q_2', 'gRandom->Rndm() < 0.02 ? q_1 : -q_1')
+        rdf = rdf.Define('_vis', 'synthetic::dimuon(pt_1, eta_1, phi_1, pt_2, eta_2, phi_2)')
+        rdf = rdf.Define('m_vis', 'float(_vis.M())')
+        rdf = rdf.Define('pt_vis', 'float(_vis.Pt())')
+        met = 'synthetic::Vec2(gRandom->Gaus(0., 12.), gRandom->Gaus(0., 12.))'
+    else:
+        rdf = rdf.Define('pt_vis', 'pt_1')
+        met = 'synthetic::transverse(_event.d2.Pt(), _event.d2.Phi())'\
+              ' + synthetic::Vec2(gRandom->Gaus(0., 12.), gRandom->Gaus(0., 12.))'
+
+    rdf = rdf.Define('_met', met)
+    rdf = rdf.Define('pfmet_uncorrected', 'float(_met.R())')
+    rdf = rdf.Define('pfmetphi_uncorrected', 'float(_met.Phi())')
+    rdf = rdf.Define('extramuon_veto', 'gRandom->Rndm() < 0.98 ? 1 : 0')
+
+    return rdf
+
+
+def define_event_info(rdf, sample, kind, is_data):
+    """
+    Pileup, run number, generator weights and truth information.
+    """
+    rdf = rdf.Define('npu', 'float(gRandom->Poisson(46.))')
+    rdf = rdf.Define('npvGood', 'int(gRandom->Poisson(0.7 * npu))')
+    rdf = rdf.Define('is_data', f'{int(is_data)}')
+    rdf = rdf.Define('run', 'UInt_t(gRandom->Uniform(355862, 357482))' if is_data else 'UInt_t(1)')
+    rdf = rdf.Define('is_dy_tt', 'gRandom->Rndm() < 0.03 ? 1 : 0' if kind == 'Z' else '0')
+    rdf = rdf.Define(
+        'gen_match_1',
+        {'Z': '13', 'W': 'gRandom->Rndm() < 0.1 ? 15 : 13', 'continuum': '0'}[kind]
+        if not is_data else '0'
+    )
+
+    # about 16% negative weights in the nlo samples
+    if 'amcatnlo' in sample:
+        rdf = rdf.Define('genweight', 'float(gRandom->Rndm() < 0.16 ? -1. : 1.)')
+    else:
+        rdf = rdf.Define('genweight', 'float(1.)')
+
+    for i in range(103):
+        width = 0.005 if i > 100 else 0.01
+        rdf = rdf.Define(
+            f'LHEPdfWeight{i}',
+            'float(1.)' if is_data or i == 0 else f'float(gRandom->Gaus(1., {width}))'
+        )
+    for i in range(9):
+        rdf = rdf.Define(
+            f'LHEScaleWeight{i}',
+            'float(1.)' if is_data or i == 4 else 'float(gRandom->Gaus(1., 0.05))'
+        )
+    for i in range(4):
+        rdf = rdf.Define(
+            f'PSWeight{i}', 'float(1.)' if is_data else 'float(gRandom->Gaus(1., 0.03))'
+        )
+
+    return rdf
+
+
+def define_friends(rdf, channel, is_data, sumw, xsec):
+    """
+    Columns of the correction friends. The momentum corrections are
+    deterministic functions of the ntuple columns, the scale factors
+    are smeared around typical values.
+    """
+    for factor in SF_FACTORS:
+        sf = f'sf_{factor}'
+        rdf = rdf.Define(sf, 'float(1.)' if is_data else 'float(gRandom->Gaus(0.98, 0.01))')
+        rdf = rdf.Define(f'{sf}_up', f'float({sf} + 0.005)')
+        rdf = rdf.Define(f'{sf}_dn', f'float({sf} - 0.005)')
+
+    for postfix in ['', '_bcd']:
+        rdf = rdf.Define(f'pog_puweight{postfix}', 'float(0.5 + npu / 92.)')
+        rdf = rdf.Define(f'pog_puweightUp{postfix}', 'float(0.3 + npu / 65.7)')
+        rdf = rdf.Define(f'pog_puweightDn{postfix}', 'float(0.7 + npu / 153.3)')
+
+    rdf = rdf.Define('ptweight', 'float(1. + 0.05 * tanh((genbosonpt - 20.) / 20.))')
+    rdf = rdf.Define('ptweightUp', 'float(ptweight * 1.02)')
+    rdf = rdf.Define('ptweightDn', 'float(ptweight * 0.98)')
+
+    rdf = rdf.Define('sumwWeight', f'float({1. / sumw})')
+    rdf = rdf.Define('crossSectionPerEventWeight', f'float({xsec})')
+
+    rdf = rdf.Define('pfmet_xycorr', 'float(pfmet_uncorrected * 0.99)')
+    rdf = rdf.Define('pfmetphi_xycorr', 'pfmetphi_uncorrected')
+
+    n_muons = 2 if channel == 'mm' else 1
+    muons = range(1, n_muons + 1)
+    pts = 'ROOT::RVecD{' + ', '.join(f'pt_{i}' for i in muons) + '}'
+    phis = 'ROOT::RVecD{' + ', '.join(f'phi_{i}' for i in muons) + '}'
+
+    # the boson is approximated by the leading muon in data
+    if is_data:
+        rdf = rdf.Define('bosonpt', 'pt_vis')
+        rdf = rdf.Define('bosonphi', 'phi_1')
+        rdf = rdf.Define('bosonrap', 'eta_1')
+    else:
+        rdf = rdf.Define('bosonpt', 'genbosonpt')
+        rdf = rdf.Define('bosonphi', 'genbosonphi')
+        rdf = rdf.Define('bosonrap', 'genbosonrapidity')
+    for component in [1, 2]:
+        rdf = rdf.Define(
+            f'pfuP{component}_uncorrected',
+            f'float(synthetic::recoil(pfmet_uncorrected, pfmetphi_uncorrected, {pts}, {phis}, bosonphi, {component}))'
+        )
+
+    shifts = {
+        '': '1.', '_up': '1.0005', '_dn': '0.9995', '_scaleup': '1.001', '_scaledn': '0.999',
+    }
+    for var in LEPTON_VARIATIONS:
+        for i in muons:
+            nominal = f'pt_{i} * (1. + 0.002 * q_{i} * sin(phi_{i}))'
+            if var in shifts:
+                rdf = rdf.Define(f'pt_{i}_corr{var}', f'float({nominal} * {shifts[var]})')
+            else:
+                sign = '+' if var == '_resolup' else '-'
+                rdf = rdf.Define(
+                    f'pt_{i}_corr{var}',
+                    f'float({nominal} {sign} 0.3 * ({nominal} - genmatch_pt_{i}))'
+                    if not is_data else f'float({nominal})'
+                )
+
+        if channel == 'mm':
+            rdf = rdf.Define(
+                f'_vis_corr{var}',
+                f'synthetic::dimuon(pt_1_corr{var}, eta_1, phi_1, pt_2_corr{var}, eta_2, phi_2)'
+            )
+        else:
+            rdf = rdf.Define(
+                f'_vis_corr{var}',
+                f'synthetic::Vec(pt_1_corr{var}, eta_1, phi_1, synthetic::muon_mass)'
+            )
+        for q, f in [('m', 'M'), ('pt', 'Pt'), ('phi', 'Phi'), ('rap', 'Rapidity')]:
+            rdf = rdf.Define(f'{q}_vis_corr{var}', f'float(_vis_corr{var}.{f}())')
+
+        ptcs = 'ROOT::RVecD{' + ', '.join(f'pt_{i}_corr{var}' for i in muons) + '}'
+        rdf = rdf.Define(
+            f'_met_lepcorr{var}',
+            f'synthetic::met(pfmet_xycorr, pfmetphi_xycorr, {pts}, {ptcs}, {phis}, 1.)'
+        )
+        rdf = rdf.Define(f'pfmet_lepcorr{var}', f'float(_met_lepcorr{var}.R())')
+        rdf = rdf.Define(f'pfmetphi_lepcorr{var}', f'float(_met_lepcorr{var}.Phi())')
+
+        # the recoil correction scales the hadronic response in simulation
+        if var in MET_VARIATIONS:
+            rdf = rdf.Define(
+                f'_met_corr{var}',
+                f'synthetic::met(pfmet_xycorr, pfmetphi_xycorr, {pts}, {ptcs}, {phis}, {1. if is_data else 1.02})'
+            )
+            rdf = rdf.Define(f'pfmet_corr{var}', f'float(_met_corr{var}.R())')
+            rdf = rdf.Define(f'pfmetphi_corr{var}', f'float(_met_corr{var}.Phi())')
+
+    return rdf
+
+
+def get_columns(channel):
+    """
+    Columns of the ntuple and of each friend in a channel. The xy friend
+    is written as metxy by the corrections and read as xy by the analysis
+    (see LINKED_FRIENDS).
+    """
+    n_muons = 2 if channel == 'mm' else 1
+    muons = range(1, n_muons + 1)
+
+    ntuple = [
+        'genbosonpt', 'genbosonphi', 'genbosonrapidity', 'gen_m_vis',
+        'iso_1', 'q_1', 'pt_vis', 'pfmet_uncorrected', 'pfmetphi_uncorrected',
+        'extramuon_veto', 'npu', 'npvGood', 'is_data', 'run', 'is_dy_tt',
+        'gen_match_1', 'genweight',
+    ]
+    for i in muons:
+        ntuple += [
+            f'{c}_{i}' for c in [
+                'genmatch_pt', 'genmatch_eta', 'pt', 'eta', 'phi', 'mass',
+                'tightId', 'trg_single_mu24',
+            ]
+        ]
+    if channel == 'mm':
+        ntuple += ['iso_2', 'q_2', 'm_vis']
+    ntuple += [f'LHEPdfWeight{i}' for i in range(103)]
+    ntuple += [f'LHEScaleWeight{i}' for i in range(9)]
+    ntuple += [f'PSWeight{i}' for i in range(4)]
+
+    sf = []
+    for factor in SF_FACTORS:
+        sf += [f'sf_{factor}', f'sf_{factor}_up', f'sf_{factor}_dn']
+
+    lepton = [
+        'pfuP1_uncorrected', 'pfuP2_uncorrected', 'bosonpt', 'bosonphi', 'bosonrap',
+    ]
+    for var in LEPTON_VARIATIONS:
+        lepton += [f'pt_{i}_corr{var}' for i in muons]
+        lepton += [f'{q}_vis_corr{var}' for q in ['m', 'pt', 'phi', 'rap']]
+        lepton += [f'pfmet_lepcorr{var}', f'pfmetphi_lepcorr{var}']
+
+    met_punom = []
+    for var in MET_VARIATIONS:
+        met_punom += [f'pfmet_corr{var}', f'pfmetphi_corr{var}']
+
+    friends = {
+        'sf': sf,
+        'metxy': ['pfmet_xycorr', 'pfmetphi_xycorr'],
+        'pu': [
+            f'pog_puweight{v}{p}' for p in ['', '_bcd'] for v in ['', 'Up', 'Dn']
+        ],
+        'ptweight': ['ptweight', 'ptweightUp', 'ptweightDn'],
+        'xsec': ['sumwWeight', 'crossSectionPerEventWeight'],
+        'lepton': lepton,
+        'met_punom': met_punom,
+    }
+
+    return ntuple, friends
+
+
+def write_file(f, sample, channel, n_events, sumw, seed):
+    """
+    Write one ntuple file and all its friends in a single event loop,
+    such that the friends are aligned with the ntuple.
+    """
+    kind = get_kind(sample, channel)
+    is_data = 'Muon' in sample
+    ROOT.gRandom.SetSeed(seed)
+
+    rdf = ROOT.RDataFrame(n_events)
+    rdf = define_event(rdf, kind, channel, is_data)
+    rdf = define_event_info(rdf, sample, kind, is_data)
+    rdf = define_friends(rdf, channel, is_data, sumw, KINDS[kind]['xsec'])
+
+    # preselection of the ntuple production
+    if channel == 'mm':
+        rdf = rdf.Filter('pt_1 > 20 && pt_2 > 10 && abs(eta_1) < 2.5 && abs(eta_2) < 2.5')
+    else:
+        rdf = rdf.Filter('pt_1 > 20 && abs(eta_1) < 2.5')
+
+    ntuple, friends = get_columns(channel)
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fLazy = True
+
+    snapshots = [rdf.Snapshot('ntuple', f, ntuple, opts)]
+    for friend, columns in friends.items():
+        f_friend = f.replace('ntuples', f'friends/{friend}')
+        os.makedirs(os.path.dirname(f_friend), exist_ok=True)
+        snapshots.append(rdf.Snapshot('ntuple', f_friend, columns, opts))
+
+    ROOT.RDF.RunGraphs(snapshots)
+
+    for link, friend in LINKED_FRIENDS.items():
+        f_link = f.replace('ntuples', f'friends/{link}')
+        os.makedirs(os.path.dirname(f_link), exist_ok=True)
+        if os.path.lexists(f_link):
+            os.remove(f_link)
+        os.symlink(
+            os.path.relpath(f.replace('ntuples', f'friends/{friend}'),
+                            os.path.dirname(f_link)),
+            f_link
+        )
+
+    return f
+
+
+def make_sample(sample, channel, basepath=BASEPATH, n_events=100000, n_files=1, seed=42):
+    """
+    Write the files of one sample directory:
+    {basepath}{sample}/{channel}/{sample}_{i}.root and the friends
+    obtained by replacing 'ntuples' with 'friends/{friend}'.
+    Returns the list of ntuple files.
+    """
+    out_dir = os.path.join(basepath, sample, channel)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # expected sum of generator weights for the normalization
+    sumw = n_events * (0.68 if 'amcatnlo' in sample else 1.)
+
+    files = []
+    n_per_file = n_events // n_files
+    for i in range(n_files):
+        f = os.path.join(out_dir, f'{sample}_{i}.root')
+        files.append(write_file(f, sample, channel, n_per_file, sumw, seed + i))
+
+    return files
+
+
+def make_samples(basepath=BASEPATH, n_events=100000, n_files=1, channels=['mm', 'mmet'], seed=42):
+    """
+    Write a synthetic dataset with the production schema for all
+    sample directories of the config. The analysis and the corrections
+    are pointed to it with the SAMPLES_BASEPATH and CORRECTIONS_INPATH
+    environment variables.
+    """
+    if 'ntuples' not in basepath:
+        raise ValueError(f"The base path {basepath} needs to contain 'ntuples' for the friends.")
+
+    files = []
+    for sample, channel in get_sample_dirs():
+        if channel not in channels:
+            continue
+
+        logger.info(f"Writing {n_events} events of {sample} ({channel})")
+        files += make_sample(sample, channel, basepath, n_events, n_files, seed)
+        seed += n_files
+
+    logger.info(
+        f"Wrote {len(files)} files. Use them with "
+        f"SAMPLES_BASEPATH={os.path.abspath(basepath)}/ and "
+        f"CORRECTIONS_INPATH='{os.path.abspath(basepath)}/*/*/*.root'"
+    )
+
+    return files
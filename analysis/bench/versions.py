@@ -0,0 +1,173 @@
+import os
+import logging
+import matplotlib.pyplot as plt
+
+from hist.metrics import collect_metrics
+
+logger = logging.getLogger(__name__)
+
+# relative changes plotted per job
+METRICS = ['events_per_s', 'peak_rss_mb', 'mb_read']
+
+
+def get_commit(version):
+    """
+    Commit of a version from output/{version}/info.txt.
+    """
+    info = f'output/{version}/info.txt'
+    if not os.path.isfile(info):
+        return 'unknown'
+
+    with open(info, 'r') as f:
+        for line in f:
+            if line.startswith('Commit hash:'):
+                return line.split(':', 1)[1].strip()[:10]
+
+    return 'unknown'
+
+
+def job_key(record):
+    return (record['region'], record['variation'], record['proc'], record['cat'])
+
+
+def load_jobs(version):
+    """
+    Metrics of the histogram jobs of a version, keyed by
+    (region, variation, process, category). Split jobs are summed up,
+    the peak memory is the maximum of the parts.
+    """
+    jobs = {}
+    for record in collect_metrics(f'output/{version}/batch_jobs'):
+        if 'proc' not in record:
+            continue
+
+        key = job_key(record)
+        job = jobs.setdefault(key, {
+            'wall': 0., 'cpu': 0., 'entries': 0, 'bytes': 0,
+            'peak_rss_mb': 0., 'parts': 0,
+        })
+        job['wall'] += record['wall']
+        job['cpu'] += record['cpu']
+        job['entries'] += record.get('entries', 0)
+        job['bytes'] += sum(record.get('bytes_read', {}).values())
+        job['peak_rss_mb'] = max(job['peak_rss_mb'], record['peak_rss_mb'])
+        job['parts'] += 1
+
+    for job in jobs.values():
+        job['events_per_s'] = job['entries'] / job['wall'] if job['wall'] else 0.
+        job['mb_read'] = job['bytes'] / 1024**2
+
+    return jobs
+
+
+def relative_change(old, new):
+    return (new - old) / old if old else 0.
+
+
+def compare_versions(versions, threshold=10., plot_path=None):
+    """
+    Compare the job metrics of several versions to the first one.
+    Jobs are matched by (region, variation, process, category).
+    Jobs which got more than threshold percent slower are flagged.
+    Returns the flagged jobs as [(version, key, base wall, wall)].
+    """
+    if len(versions) < 2:
+        raise ValueError("Need at least two versions to compare.")
+
+    jobs = {version: load_jobs(version) for version in versions}
+    base = versions[0]
+
+    flagged = []
+    changes = {}
+    for version in versions[1:]:
+        common = sorted(set(jobs[base]) & set(jobs[version]))
+        missing = set(jobs[base]) ^ set(jobs[version])
+        if missing:
+            logger.warning(
+                f"{len(missing)} jobs only in one of {base} and {version}."
+            )
+
+        print(
+            f"\n{base} ({get_commit(base)}) -> {version} ({get_commit(version)}):"
+            f" {len(common)} matched jobs"
+        )
+        print(
+            f"{'job':<50} {'wall':>8} {'change':>8} {'events/s':>10}"
+            f" {'RSS MB':>8} {'read MB':>9}"
+        )
+
+        changes[version] = {}
+        for key in common:
+            old, new = jobs[base][key], jobs[version][key]
+            slower = relative_change(old['wall'], new['wall'])
+            changes[version][key] = {
+                metric: relative_change(old[metric], new[metric]) for metric in METRICS
+            }
+
+            flag = ''
+            if slower * 100 > threshold:
+                flag = ' <-- slower'
+                flagged.append((version, key, old['wall'], new['wall']))
+
+            name = '/'.join(key)
+            print(
+                f"{name[-50:]:<50} {new['wall']:>8.1f} {slower:>+8.1%}"
+                f" {relative_change(old['events_per_s'], new['events_per_s']):>+10.1%}"
+                f" {relative_change(old['peak_rss_mb'], new['peak_rss_mb']):>+8.1%}"
+                f" {relative_change(old['mb_read'], new['mb_read']):>+9.1%}{flag}"
+            )
+
+        total_old = sum(jobs[base][key]['wall'] for key in common)
+        total_new = sum(jobs[version][key]['wall'] for key in common)
+        print(
+            f"Total wall time of the matched jobs: {total_old / 3600:.2f} h ->"
+            f" {total_new / 3600:.2f} h ({relative_change(total_old, total_new):+.1%})"
+        )
+
+    print(f"\n{len(flagged)} job(s) more than {threshold:.0f}% slower.")
+
+    if plot_path is None:
+        plot_path = f"output/{versions[-1]}/performance_vs_{base}.png"
+    plot_changes(changes, base, plot_path)
+
+    return flagged
+
+
+def plot_changes(changes, base, plot_path):
+    """
+    Relative changes of throughput, memory and bytes read per job
+    with respect to the base version.
+    """
+    keys = sorted(set(k for c in changes.values() for k in c))
+    if not keys:
+        logger.warning("No matched jobs to plot.")
+        return
+
+    fig, axes = plt.subplots(
+        len(METRICS), 1, figsize=(max(8, 0.3 * len(keys)), 3 * len(METRICS)),
+        sharex=True
+    )
+    width = 0.8 / len(changes)
+    for i, metric in enumerate(METRICS):
+        ax = axes[i]
+        for j, (version, change) in enumerate(changes.items()):
+            ax.bar(
+                [x + j * width for x in range(len(keys))],
+                [100 * change.get(key, {}).get(metric, 0.) for key in keys],
+                width=width, label=version
+            )
+        ax.axhline(0, color='black', linewidth=0.8)
+        ax.set_ylabel(f'{metric} [%]')
+
+    axes[0].set_title(f'Change with respect to {base}')
+    axes[0].legend()
+    axes[-1].set_xticks([x + 0.4 - width / 2 for x in range(len(keys))])
+    axes[-1].set_xticklabels(['/'.join(key) for key in keys], rotation=90, fontsize=6)
+
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(plot_path) or '.', exist_ok=True)
+    fig.savefig(plot_path)
+    plt.close(fig)
+    logger.info(f"Saved performance comparison to {plot_path}")
+
+    return
@@ -0,0 +1,133 @@
+from argparse import ArgumentParser
+import sys
+
+import main_setup.logger as setup_logger
+from bench import run_suite, compare_history, make_samples
+from bench.synthetic import BASEPATH
+from bench.versions import compare_versions
+from bench.suite import MATRIX, QUICK_MATRIX
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmarks of the histogram production")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="run the benchmark suite")
+    run.add_argument(
+        '--quick',
+        action='store_true',
+        default=False,
+        help="run a small subset of the settings"
+    )
+    run.add_argument(
+        '--events',
+        type=int,
+        default=1000000,
+        help="number of events of the synthetic dataset"
+    )
+    run.add_argument(
+        '--label',
+        type=str,
+        default='',
+        help="label of the run in the history"
+    )
+
+    compare = subparsers.add_parser(
+        'compare', help="compare two runs and flag regressions"
+    )
+    compare.add_argument(
+        '--base',
+        type=str,
+        default=None,
+        help="commit or label of the reference run (default: second to last)"
+    )
+    compare.add_argument(
+        '--head',
+        type=str,
+        default=None,
+        help="commit or label of the new run (default: last)"
+    )
+
+    generate = subparsers.add_parser(
+        'generate', help="write a synthetic dataset with the production schema"
+    )
+    generate.add_argument(
+        '--events',
+        type=int,
+        default=100000,
+        help="number of generated events per sample"
+    )
+    generate.add_argument(
+        '--files',
+        type=int,
+        default=1,
+        help="number of files per sample"
+    )
+    generate.add_argument(
+        '--channels',
+        nargs='+',
+        default=['mm', 'mmet'],
+        choices=['mm', 'mmet'],
+        help="channels to generate"
+    )
+    generate.add_argument(
+        '--basepath',
+        type=str,
+        default=BASEPATH,
+        help="output directory of the ntuples, has to contain 'ntuples'"
+    )
+
+    versions = subparsers.add_parser(
+        'versions', help="compare the job metrics of production versions"
+    )
+    versions.add_argument(
+        'versions',
+        nargs='+',
+        help="versions to compare, the first one is the reference"
+    )
+    versions.add_argument(
+        '--threshold',
+        type=float,
+        default=10.,
+        help="flag jobs which got more than this percentage slower"
+    )
+    versions.add_argument(
+        '--plot',
+        type=str,
+        default=None,
+        help="path of the plot (default: output/{last version}/performance_vs_{first version}.png)"
+    )
+
+    for p in [run, compare]:
+        p.add_argument(
+            '--history',
+            type=str,
+            default='output/benchmark/history.json',
+            help="json file with the benchmark history"
+        )
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    setup_logger.setup()
+
+    if args.command == 'run':
+        run_suite(
+            QUICK_MATRIX if args.quick else MATRIX,
+            n_events=args.events,
+            history=args.history,
+            label=args.label
+        )
+
+    elif args.command == 'compare':
+        regressions = compare_history(args.history, args.base, args.head)
+        sys.exit(1 if regressions else 0)
+
+    elif args.command == 'versions':
+        flagged = compare_versions(args.versions, args.threshold, args.plot)
+        sys.exit(1 if flagged else 0)
+
+    elif args.command == 'generate':
+        make_samples(args.basepath, args.events, args.files, args.channels)
@@ -12,4 +12,22 @@ def get_definitions(variation):
         'pfmt'+postfix: f'sqrt(2 * pfmet{postfix} * pt_1{postfix} * (1 - cos(phi_1 - pfmetphi{postfix})))',
     }
     
-    return definitions
\ No newline at end of file
+    return definitions
+
+
+def get_momentum_variations(region):
+    """
+    Get the columns shifted by the muon momentum scale and resolution
+    variations. The shifted columns are named {column}_{variation}{up/dn}.
+    """
+    if region == 'Z':
+        columns = ['pt_1_corr', 'pt_2_corr', 'm_vis_corr']
+    elif region in ['Wp', 'Wm']:
+        columns = ['pt_1_corr', 'pfmet_corr', 'pfmetphi_corr']
+    else:
+        raise ValueError(f"Unknown region: {region}")
+
+    return {
+        'scale': columns,
+        'resol': columns,
+    }
@@ -1,12 +1,28 @@
-def get_samples(region):
+import os
+
 
+def get_channel(region):
+    """
+    Get the ntuple channel of a region.
+    """
     if region=='Z':
-        channel = 'mm'
+        return 'mm'
     elif region=='Wp' or region=='Wm':
-        channel = 'mmet'
+        return 'mmet'
+    else:
+        raise ValueError(f"Unknown region: {region}")
+
+
+def get_samples(region):
+
+    channel = get_channel(region)
 
 
-    basepath = '/ceph/jdriesch/CROWN_samples/RerecoRun3_Nanov12_04/ntuples/2022/'
+    # can be pointed to a synthetic dataset (see bench/synthetic.py)
+    basepath = os.environ.get(
+        'SAMPLES_BASEPATH',
+        '/ceph/jdriesch/CROWN_samples/RerecoRun3_Nanov12_04/ntuples/2022/'
+    )
 
     sample_tmpl = '{}_TuneCP5_13p6TeV_{}-pythia8_Run3Summer22NanoAODv12-130X'
 
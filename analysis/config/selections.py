@@ -49,7 +49,8 @@ def get_region_selections(args):
     if not args.noNom:
         variations.append("Nominal")
     
-    if not args.noPtVar:
+    # with vary, the pt variations are derived in the Nominal jobs
+    if not args.noPtVar and not args.vary:
         variations += ["scaleup", "scaledn", "resolup", "resoldn"]
 
     for region in ["Z", "Wp", "Wm"]:
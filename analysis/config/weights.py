@@ -1,6 +1,63 @@
-def get_weights(proc, variation=''):
+def get_weight_factors(proc, variation=''):
+    """
+    Get the weight variations which are multiplicative factors
+    on top of the nominal weight (pdf, scale and parton shower).
+    """
+    if proc in ['Data', 'VV', 'VBF'] or variation != 'Nominal':
+        return {}
+
+    factors = {}
+
+    # variations of pdfs
+    for i in range(1, 101):
+        factors[f'LHEPdfWeight{i}Up'] = f'LHEPdfWeight{i}'
+        factors[f'LHEPdfWeight{i}Down'] = f'(2.-LHEPdfWeight{i})'
+
+    # variations of scales
+    factors['LHEPdfWeightAlphaSUp'] = 'LHEPdfWeight102'
+    factors['LHEPdfWeightAlphaSDown'] = 'LHEPdfWeight101'
+    factors['LHEScaleWeightMUFUp'] = 'LHEScaleWeight4'
+    factors['LHEScaleWeightMUFDown'] = 'LHEScaleWeight3'
+    factors['LHEScaleWeightMURUp'] = 'LHEScaleWeight6'
+    factors['LHEScaleWeightMURDown'] = 'LHEScaleWeight1'
+    factors['LHEScaleWeightMUFMURUp'] = 'LHEScaleWeight7'
+    factors['LHEScaleWeightMUFMURDown'] = 'LHEScaleWeight0'
+
+    # parton shower variations
+    factors['PSWeightISRUp'] = 'PSWeight0'
+    factors['PSWeightISRDown'] = 'PSWeight2'
+    factors['PSWeightFSRUp'] = 'PSWeight1'
+    factors['PSWeightFSRDown'] = 'PSWeight3'
+
+    return factors
+
+
+# columns of the weight friend (corrections/correct.py --weights)
+# and the variations whose nominal weight they are
+NOMINAL_WEIGHTS = {
+    'weight_nominal': 'Nominal',
+    'weight_nominal_highiso': 'iso',
+}
+
+
+def get_nominal_weights():
+    """
+    Get the expressions of the nominal weights of the weight friend.
+    """
+    return {
+        column: get_weights('MC', variation, factors=False)['Nominal']
+        for column, variation in NOMINAL_WEIGHTS.items()
+    }
+
+
+def get_weights(proc, variation='', factors=True, materialized=False):
     """
     Get the weights only if the postfix is empty.
+    If factors is False, the multiplicative variations from
+    get_weight_factors are not included.
+    If materialized is True, the nominal weight is read from the weight
+    friend (corrections/correct.py --weights) and the variations are given as
+    the nominal weight times the ratio of the varied and nominal factor.
     """
     if proc == 'Data':
         return {'Nominal': '1.0'}
@@ -14,6 +71,14 @@ def get_weights(proc, variation=''):
         sfweight = '*sf_trk*sf_sta*sf_id*sf_iso*sf_trg*sf_prefire'
 
     nominal = baseweight+evtweight+sfweight
+    if materialized:
+        nominal = 'weight_nominal_highiso' if 'iso' in variation else 'weight_nominal'
+
+    def vary(var, varied):
+        if materialized:
+            # the variation vanishes where the nominal factor does
+            return f'{nominal}*({var} != 0 ? {varied}/{var} : 0.)'
+        return nominal.replace(var, varied)
 
     weight_variations = {
         'Nominal': nominal
@@ -24,36 +89,19 @@ def get_weights(proc, variation=''):
 
     # variations of efficiency scale factors
     for var in sfweight.split('*')[1:]:
-        weight_variations[var+'Up'] = nominal.replace(var, var+'_up')
-        weight_variations[var+'Down'] = nominal.replace(var, var+'_dn')
+        weight_variations[var+'Up'] = vary(var, var+'_up')
+        weight_variations[var+'Down'] = vary(var, var+'_dn')
 
     # variations of pileup and pt weights
     for var in ['pog_puweight', 'ptweight']:
-        weight_variations[var+'Up'] = nominal.replace(var, var+'Up')
-        weight_variations[var+'Down'] = nominal.replace(var, var+'Dn')
+        weight_variations[var+'Up'] = vary(var, var+'Up')
+        weight_variations[var+'Down'] = vary(var, var+'Dn')
 
-    if proc in ['VV', 'VBF']:
+    if not factors:
         return weight_variations
-    
-    # variations of pdfs
-    for i in range(1, 101):
-        weight_variations[f'LHEPdfWeight{i}Up'] = nominal+f'*LHEPdfWeight{i}'
-        weight_variations[f'LHEPdfWeight{i}Down'] = nominal+f'*(2.-LHEPdfWeight{i})'
 
-    # variations of scales
-    weight_variations['LHEPdfWeightAlphaSUp'] = nominal+'*LHEPdfWeight102'
-    weight_variations['LHEPdfWeightAlphaSDown'] = nominal+'*LHEPdfWeight101'
-    weight_variations['LHEScaleWeightMUFUp'] = nominal+'*LHEScaleWeight4'
-    weight_variations['LHEScaleWeightMUFDown'] = nominal+'*LHEScaleWeight3'
-    weight_variations['LHEScaleWeightMURUp'] = nominal+'*LHEScaleWeight6'
-    weight_variations['LHEScaleWeightMURDown'] = nominal+'*LHEScaleWeight1'
-    weight_variations['LHEScaleWeightMUFMURUp'] = nominal+'*LHEScaleWeight7'
-    weight_variations['LHEScaleWeightMUFMURDown'] = nominal+'*LHEScaleWeight0'
-
-    # parton shower variations
-    weight_variations['PSWeightISRUp'] = nominal+'*PSWeight0'
-    weight_variations['PSWeightISRDown'] = nominal+'*PSWeight2'
-    weight_variations['PSWeightFSRUp'] = nominal+'*PSWeight1'
-    weight_variations['PSWeightFSRDown'] = nominal+'*PSWeight3'
+    # variations of pdfs, scales and parton shower
+    for name, factor in get_weight_factors(proc, variation).items():
+        weight_variations[name] = nominal+'*'+factor
 
-    return weight_variations
\ No newline at end of file
+    return weight_variations
@@ -1 +1,3 @@
-from .runner import run_qcd, run_production
\ No newline at end of file
+from .runner import run_qcd, run_production, run_catalog, run_skim
+from .merge import run_merge
+from .metrics import report_metrics
@@ -0,0 +1,177 @@
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'output/cache'
+
+# option keys which do not change the content of the results
+OUTPUT_KEYS = [
+    'save_path', 'merge_path', 'cache', 'compiled', 'nthreads', 'filter_stats'
+]
+
+
+@lru_cache(maxsize=None)
+def code_revision():
+    """
+    Revision of the analysis code: the git commit and a hash of the
+    uncommitted changes. None if it can not be determined.
+    """
+    code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        head = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=code_dir,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        diff = subprocess.run(
+            ['git', 'diff', 'HEAD', '--', '.'], cwd=code_dir,
+            capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        logger.warning("Could not determine the code revision. Not caching.")
+        return None
+
+    return f'{head}-{hashlib.sha1(diff.encode()).hexdigest()[:12]}'
+
+
+def get_input_files(option):
+    """
+    All files read by a job: the ntuples and their friends.
+    """
+    files = list(option['files'])
+    for f in option['files']:
+        files += [
+            f.replace('ntuples', f'friends/{friend}')
+            for friend in option['friends'] + ['merged']
+        ]
+
+    return files
+
+
+def job_key(option):
+    """
+    Content hash of a job: its options without the output paths,
+    the modification times of the inputs and the code revision.
+    Returns None if the code revision is unknown.
+    """
+    revision = code_revision()
+    if revision is None:
+        return None
+
+    content = {k: v for k, v in option.items() if k not in OUTPUT_KEYS}
+    if 'selections' in option:
+        content['selections'] = {
+            name: {k: v for k, v in sel.items() if k not in OUTPUT_KEYS}
+            for name, sel in option['selections'].items()
+        }
+
+    mtimes = {
+        f: os.path.getmtime(f) if os.path.exists(f) else None
+        for f in get_input_files(option)
+    }
+
+    key = json.dumps(
+        {'option': content, 'inputs': mtimes, 'revision': revision},
+        sort_keys=True
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def add_cache_key(option, cache_dir=CACHE_DIR):
+    """
+    Add the cache key and directory to the option of a job,
+    such that the job stores its results in the cache.
+    """
+    key = job_key(option)
+    if key is not None:
+        option['cache'] = {'key': key, 'dir': os.path.abspath(cache_dir)}
+
+    return option
+
+
+def cached_paths(option):
+    """
+    Paths of the cached results of a job, {save path: cached path}.
+    """
+    cache = option['cache']
+    result_dir = os.path.join(cache['dir'], cache['key'][:2], cache['key'])
+
+    selections = option['selections'] if 'selections' in option \
+        else {option.get('selection', 'Nominal'): option}
+
+    return {
+        sel['save_path']: os.path.join(result_dir, f'{name}.root')
+        for name, sel in selections.items()
+    }
+
+
+def is_cached(option):
+    """
+    Check if all results of a job are in the cache.
+    """
+    if 'cache' not in option:
+        return False
+
+    return all(os.path.isfile(p) for p in cached_paths(option).values())
+
+
+def link_file(source, target):
+    """
+    Hard link the source to the target, copy if linking is not possible.
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+    return
+
+
+def restore_cached(option_dicts):
+    """
+    Link the cached results of all jobs to their output paths.
+    Returns the indices of the jobs which have to be run.
+    """
+    missing = []
+    for i, option in enumerate(option_dicts):
+        if not is_cached(option):
+            missing.append(i)
+            continue
+
+        for save_path, cached in cached_paths(option).items():
+            link_file(cached, save_path)
+
+    logger.info(
+        f"Found {len(option_dicts) - len(missing)} of {len(option_dicts)}"
+        f" jobs in the cache."
+    )
+
+    return missing
+
+
+def store_result(option):
+    """
+    Copy the results of a finished job into the cache.
+    """
+    if 'cache' not in option:
+        return
+
+    for save_path, cached in cached_paths(option).items():
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+
+        # copy and rename, such that no partial file is ever in the cache
+        tmp = f'{cached}.tmp{os.getpid()}'
+        shutil.copy2(save_path, tmp)
+        os.replace(tmp, cached)
+
+    logger.debug(f"Stored results of job {option['cache']['key']} in the cache.")
+
+    return
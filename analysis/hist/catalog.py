@@ -0,0 +1,233 @@
+import ROOT
+from glob import glob, has_magic
+import os
+import json
+import sqlite3
+import logging
+
+from .filters import measure_filters
+
+logger = logging.getLogger(__name__)
+
+
+class SampleCatalog:
+    """
+    Persistent index of the input samples.
+    Stores the resolved file lists of the sample patterns and, per file,
+    the tree entries, basket sizes, sum of genweights and available friends.
+    The measured pass fractions and costs of filters are stored per sample.
+    Entries are refreshed incrementally when the modification time changes.
+    """
+
+    def __init__(self, path='output/catalog.sqlite'):
+        """
+        Open (or create) the catalog.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS patterns ("
+            " pattern TEXT PRIMARY KEY, dir_mtime REAL, files TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, mtime REAL, size INTEGER,"
+            " entries INTEGER, zip_bytes INTEGER, tot_bytes INTEGER,"
+            " sumw REAL, friends TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS filters ("
+            " path TEXT, filter TEXT, mtime REAL, pass REAL, cost REAL,"
+            " PRIMARY KEY (path, filter))"
+        )
+        self.db.commit()
+
+        return
+
+
+    def resolve(self, pattern):
+        """
+        Get the files matching a glob pattern.
+        The result is cached as long as the directory is unchanged.
+        """
+        directory = os.path.dirname(pattern)
+
+        # patterns with wildcards in the directory are always expanded
+        if has_magic(directory) or not os.path.isdir(directory):
+            return sorted(glob(pattern))
+
+        dir_mtime = os.path.getmtime(directory)
+        row = self.db.execute(
+            "SELECT dir_mtime, files FROM patterns WHERE pattern = ?",
+            (pattern,)
+        ).fetchone()
+
+        if row and row[0] == dir_mtime:
+            return json.loads(row[1])
+
+        files = sorted(glob(pattern))
+        self.db.execute(
+            "REPLACE INTO patterns VALUES (?, ?, ?)",
+            (pattern, dir_mtime, json.dumps(files))
+        )
+        self.db.commit()
+        logger.debug(f"Resolved {pattern} to {len(files)} files.")
+
+        return files
+
+
+    def resolve_all(self, patterns):
+        """
+        Get the files of a list of patterns.
+        """
+        files = []
+        for pattern in patterns:
+            files += self.resolve(pattern)
+
+        return files
+
+
+    def read_file(self, path):
+        """
+        Read the tree information of a single file.
+        """
+        info = {
+            'mtime': os.path.getmtime(path),
+            'size': os.path.getsize(path),
+            'entries': 0,
+            'zip_bytes': 0,
+            'tot_bytes': 0,
+            'sumw': None,
+        }
+
+        tf = ROOT.TFile.Open(path, 'read')
+        if not tf or tf.IsZombie():
+            logger.warning(f"Could not open {path}.")
+            return info
+
+        tree = tf.Get('ntuple')
+        if tree:
+            info['entries'] = int(tree.GetEntries())
+            info['zip_bytes'] = int(tree.GetZipBytes())
+            info['tot_bytes'] = int(tree.GetTotBytes())
+
+            if tree.GetBranch('genweight'):
+                rdf = ROOT.RDataFrame(tree)
+                info['sumw'] = rdf.Sum('genweight').GetValue()
+        tf.Close()
+
+        return info
+
+
+    def get(self, files, friends=[]):
+        """
+        Get the information of the given files, refreshing outdated entries.
+        The availability of friends is checked on every call.
+        """
+        infos = {}
+        for path in files:
+            mtime = os.path.getmtime(path)
+            row = self.db.execute(
+                "SELECT mtime, size, entries, zip_bytes, tot_bytes, sumw"
+                " FROM files WHERE path = ?",
+                (path,)
+            ).fetchone()
+
+            refresh = not row or row[0] != mtime
+            if refresh:
+                logger.debug(f"Refreshing catalog entry of {path}.")
+                info = self.read_file(path)
+            else:
+                keys = ['mtime', 'size', 'entries', 'zip_bytes', 'tot_bytes', 'sumw']
+                info = dict(zip(keys, row))
+
+            info['friends'] = {
+                friend: os.path.isfile(path.replace('ntuples', f'friends/{friend}'))
+                for friend in friends
+            }
+            infos[path] = info
+
+            if not refresh and not friends:
+                continue
+
+            self.db.execute(
+                "REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path, info['mtime'], info['size'], info['entries'],
+                    info['zip_bytes'], info['tot_bytes'], info['sumw'],
+                    json.dumps(info['friends'])
+                )
+            )
+
+        self.db.commit()
+
+        return infos
+
+
+    def entries(self, files):
+        """
+        Get the number of entries of the given files.
+        """
+        return {path: info['entries'] for path, info in self.get(files).items()}
+
+
+    def update(self, samples, friends=[]):
+        """
+        Resolve and refresh all files of the given samples.
+        samples = {process: [patterns]}
+        """
+        for proc, patterns in samples.items():
+            files = self.resolve_all(patterns)
+            infos = self.get(files, friends)
+
+            missing = [
+                f for f, info in infos.items() if not all(info['friends'].values())
+            ]
+            logger.info(
+                f"Catalog of {proc}: {len(files)} files with"
+                f" {sum(info['entries'] for info in infos.values())} entries."
+            )
+            if missing:
+                logger.warning(f"{len(missing)} files of {proc} miss friends.")
+
+        return
+
+
+    def filter_stats(self, files, friends, clauses):
+        """
+        Get the pass fraction and cost of each filter clause for a sample,
+        measured on its first file (see filters.measure_filters).
+        Clauses not measured since the last change of the file are
+        measured now. Returns {clause: [pass fraction, cost]}.
+        """
+        if not files:
+            return {}
+
+        path = files[0]
+        mtime = os.path.getmtime(path)
+
+        stats = {}
+        for clause in clauses:
+            row = self.db.execute(
+                "SELECT mtime, pass, cost FROM filters WHERE path = ? AND filter = ?",
+                (path, clause)
+            ).fetchone()
+            if row and row[0] == mtime:
+                stats[clause] = [row[1], row[2]]
+
+        missing = [c for c in clauses if c not in stats]
+        if not missing:
+            return stats
+
+        logger.info(f"Measuring {len(missing)} filters on {path}.")
+        measured = measure_filters(path, friends, missing)
+        for clause, (passed, cost) in measured.items():
+            self.db.execute(
+                "REPLACE INTO filters VALUES (?, ?, ?, ?, ?)",
+                (path, clause, mtime, passed, cost)
+            )
+        self.db.commit()
+        stats.update(measured)
+
+        return stats
@@ -0,0 +1,305 @@
+import json
+import logging
+from itertools import combinations, product
+
+from .cache import add_cache_key
+from .expressions import parse, to_cpp
+
+logger = logging.getLogger(__name__)
+
+# region selection clauses filled as categorical axes instead of separate
+# jobs: the isolation bins and the muon charge of the W regions
+CATEGORY_KEYS = ['iso', 'add']
+
+# keys of the selection part of a job option
+SELECTION_KEYS = [
+    'definitions', 'region_selection', 'weights', 'weight_factors',
+    'hists', 'save_path', 'merge_path', 'vary',
+]
+
+# keys identifying a job, which do not change its processing
+JOB_KEYS = ['proc', 'cat', 'region', 'variation', 'cache']
+
+# keys merged over the fused jobs
+MERGED_KEYS = ['filter_stats']
+
+# comparisons which are the negation of another one
+NEGATED = {'!=': '==', '<=': '>', '>=': '<'}
+
+# most atoms of two clauses checked to exclude each other
+MAX_ATOMS = 16
+
+
+def fuse_key(option, keys):
+    """
+    Everything that has to agree between jobs filled in one pass:
+    the processing of the job and all clauses except the categories.
+    """
+    job = {
+        k: v for k, v in option.items()
+        if k not in SELECTION_KEYS + JOB_KEYS + MERGED_KEYS
+    }
+    clauses = {
+        k: v for k, v in option['region_selection'].items() if k not in keys
+    }
+
+    return json.dumps({
+        'job': job,
+        'clauses': clauses,
+        'keys': sorted(option['region_selection']),
+        'definitions': option['definitions'],
+        'hists': option['hists'],
+    }, sort_keys=True)
+
+
+def merge_keys(option, group):
+    """
+    Merge the dicts of MERGED_KEYS of the fused jobs into the fused option.
+    """
+    for key in MERGED_KEYS:
+        merged = {}
+        for o in group:
+            merged.update(o.get(key) or {})
+        if merged:
+            option[key] = merged
+
+    return
+
+
+def can_fuse(group, keys):
+    """
+    Jobs can be fused if each of them is a different category and the
+    multiplicative weight variations are the same wherever they are used.
+    """
+    categories = {
+        tuple(o['region_selection'].get(k) for k in keys) for o in group
+    }
+    factors = {
+        json.dumps(o['weight_factors'], sort_keys=True)
+        for o in group if o.get('weight_factors')
+    }
+
+    return len(categories) == len(group) and len(factors) <= 1
+
+
+def fuse_categories(option_dicts, keys=CATEGORY_KEYS, cache=False):
+    """
+    Fuse the jobs, which differ only in the region selection clauses
+    given by keys, into one job per sample. The fused job fills each
+    histogram once with a categorical axis (see HistMaker) and writes
+    the outputs of all original jobs. The categories have to exclude
+    each other, as the isolation bins and the two charges do.
+    Returns the fused jobs and the remaining ones.
+    """
+    groups = {}
+    rest = []
+    for option in option_dicts:
+        # only single selection jobs of the rdf engine
+        if 'selections' in option or option.get('engine') == 'columnar':
+            rest.append(option)
+            continue
+        groups.setdefault(fuse_key(option, keys), []).append(option)
+
+    fused = []
+    for group in groups.values():
+        if len(group) == 1 or not can_fuse(group, keys):
+            rest += group
+            continue
+
+        first = group[0]
+        option = {
+            k: v for k, v in first.items()
+            if k not in SELECTION_KEYS + ['cache']
+        }
+        option['region'] = '+'.join(sorted({o['region'] for o in group}))
+        option['variation'] = 'categorical'
+        option['categorical'] = True
+        option['selections'] = {
+            f"{o['region']}_{o['variation']}": {
+                k: o[k] for k in SELECTION_KEYS if k in o
+            }
+            for o in group
+        }
+        merge_keys(option, group)
+        if cache:
+            add_cache_key(option)
+
+        fused.append(option)
+
+    logger.info(
+        f"Fused {len(option_dicts) - len(rest)} jobs into {len(fused)}"
+        f" categorical jobs, {len(rest)} jobs are left."
+    )
+
+    return fused, rest
+
+
+def atom(tree):
+    """
+    Key of a comparison or other boolean leaf of a clause and whether it
+    is negated, e.g. x <= 25 is the negation of x > 25.
+    """
+    if tree[0] == 'binary' and tree[1] in NEGATED:
+        return to_cpp(('binary', NEGATED[tree[1]], tree[2], tree[3])), True
+
+    return to_cpp(tree), False
+
+
+def atoms(tree):
+    if tree[0] == 'binary' and tree[1] in ['&&', '||']:
+        return atoms(tree[2]) | atoms(tree[3])
+    if tree[0] == 'unary' and tree[1] == '!':
+        return atoms(tree[2])
+
+    return {atom(tree)[0]}
+
+
+def truth(tree, values):
+    """
+    Value of a clause for the values {atom: bool} of its atoms.
+    """
+    if tree[0] == 'binary' and tree[1] == '&&':
+        return truth(tree[2], values) and truth(tree[3], values)
+    if tree[0] == 'binary' and tree[1] == '||':
+        return truth(tree[2], values) or truth(tree[3], values)
+    if tree[0] == 'unary' and tree[1] == '!':
+        return not truth(tree[2], values)
+
+    key, negated = atom(tree)
+    return values[key] != negated
+
+
+def exclusive(a, b):
+    """
+    Whether no event can pass both clauses, e.g. gen_match_1 == 15 and
+    gen_match_1 != 15 && genmatch_pt_1 > 25. The atoms are treated as
+    independent, such that clauses which only exclude each other by
+    their values (e.g. x > 30 and x < 20) are not recognized.
+    """
+    try:
+        trees = [parse(a), parse(b)]
+    except ValueError:
+        return False
+
+    keys = sorted(atoms(trees[0]) | atoms(trees[1]))
+    if len(keys) > MAX_ATOMS:
+        return False
+
+    for values in product([False, True], repeat=len(keys)):
+        values = dict(zip(keys, values))
+        if truth(trees[0], values) and truth(trees[1], values):
+            return False
+
+    return True
+
+
+def disjoint(clauses):
+    """
+    Whether the clauses exclude each other pairwise.
+    """
+    return all(exclusive(a, b) for a, b in combinations(clauses, 2))
+
+
+def partition(group):
+    """
+    Split the process selections of jobs on the same input files into
+    the clauses common to all processes and one clause per process.
+    Returns None if a process has no clause of its own. Whether the
+    clauses partition the events is checked by disjoint.
+    """
+    common = [
+        c for c in group[0]['process_selection']
+        if all(c in o['process_selection'] for o in group)
+    ]
+
+    clauses = []
+    for o in group:
+        own = [c for c in o['process_selection'] if c not in common]
+        if not own:
+            return None
+        clauses.append(' && '.join(f'({c})' for c in own))
+
+    return common, clauses
+
+
+def fuse_processes(option_dicts, cache=False):
+    """
+    Fuse the jobs of processes reading the same files, e.g. DY, DYtau
+    and DYnonfid, into one job, which reads the files once. The process
+    selection becomes the region selection clause 'process' of each
+    selection, the outputs stay {proc}_{cat}.root. Single selection and
+    categorical jobs of processes which exclude each other are filled
+    with the process as categorical axis, i.e. from a partition index
+    per event. Other jobs branch off per process.
+    Returns the fused jobs and the remaining ones.
+    """
+    groups = {}
+    for option in option_dicts:
+        job = {
+            k: v for k, v in option.items()
+            if k not in SELECTION_KEYS + JOB_KEYS + MERGED_KEYS
+            + ['process_selection', 'selections']
+        }
+        job['region'] = option.get('region')
+        job['variation'] = option.get('variation')
+        job['single'] = 'selections' not in option
+        groups.setdefault(json.dumps(job, sort_keys=True), []).append(option)
+
+    fused = []
+    rest = []
+    for group in groups.values():
+        # jobs without files would be grouped by accident
+        parts = partition(group) if len(group) > 1 and group[0]['files'] else None
+        if parts is None:
+            rest += group
+            continue
+        common, clauses = parts
+
+        first = group[0]
+        option = {
+            k: v for k, v in first.items()
+            if k not in SELECTION_KEYS + ['cache', 'selections']
+        }
+        option['proc'] = '+'.join(o['proc'] for o in group)
+        option['cat'] = '+'.join(dict.fromkeys(o['cat'] for o in group))
+        option['process_selection'] = common
+        option['selections'] = {}
+
+        for o, clause in zip(group, clauses):
+            selections = o['selections'] if 'selections' in o \
+                else {o.get('variation', 'Nominal'): o}
+            for name, sel in selections.items():
+                sel = {k: sel[k] for k in SELECTION_KEYS if k in sel}
+                sel['region_selection'] = {
+                    'process': clause, **sel['region_selection']
+                }
+                option['selections'][f"{name}_{o['proc']}"] = sel
+
+        # a partition index needs exclusive processes and the same clauses
+        # and weight factors in all selections (see HistMaker.define_categories),
+        # otherwise each process gets its own branch
+        factors = {
+            json.dumps(sel['weight_factors'], sort_keys=True)
+            for sel in option['selections'].values() if sel.get('weight_factors')
+        }
+        exclusive_procs = disjoint(clauses)
+        if not exclusive_procs:
+            logger.warning(
+                f"Process selections of {option['proc']} do not exclude each"
+                f" other. Filling them in separate branches."
+            )
+        option['categorical'] = option.get('engine') != 'columnar' \
+            and (first.get('categorical') or 'selections' not in first) \
+            and len(factors) <= 1 and exclusive_procs
+        merge_keys(option, group)
+        if cache:
+            add_cache_key(option)
+
+        fused.append(option)
+
+    logger.info(
+        f"Fused {len(option_dicts) - len(rest)} jobs of processes on the"
+        f" same files into {len(fused)} jobs, {len(rest)} jobs are left."
+    )
+
+    return fused, rest
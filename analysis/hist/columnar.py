@@ -0,0 +1,570 @@
+import os
+import sys
+import json
+import time
+import logging
+from collections import ChainMap
+
+import numpy as np
+import uproot
+
+# run as batch script from this directory or imported from the package
+try:
+    from .expressions import parse, to_numpy, get_columns
+    from .cache import store_result
+    from .metrics import start_metrics, job_metrics, job_info, write_metrics, sidecar_path, output_size
+except ImportError:
+    from expressions import parse, to_numpy, get_columns
+    from cache import store_result
+    from metrics import start_metrics, job_metrics, job_info, write_metrics, sidecar_path, output_size
+
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()  # log to console
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+class ColumnarHistMaker:
+    """
+    Columnar alternative to HistMaker without ROOT.
+    The ntuples and friends are read in chunks with uproot, selections and
+    weights are evaluated as numpy expressions and all histograms are
+    filled with bincount. The output histograms have the same names as
+    the ones of HistMaker.
+    """
+
+    def __init__(
+        self, files, cat, proc, friends=[],
+        process_selection=[],
+        selections={},
+        entry_range=None,
+        step_size=100000
+    ):
+        """
+        Initialize the histogram class.
+        selections = {name: {definitions, region_selection, weights,
+        weight_factors, vary}} as for HistMaker.
+        step_size: number of entries read at once.
+        """
+        logger.info(
+            f"Initializing ColumnarHistMaker for {proc} in category {cat}"
+            f" with files {files} and friends {friends}"
+            f" and selections {list(selections.keys())}."
+        )
+
+        self.files = files
+        self.category = cat
+        self.process = proc
+        self.friends = friends
+        self.process_selection = process_selection
+        self.entry_range = entry_range
+        self.step_size = step_size
+        self.functions = {}
+        self.count = 0
+        self.entries = 0
+        self.timing = {}
+        self.bytes_read = {}
+
+        self.selections = {}
+        for name, sel in selections.items():
+            self.selections[name] = {
+                'definitions': sel.get('definitions', {}),
+                'region_selection': sel.get('region_selection', {}),
+                'weights': sel.get('weights', {}),
+                'weight_factors': sel.get('weight_factors', {}),
+                'vary': sel.get('vary', {}),
+                'hists': {},
+                'histograms': {},
+            }
+
+        self.selection = list(self.selections.keys())[0]
+        self.friends = self.get_friends()
+
+        return
+
+
+    def get_friends(self):
+        """
+        Get the friends to load, the merged friend is used for the friends
+        it contains if it is up to date (see HistMaker.get_friends).
+        """
+        if not self.friends:
+            return self.friends
+
+        for file in self.files:
+            if not os.path.isfile(file.replace("ntuples", "friends/merged")):
+                return self.friends
+
+        with uproot.open(self.files[0].replace("ntuples", "friends/merged")) as f:
+            merged = f['friends'].member('fTitle').split(',') \
+                if 'friends' in f else []
+
+        covered = [f for f in self.friends if f in merged]
+        if not covered:
+            return self.friends
+
+        for file in self.files:
+            mtime = os.path.getmtime(file.replace("ntuples", "friends/merged"))
+            for friend in covered:
+                f_friend = file.replace("ntuples", f"friends/{friend}")
+                if os.path.isfile(f_friend) and os.path.getmtime(f_friend) > mtime:
+                    return self.friends
+
+        logger.info(f"Using merged friend instead of {covered}.")
+        return ['merged'] + [f for f in self.friends if f not in covered]
+
+
+    def function(self, expr):
+        """
+        Get the numpy function of a C++ expression, translated only once.
+        Returns the function and the columns it reads.
+        """
+        if expr not in self.functions:
+            tree = parse(expr)
+            self.functions[expr] = (
+                eval(f'lambda c: {to_numpy(tree)}', {'np': np}),
+                get_columns(tree)
+            )
+
+        return self.functions[expr]
+
+
+    def evaluate(self, expr, columns, n, cache, local={}):
+        """
+        Evaluate an expression on the columns of a chunk with n entries.
+        Results are cached in cache, or in local['cache'] if the expression
+        reads one of the columns in local['columns'].
+        """
+        function, reads = self.function(expr)
+        if local and reads & local['columns']:
+            cache = local['cache']
+
+        if expr not in cache:
+            cache[expr] = np.broadcast_to(function(columns), (n,))
+
+        return cache[expr]
+
+
+    def get_expressions(self):
+        """
+        All expressions which are evaluated.
+        """
+        expressions = list(self.process_selection)
+        for sel in self.selections.values():
+            expressions += list(sel['definitions'].values())
+            expressions += list(sel['region_selection'].values())
+            expressions += list(sel['weights'].values())
+            expressions += list(sel['weight_factors'].values())
+            expressions += list(sel['hists'].keys())
+            for name, cols in sel['vary'].items():
+                for col in cols:
+                    expressions += [f'{col}_{name}up', f'{col}_{name}dn']
+
+        return expressions
+
+
+    def input_columns(self):
+        """
+        All columns read from the input files.
+        Defined columns are not read.
+        """
+        columns = set()
+        for expr in self.get_expressions():
+            columns |= self.function(expr)[1]
+
+        for sel in self.selections.values():
+            columns -= set(sel['definitions'].keys())
+
+        return columns
+
+
+    def make_hists(self, hists, selection=None):
+        """
+        Book histograms, which are filled in run.
+        """
+        if selection is None:
+            selection = self.selection
+
+        self.selections[selection]['hists'].update(hists)
+
+        return
+
+
+    def iterate(self):
+        """
+        Iterate over the chunks of all input files.
+        Yields dicts {column: array} of the ntuple and friends.
+        """
+        columns = self.input_columns()
+        offset = 0
+
+        for file in self.files:
+            paths = [file] + [
+                file.replace("ntuples", f"friends/{friend}")
+                for friend in self.friends
+            ]
+            trees = [uproot.open(path)['ntuple'] for path in paths]
+            n = trees[0].num_entries
+
+            start, stop = 0, n
+            if self.entry_range:
+                start = max(0, self.entry_range[0] - offset)
+                stop = min(n, self.entry_range[1] - offset)
+            offset += n
+            if start >= stop:
+                continue
+
+            # the friends are aligned with the ntuple, read in the same steps
+            branches = [set(tree.keys()) & columns for tree in trees]
+            for name, tree, names in zip(['ntuple'] + self.friends, trees, branches):
+                compressed = sum(tree[b].compressed_bytes for b in names)
+                self.bytes_read[name] = self.bytes_read.get(name, 0) \
+                    + int(compressed * (stop - start) / n)
+            for entry in range(start, stop, self.step_size):
+                end = min(entry + self.step_size, stop)
+                chunk = {}
+                for tree, names in zip(trees, branches):
+                    if names:
+                        chunk.update(tree.arrays(
+                            filter_name=list(names), entry_start=entry,
+                            entry_stop=end, library='np'
+                        ))
+                yield chunk, end - entry
+
+        return
+
+
+    def fill(self, chunk, n):
+        """
+        Fill the histograms of all selections with one chunk.
+        As for the Vary of HistMaker, the process selection is evaluated
+        on the shifted columns, if it reads any of them.
+        """
+        cache = {}
+        self.entries += n
+
+        # process selection on all columns
+        mask = self.process_mask(chunk, n, cache)
+        base = {col: values[mask] for col, values in chunk.items()}
+        n_base = int(mask.sum())
+        self.count += n_base
+        base_cache = {}
+
+        # selected columns of each shift, which changes the process selection
+        shifts = {}
+
+        for sel in self.selections.values():
+            if n_base:
+                self.fill_selection(sel, base, n_base, base_cache)
+
+            # each shift of the varied columns gives a new set of columns
+            for name, cols in sel['vary'].items():
+                for tag in ['up', 'dn']:
+                    shifted = {col: chunk[f'{col}_{name}{tag}'] for col in cols}
+                    columns, n_shift, shift_cache = base, n_base, base_cache
+
+                    if self.reads(self.process_selection, set(cols)):
+                        key = (name, tag, tuple(cols))
+                        if key not in shifts:
+                            local = {'columns': set(cols), 'cache': {}}
+                            shift_mask = self.process_mask(
+                                ChainMap(shifted, chunk), n, cache, local
+                            )
+                            shifts[key] = (
+                                {c: v[shift_mask] for c, v in chunk.items()},
+                                int(shift_mask.sum()), {}
+                            )
+                        columns, n_shift, shift_cache = shifts[key]
+
+                    if not n_shift:
+                        continue
+                    selected = {
+                        col: columns[f'{col}_{name}{tag}'] for col in cols
+                    }
+                    self.fill_selection(
+                        sel, ChainMap(selected, columns), n_shift, shift_cache,
+                        weights={'Nominal': sel['weights']['Nominal']},
+                        suffix=f'_{name}{tag}'
+                    )
+
+        return
+
+
+    def process_mask(self, columns, n, cache, local={}):
+        """
+        Mask of the entries passing the process selection.
+        """
+        mask = np.ones(n, dtype=bool)
+        for expr in self.process_selection:
+            mask &= self.evaluate(expr, columns, n, cache, local)
+
+        return mask
+
+
+    def reads(self, expressions, columns):
+        """
+        Whether any of the expressions reads one of the columns.
+        """
+        return any(self.function(expr)[1] & columns for expr in expressions)
+
+
+    def fill_selection(self, sel, base, n, base_cache, weights=None, suffix=''):
+        """
+        Fill the histograms of one selection. Expressions which do not read
+        any defined or shifted column are shared between the selections.
+        """
+        columns = ChainMap({}, base)
+        local = {
+            'columns': set(sel['definitions']),
+            'cache': {},
+        }
+        if isinstance(base, ChainMap):
+            local['columns'] |= set(base.maps[0])
+
+        for var, expr in sel['definitions'].items():
+            columns[var] = self.evaluate(expr, columns, n, base_cache, local)
+
+        mask = np.ones(n, dtype=bool)
+        for expr in sel['region_selection'].values():
+            mask &= self.evaluate(expr, columns, n, base_cache, local)
+
+        factors = {}
+        if weights is None:
+            weights = sel['weights']
+            if 'Nominal' in weights:
+                factors = sel['weight_factors']
+
+        values = {
+            name: self.evaluate(expr, columns, n, base_cache, local)[mask]
+            for name, expr in weights.items()
+        }
+
+        # the weight factors multiply the nominal weight
+        for name, expr in factors.items():
+            factor = self.evaluate(expr, columns, n, base_cache, local)[mask]
+            values[name] = values['Nominal'] * factor
+
+        for var, hist in sel['hists'].items():
+            x = self.evaluate(var, columns, n, base_cache, local)[mask]
+            idx = bin_index(x, hist['bins'])
+
+            for weight, w in values.items():
+                fill_histogram(sel['histograms'][f'{var}{suffix}_{weight}'], idx, x, w)
+
+        return
+
+
+    def book(self, sel):
+        """
+        Create all histograms of a selection, such that empty
+        histograms are written as well.
+        """
+        suffixes = [''] + [
+            f'_{name}{tag}' for name in sel['vary'] for tag in ['up', 'dn']
+        ]
+
+        for var, hist in sel['hists'].items():
+            for suffix in suffixes:
+                weights = ['Nominal'] if suffix else list(sel['weights'])
+                if not suffix and 'Nominal' in sel['weights']:
+                    weights += list(sel['weight_factors'])
+                for weight in weights:
+                    sel['histograms'][f'{var}{suffix}_{weight}'] = \
+                        new_histogram(hist['bins'], hist['overflow'])
+
+        return
+
+
+    def run(self):
+        """
+        Run the event loop over all chunks.
+        """
+        for sel in self.selections.values():
+            self.book(sel)
+
+        start = time.time()
+        for chunk, n in self.iterate():
+            self.fill(chunk, n)
+
+        self.timing = {
+            'jit': 0.,
+            'event_loop': time.time() - start,
+            'entries': self.entries,
+        }
+
+        logger.info(
+            f"Filled histograms of {self.process} with"
+            f" {self.count} entries passing the process selection"
+            f" in {self.timing['event_loop']:.2f} s."
+        )
+
+        return
+
+
+    def save_hists(self, outpath, option='recreate', selection=None):
+        """
+        Save the histograms of a selection to a ROOT file.
+        """
+        if selection is None:
+            selection = self.selection
+        sel = self.selections[selection]
+
+        logger.debug(f"Saving histograms to {outpath}")
+        with uproot.recreate(outpath) as f:
+            for name, h in sel['histograms'].items():
+                f[name] = to_th1(name, h)
+
+        sel['histograms'] = {}
+        return
+
+
+def bin_index(x, bins):
+    """
+    Index of the bin of each value, including underflow (0)
+    and overflow (nbins+1) as for ROOT histograms.
+    """
+    nbins, low, high = bins
+    idx = np.floor((x - low) / (high - low) * nbins).astype(np.int64) + 1
+
+    return np.clip(idx, 0, nbins + 1)
+
+
+def new_histogram(bins, overflow):
+    nbins = bins[0]
+    return {
+        'bins': bins,
+        'overflow': overflow,
+        'sumw': np.zeros(nbins + 2),
+        'sumw2': np.zeros(nbins + 2),
+        'entries': 0,
+        'tsumw': 0.,
+        'tsumw2': 0.,
+        'tsumwx': 0.,
+        'tsumwx2': 0.,
+    }
+
+
+def fill_histogram(h, idx, x, w):
+    """
+    Fill a histogram with values of known bin index and weights.
+    """
+    w = np.asarray(w, dtype=np.float64)
+    size = h['bins'][0] + 2
+    h['sumw'] += np.bincount(idx, weights=w, minlength=size)
+    h['sumw2'] += np.bincount(idx, weights=w*w, minlength=size)
+
+    # statistics only of the entries within the range, as ROOT does
+    inside = (idx > 0) & (idx < size - 1)
+    w_in, x_in = w[inside], x[inside]
+    h['entries'] += len(idx)
+    h['tsumw'] += w_in.sum()
+    h['tsumw2'] += (w_in * w_in).sum()
+    h['tsumwx'] += (w_in * x_in).sum()
+    h['tsumwx2'] += (w_in * x_in * x_in).sum()
+
+    return
+
+
+def to_th1(name, h):
+    """
+    Convert a histogram to a TH1D which uproot can write.
+    The overflow is added to the last bin if requested (see HistMaker.add_overflow).
+    """
+    nbins, low, high = h['bins']
+    sumw, sumw2 = h['sumw'].copy(), h['sumw2'].copy()
+
+    if h['overflow']:
+        sumw[nbins] += sumw[nbins + 1]
+        sumw2[nbins] += sumw2[nbins + 1]
+        sumw[nbins + 1] = 0
+        sumw2[nbins + 1] = 0
+
+    return uproot.writing.identify.to_TH1x(
+        fName=name,
+        fTitle='',
+        data=sumw,
+        fEntries=h['entries'],
+        fTsumw=h['tsumw'],
+        fTsumw2=h['tsumw2'],
+        fTsumwx=h['tsumwx'],
+        fTsumwx2=h['tsumwx2'],
+        fSumw2=sumw2,
+        fXaxis=uproot.writing.identify.to_TAxis(
+            fName='xaxis', fTitle='', fNbins=nbins, fXmin=low, fXmax=high
+        ),
+    )
+
+
+def run_jobs(options):
+    """
+    Run the jobs given by a list of option dicts with the columnar engine.
+    Returns the timing of each job.
+    """
+    timings = []
+    for option in options:
+        start = start_metrics()
+        selections = option['selections'] if 'selections' in option \
+            else {option.get('selection', 'Nominal'): option}
+
+        hist = ColumnarHistMaker(
+            files=option['files'],
+            cat=option['cat'],
+            proc=option['proc'],
+            friends=option['friends'],
+            process_selection=option['process_selection'],
+            selections=selections,
+            entry_range=option.get('entry_range'),
+        )
+        for name, sel in selections.items():
+            hist.make_hists(sel['hists'], name)
+
+        hist.run()
+
+        save_paths = []
+        for name, sel in selections.items():
+            # outputs may be hard links into the result cache
+            if os.path.lexists(sel['save_path']):
+                os.remove(sel['save_path'])
+            hist.save_hists(sel['save_path'], 'recreate', name)
+            save_paths.append(sel['save_path'])
+        store_result(option)
+
+        logger.info(
+            f"Job for {option['proc']} in category {option['cat']} finished."
+        )
+
+        write_metrics(sidecar_path(save_paths[0]), job_metrics(
+            start,
+            **job_info(option),
+            engine='columnar',
+            event_loops=1,
+            jit=0.,
+            event_loop=hist.timing['event_loop'],
+            entries=hist.timing['entries'],
+            bytes_read=hist.bytes_read,
+            output_bytes=output_size(save_paths),
+            jobs_in_process=1,
+        ))
+        timings.append(hist.timing)
+
+    return timings
+
+
+if __name__ == '__main__':
+    # for batch submission or local usage, as hist_process.py
+    args = sys.argv
+    options_file = args[1]
+    proc = args[2]
+
+    with open(options_file, 'r') as f:
+        options = json.load(f)
+    logger.info(f"Loaded options from {options_file} for process {proc}")
+
+    indices = [int(i) for i in proc.split(',')]
+
+    run_jobs([options[i] for i in indices])
@@ -0,0 +1,43 @@
+import re
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def get_identifiers(expression):
+    """
+    Get all identifiers (possible column names) in a C++ expression.
+    """
+    return set(IDENTIFIER.findall(expression))
+
+
+def find_columns(expressions, available=None):
+    """
+    Get the columns referenced by a list of expressions.
+    If available is given, only identifiers that are available columns
+    are returned, which removes functions, namespaces and keywords.
+    """
+    identifiers = set()
+    for expr in expressions:
+        identifiers |= get_identifiers(expr)
+
+    if available is not None:
+        identifiers &= set(available)
+
+    return sorted(identifiers)
+
+
+def get_selection_expressions(selection):
+    """
+    Get all expressions used by one selection of a histogram job.
+    """
+    expressions = list(selection.get('definitions', {}).values())
+    expressions += list(selection.get('region_selection', {}).values())
+    expressions += list(selection.get('weights', {}).values())
+    expressions += list(selection.get('weight_factors', {}).values())
+    expressions += list(selection.get('hists', {}).keys())
+
+    for name, cols in selection.get('vary', {}).items():
+        for col in cols:
+            expressions += [col, f'{col}_{name}up', f'{col}_{name}dn']
+
+    return expressions
@@ -0,0 +1,277 @@
+import ROOT
+import os
+import sys
+import json
+import time
+import shutil
+import multiprocessing
+import hashlib
+import tempfile
+import logging
+
+# run as batch script from this directory or imported from the package
+try:
+    from .columns import get_identifiers
+except ImportError:
+    from columns import get_identifiers
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'output/jit_cache'
+
+# return types of the compiled expressions
+RETURN_TYPES = {
+    'filter': 'bool',
+    'define': 'double',
+    'factors': 'ROOT::RVecD',
+}
+
+HEADER = """#ifndef HIST_EXPRESSIONS_{key}
+#define HIST_EXPRESSIONS_{key}
+#include "RtypesCore.h"
+#include "ROOT/RVec.hxx"
+#include <cmath>
+// the expressions are written for the interpreter, which uses namespace std
+using namespace std;
+using namespace ROOT::VecOps;
+
+{declarations}
+
+#endif
+"""
+
+SOURCE = """#include "{header}"
+
+{definitions}
+"""
+
+
+def get_parameters(rdf, expr, types):
+    """
+    Get the columns of an expression with their types.
+    types = {column: type} of columns which are not yet defined on the
+    dataframe. Other identifiers are looked up on the dataframe,
+    such that functions and keywords are skipped.
+    """
+    parameters = []
+    for name in sorted(get_identifiers(expr)):
+        if name in types:
+            parameters.append((name, types[name]))
+            continue
+
+        try:
+            parameters.append((name, str(rdf.GetColumnType(name))))
+        except Exception:
+            # not a column
+            continue
+
+    return parameters
+
+
+def get_function(expr, kind, parameters):
+    """
+    Get the name, declaration and definition of the function
+    which evaluates an expression.
+    """
+    signature = ', '.join(f'const {t} &{name}' for name, t in parameters)
+    return_type = RETURN_TYPES[kind]
+
+    key = f'{kind}:{expr}:{signature}'
+    name = 'hist_expr_' + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    declaration = f'{return_type} {name}({signature});'
+    definition = f'{return_type} {name}({signature}) {{\n    return ({expr});\n}}'
+
+    return name, declaration, definition
+
+
+def build_library(functions, cache_dir=CACHE_DIR):
+    """
+    Compile the functions into a shared library, which is cached by the
+    hash of the generated code. The names of the functions are listed in
+    functions.json next to the library. Returns the path of the library
+    or None if the compilation fails.
+    functions = [(name, declaration, definition)]
+    """
+    functions = sorted(set(functions))
+    declarations = '\n'.join(f[1] for f in functions)
+    definitions = '\n\n'.join(f[2] for f in functions)
+
+    key = hashlib.sha1((declarations + definitions).encode()).hexdigest()[:16]
+    lib_dir = os.path.abspath(os.path.join(cache_dir, key))
+    library = os.path.join(lib_dir, 'expressions_cxx.so')
+
+    if os.path.isfile(library):
+        logger.debug(f"Using cached expression library {library}")
+        return library
+
+    # compile in a temporary directory, another production may build
+    # the same library at the same time
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=f'{key}_tmp')
+
+    with open(os.path.join(tmp_dir, 'expressions.h'), 'w') as f:
+        f.write(HEADER.format(key=key, declarations=declarations))
+    source = os.path.join(tmp_dir, 'expressions.cxx')
+    with open(source, 'w') as f:
+        f.write(SOURCE.format(header='expressions.h', definitions=definitions))
+    with open(os.path.join(tmp_dir, 'functions.json'), 'w') as f:
+        json.dump([f[0] for f in functions], f)
+
+    logger.info(f"Compiling {len(functions)} expressions into {lib_dir}")
+    ok = ROOT.gSystem.CompileMacro(
+        source, 'kO', os.path.join(tmp_dir, 'expressions_cxx'), ''
+    )
+    if not ok:
+        logger.warning("Compilation of the expressions failed. Using JIT.")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+    try:
+        os.rename(tmp_dir, lib_dir)
+    except OSError:
+        # built in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return library
+
+
+def load_library(library):
+    """
+    Load a compiled expression library and declare its functions.
+    Returns the names of the functions in the library.
+    """
+    lib_dir = os.path.dirname(library)
+    ROOT.gInterpreter.Declare(f'#include "{os.path.join(lib_dir, "expressions.h")}"')
+
+    if ROOT.gSystem.Load(library) < 0:
+        raise RuntimeError(f"Could not load expression library {library}")
+
+    with open(os.path.join(lib_dir, 'functions.json'), 'r') as f:
+        return set(json.load(f))
+
+
+def get_calls(rdf, expressions, types={}):
+    """
+    Get the calls of the functions evaluating the expressions.
+    expressions = [(expression, kind)] with kind 'filter', 'define' or 'factors'
+    types = {column: type} of columns defined later on the dataframe
+    Returns {(expression, kind): call} and the functions
+    [(name, declaration, definition)] to compile (see build_library).
+    """
+    calls = {}
+    functions = []
+    for expr, kind in expressions:
+        if (expr, kind) in calls:
+            continue
+
+        parameters = get_parameters(rdf, expr, types)
+        name, declaration, definition = get_function(expr, kind, parameters)
+
+        calls[(expr, kind)] = f"{name}({', '.join(p[0] for p in parameters)})"
+        functions.append((name, declaration, definition))
+
+    return calls, functions
+
+
+def compiled_calls(library, calls):
+    """
+    Load the library built before the jobs were started and keep the
+    calls of the functions it contains. The other expressions, e.g. of
+    files with different column types, are JIT compiled.
+    Returns {(expression, kind): call}, empty if there is no library.
+    """
+    if not calls:
+        return {}
+
+    if not library or not os.path.isfile(library):
+        logger.warning(f"Expression library {library} not found. Using JIT.")
+        return {}
+
+    names = load_library(library)
+    available = {
+        key: call for key, call in calls.items() if call.split('(')[0] in names
+    }
+    logger.info(
+        f"Using {len(available)} of {len(calls)} precompiled expressions"
+        f" from {library}"
+    )
+
+    return available
+
+
+def timing_job(option):
+    """
+    Run one histogram job and return its timing.
+    """
+    try:
+        from .hist_process import run_jobs
+    except ImportError:
+        from hist_process import run_jobs
+
+    return run_jobs([option])[0]
+
+
+def jit_report(option, cache_dir=CACHE_DIR):
+    """
+    Compare the timing of a job with JIT compiled expressions, with a
+    freshly compiled library and with the cached library.
+    Each run uses a new process, such that nothing is reused from the
+    interpreter of a previous run.
+    """
+    try:
+        from .hist_process import build_job_library
+    except ImportError:
+        from hist_process import build_job_library
+
+    cache_dir = os.path.abspath(cache_dir)
+    fresh_dir = tempfile.mkdtemp(prefix='jit_cache')
+
+    # the libraries are built before the jobs, as in the production
+    runs = {'jit': dict(option, compiled=None)}
+    build = {}
+    for name, directory in [('compiled', fresh_dir), ('cached', cache_dir)]:
+        run_option = dict(option)
+        start = time.time()
+        build_job_library([run_option], directory)
+        build[name] = time.time() - start
+        runs[name] = run_option
+
+    context = multiprocessing.get_context('spawn')
+    report = {}
+    for name, run_option in runs.items():
+        with context.Pool(1) as pool:
+            report[name] = pool.apply(timing_job, (run_option,))
+
+    shutil.rmtree(fresh_dir, ignore_errors=True)
+
+    print(
+        f"{'run':<10} {'build [s]':>10} {'JIT [s]':>10} {'loop [s]':>10}"
+        f" {'entries':>10}"
+    )
+    for name, timing in report.items():
+        print(
+            f"{name:<10} {build.get(name, 0.):>10.2f} {timing['jit']:>10.2f}"
+            f" {timing['event_loop']:>10.2f} {timing['entries']:>10}"
+        )
+
+    return report
+
+
+if __name__ == '__main__':
+    # timing report of one job: python compiled.py options.json <index>
+    options_file = sys.argv[1]
+    index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    with open(options_file, 'r') as f:
+        option = json.load(f)[index]
+
+    # the report must not overwrite the outputs of the job
+    out_dir = tempfile.mkdtemp(prefix='jit_report')
+    for sel in ([option] if 'selections' not in option
+                else option['selections'].values()):
+        sel['save_path'] = os.path.join(out_dir, os.path.basename(sel['save_path']))
+
+    jit_report(option)
+    shutil.rmtree(out_dir, ignore_errors=True)
@@ -0,0 +1,45 @@
+"""
+Local stand-in for the condor CLI to test the job tracking, e.g.
+
+    CONDOR_SUBMIT="python hist/condor_stub.py submit" \
+    CONDOR_Q="python hist/condor_stub.py q" \
+    CONDOR_RM="python hist/condor_stub.py rm" \
+    python main.py -H --monitor
+
+Submitted jobs are run right away, one after the other, such that they
+are never found in the queue afterwards.
+"""
+import re
+import sys
+import time
+import subprocess
+
+
+def submit(submit_script):
+    with open(submit_script, 'r') as f:
+        lines = [line.strip() for line in f]
+
+    executable = [l.split('=', 1)[1].strip() for l in lines if l.startswith('executable')][0]
+    queue = [l for l in lines if l.startswith('queue')][0]
+
+    match = re.match(r'queue \w+ in \((.*)\)', queue)
+    if match:
+        indices = [i.strip() for i in match.group(1).split(',')]
+    else:
+        indices = [str(i) for i in range(int(queue.split()[1]))]
+
+    for i in indices:
+        subprocess.run([executable, i])
+
+    cluster = int(time.time() * 1000) % 10**9
+    print(f"{len(indices)} job(s) submitted to cluster {cluster}.")
+
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+
+    if command == 'submit':
+        submit(sys.argv[2])
+    # the queue is always empty, removing jobs has nothing to do
+    elif command not in ['q', 'rm']:
+        raise ValueError(f"Unknown command {command}")
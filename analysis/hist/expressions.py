@@ -0,0 +1,261 @@
+import re
+
+NUMBER = r'(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[fF]?'
+NAME = r'[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*'
+
+# numbers, (namespaced) identifiers and operators of C++ expressions
+TOKEN = re.compile(
+    rf'\s*(?:(?P<num>{NUMBER})|(?P<name>{NAME})'
+    r'|(?P<op>&&|\|\||==|!=|<=|>=|[-+*/%<>!?:(),]))'
+)
+
+# binary operators from the lowest to the highest precedence
+BINARY = [
+    ['||'],
+    ['&&'],
+    ['==', '!='],
+    ['<', '>', '<=', '>='],
+    ['+', '-'],
+    ['*', '/', '%'],
+]
+
+CASTS = {
+    'double': 'np.float64',
+    'Double_t': 'np.float64',
+    'float': 'np.float32',
+    'Float_t': 'np.float32',
+    'int': 'np.int32',
+    'Int_t': 'np.int32',
+    'bool': 'np.bool_',
+    'Bool_t': 'np.bool_',
+}
+
+FUNCTIONS = {
+    'abs': 'np.abs',
+    'fabs': 'np.abs',
+    'std::abs': 'np.abs',
+    'TMath::Abs': 'np.abs',
+    'sqrt': 'np.sqrt',
+    'std::sqrt': 'np.sqrt',
+    'TMath::Sqrt': 'np.sqrt',
+    'cos': 'np.cos',
+    'sin': 'np.sin',
+    'tan': 'np.tan',
+    'exp': 'np.exp',
+    'log': 'np.log',
+    'pow': 'np.power',
+    'TMath::Power': 'np.power',
+    'min': 'np.minimum',
+    'max': 'np.maximum',
+}
+
+
+def tokenize(expr):
+    """
+    Split a C++ expression into tokens.
+    """
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = TOKEN.match(expr, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Can not parse '{expr[pos:]}' in '{expr}'")
+        tokens.append(match.group(match.lastgroup))
+        pos = match.end()
+
+    return tokens
+
+
+class Parser:
+    """
+    Recursive descent parser of C++ expressions with the usual operator
+    precedence. The syntax tree is built from tuples:
+    ('num', text), ('col', name), ('call', function, [args]),
+    ('unary', op, x), ('binary', op, a, b), ('ternary', cond, a, b),
+    ('cast', type, x)
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return None
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, token):
+        if self.next() != token:
+            raise ValueError(f"Expected '{token}' in '{self.expr}'")
+
+    def parse(self):
+        tree = self.ternary()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected '{self.peek()}' in '{self.expr}'")
+        return tree
+
+    def ternary(self):
+        cond = self.binary(0)
+        if self.peek() != '?':
+            return cond
+
+        self.next()
+        a = self.ternary()
+        self.expect(':')
+        b = self.ternary()
+        return ('ternary', cond, a, b)
+
+    def binary(self, level):
+        if level == len(BINARY):
+            return self.unary()
+
+        tree = self.binary(level + 1)
+        while self.peek() in BINARY[level]:
+            op = self.next()
+            tree = ('binary', op, tree, self.binary(level + 1))
+        return tree
+
+    def unary(self):
+        if self.peek() in ['!', '-', '+']:
+            op = self.next()
+            return ('unary', op, self.unary())
+
+        if self.peek() == '(' and self.peek(1) in CASTS and self.peek(2) == ')':
+            self.next()
+            cast = self.next()
+            self.next()
+            return ('cast', cast, self.unary())
+
+        return self.primary()
+
+    def primary(self):
+        token = self.next()
+        if token is None:
+            raise ValueError(f"Unexpected end of '{self.expr}'")
+
+        if token == '(':
+            tree = self.ternary()
+            self.expect(')')
+            return tree
+
+        if re.fullmatch(NUMBER, token):
+            return ('num', token.rstrip('fF'))
+
+        if re.fullmatch(NAME, token):
+            if self.peek() != '(':
+                return ('col', token)
+
+            self.next()
+            args = []
+            while self.peek() != ')':
+                args.append(self.ternary())
+                if self.peek() == ',':
+                    self.next()
+            self.expect(')')
+            return ('call', token, args)
+
+        raise ValueError(f"Unexpected '{token}' in '{self.expr}'")
+
+
+def parse(expr):
+    """
+    Parse a C++ expression into a syntax tree (see Parser).
+    """
+    return Parser(expr).parse()
+
+
+def to_numpy(tree):
+    """
+    Python source evaluating a syntax tree on numpy arrays.
+    Columns are taken from the mapping c, logical operators
+    are evaluated element-wise.
+    """
+    kind = tree[0]
+
+    if kind == 'num':
+        return tree[1]
+
+    if kind == 'col':
+        return f'c[{tree[1]!r}]'
+
+    if kind == 'call':
+        if tree[1] not in FUNCTIONS:
+            raise ValueError(f"Function {tree[1]} is not supported.")
+        return f"{FUNCTIONS[tree[1]]}({', '.join(to_numpy(a) for a in tree[2])})"
+
+    if kind == 'unary':
+        if tree[1] == '!':
+            return f'np.logical_not({to_numpy(tree[2])})'
+        return f'({tree[1]}{to_numpy(tree[2])})'
+
+    if kind == 'binary':
+        op, a, b = tree[1], to_numpy(tree[2]), to_numpy(tree[3])
+        if op == '&&':
+            return f'np.logical_and({a}, {b})'
+        if op == '||':
+            return f'np.logical_or({a}, {b})'
+        return f'({a} {op} {b})'
+
+    if kind == 'ternary':
+        return f'np.where({to_numpy(tree[1])}, {to_numpy(tree[2])}, {to_numpy(tree[3])})'
+
+    if kind == 'cast':
+        return f'np.asarray({to_numpy(tree[2])}, dtype={CASTS[tree[1]]})'
+
+    raise ValueError(f"Unknown node {tree}")
+
+
+def to_cpp(tree):
+    """
+    C++ source of a syntax tree, fully parenthesized.
+    """
+    kind = tree[0]
+
+    if kind in ['num', 'col']:
+        return tree[1]
+
+    if kind == 'call':
+        return f"{tree[1]}({', '.join(to_cpp(a) for a in tree[2])})"
+
+    if kind == 'unary':
+        return f'({tree[1]}{to_cpp(tree[2])})'
+
+    if kind == 'binary':
+        return f'({to_cpp(tree[2])} {tree[1]} {to_cpp(tree[3])})'
+
+    if kind == 'ternary':
+        return f'({to_cpp(tree[1])} ? {to_cpp(tree[2])} : {to_cpp(tree[3])})'
+
+    if kind == 'cast':
+        return f'(({tree[1]}){to_cpp(tree[2])})'
+
+    raise ValueError(f"Unknown node {tree}")
+
+
+def get_columns(tree):
+    """
+    Columns referenced in a syntax tree.
+    """
+    kind = tree[0]
+    if kind == 'col':
+        return {tree[1]}
+    if kind == 'num':
+        return set()
+    if kind == 'call':
+        children = tree[2]
+    elif kind in ['unary', 'cast']:
+        children = [tree[2]]
+    else:
+        children = tree[1:] if kind == 'ternary' else tree[2:]
+
+    columns = set()
+    for child in children:
+        columns |= get_columns(child)
+    return columns
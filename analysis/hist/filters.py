@@ -0,0 +1,218 @@
+import ROOT
+import logging
+
+# run as batch script from this directory or imported from the package
+try:
+    from .expressions import parse, to_cpp, get_columns
+    from .columns import get_identifiers
+except ImportError:
+    from expressions import parse, to_cpp, get_columns
+    from columns import get_identifiers
+
+logger = logging.getLogger(__name__)
+
+# entries of the first file of a sample used to measure the filters
+N_EVENTS = 10000
+
+# evaluation time of each measured filter
+TIMING = """
+#include <atomic>
+#include <chrono>
+#include <deque>
+
+namespace hist_filters {
+    std::deque<std::atomic<long long>> elapsed;
+
+    void reset(int n) {
+        elapsed.clear();
+        for (int i = 0; i < n; i++) elapsed.emplace_back(0);
+    }
+
+    long long get(int i) {
+        return elapsed[i].load();
+    }
+
+    template <typename F>
+    bool timed(int i, F f) {
+        auto start = std::chrono::steady_clock::now();
+        bool result = f();
+        elapsed[i] += std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::steady_clock::now() - start
+        ).count();
+        return result;
+    }
+}
+"""
+
+_declared = False
+
+
+def split_clauses(expr):
+    """
+    Split a filter into the clauses of its top level &&, which can be
+    applied as separate filters. The clauses are written in a normalized
+    form, such that equal clauses match independent of their formatting.
+    Filters which can not be parsed are kept as they are.
+    """
+    try:
+        tree = parse(expr)
+    except ValueError:
+        return [expr]
+
+    clauses = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == 'binary' and node[1] == '&&':
+            stack += [node[3], node[2]]
+        else:
+            clauses.append(node)
+
+    return [to_cpp(clause) for clause in clauses]
+
+
+def rank(stats):
+    """
+    Expected cost per rejected event of a filter with the measured
+    [pass fraction, cost]: filters that are cheap and reject
+    many events come first.
+    """
+    passed, cost = stats
+    if passed >= 1:
+        return float('inf')
+
+    return cost / (1 - passed)
+
+
+def clause_columns(clause):
+    """
+    Columns read by a clause. All identifiers of clauses which can not
+    be parsed, such that they keep their position to more clauses.
+    """
+    try:
+        return get_columns(parse(clause))
+    except ValueError:
+        return get_identifiers(clause)
+
+
+def order_filters(filters, stats):
+    """
+    Split the filters into their clauses and order them by rank.
+    stats = {clause: [pass fraction, cost in ns]}. Clauses without
+    stats are applied last in their original order.
+    Only independent clauses are reordered: a clause stays after the
+    earlier clauses reading one of its columns, which may guard it,
+    e.g. n > 1 && pt[1] > 25 or x != 0 && y / x > 1.
+    """
+    clauses = [c for f in filters for c in split_clauses(f)]
+    clauses = list(dict.fromkeys(clauses))
+    columns = [clause_columns(c) for c in clauses]
+
+    def key(i):
+        return rank(stats[clauses[i]]) if clauses[i] in stats else float('inf')
+
+    ordered = []
+    pending = list(range(len(clauses)))
+    while pending:
+        ready = [
+            i for i in pending
+            if not any(j < i and columns[j] & columns[i] for j in pending)
+        ]
+        first = min(ready, key=key)
+        ordered.append(first)
+        pending.remove(first)
+
+    return [clauses[i] for i in ordered]
+
+
+def measure_filters(f, friends, clauses, n_events=N_EVENTS):
+    """
+    Measure the pass fraction and the evaluation time (ns per event) of
+    each clause on the first n_events entries of a file. Each clause is
+    applied on its own, the pass fractions are taken from the report of
+    the dataframe. The time of an empty filter is subtracted, the time
+    of reading the columns is not included.
+    Clauses which can not be evaluated (e.g. missing columns) are skipped.
+    Returns {clause: [pass fraction, cost]}.
+    """
+    global _declared
+    if not _declared:
+        ROOT.gInterpreter.Declare(TIMING)
+        _declared = True
+
+    chain = ROOT.TChain('ntuple')
+    chain.Add(f)
+    friend_chains = []
+    for friend in friends:
+        chain_friend = ROOT.TChain('ntuple')
+        chain_friend.Add(f.replace('ntuples', f'friends/{friend}'))
+        chain.AddFriend(chain_friend)
+        friend_chains.append(chain_friend)
+
+    # string filters are only compiled at the start of the event loop,
+    # clauses reading unknown columns would fail all measurements
+    branches = set()
+    for c in [chain] + friend_chains:
+        c.LoadTree(0)
+        tree = c.GetTree()
+        if tree:
+            branches |= {b.GetName() for b in tree.GetListOfBranches()}
+
+    rdf = ROOT.RDataFrame(chain)
+    node = rdf.Range(n_events)
+
+    # the last index is the empty filter, filters are only
+    # evaluated with an action attached
+    ROOT.hist_filters.reset(len(clauses) + 1)
+    names = {}
+    counts = []
+    for i, clause in enumerate(clauses + ['true']):
+        if i < len(clauses):
+            try:
+                missing = get_columns(parse(clause)) - branches
+            except ValueError as e:
+                missing = [str(e)]
+            if missing:
+                logger.warning(
+                    f"Can not measure filter {clause} on {f}: {sorted(missing)}"
+                )
+                continue
+
+        try:
+            counts.append(node.Filter(
+                f'return hist_filters::timed({i}, [&]() {{ return bool({clause}); }});',
+                f'clause_{i}'
+            ).Count())
+        except Exception as e:
+            logger.warning(f"Can not measure filter {clause} on {f}: {e}")
+            continue
+        names[i] = clause
+
+    if len(clauses) not in names:
+        return {}
+
+    try:
+        report = rdf.Report().GetValue()
+    except Exception as e:
+        logger.warning(f"Measuring the filters on {f} failed: {e}")
+        return {}
+
+    baseline = ROOT.hist_filters.get(len(clauses))
+    entries = report.At(f'clause_{len(clauses)}').GetAll()
+    if not entries:
+        return {}
+
+    stats = {}
+    for i, clause in names.items():
+        if i == len(clauses):
+            continue
+
+        info = report.At(f'clause_{i}')
+        stats[clause] = [
+            info.GetPass() / entries,
+            max((ROOT.hist_filters.get(i) - baseline) / entries, 0.1),
+        ]
+
+    logger.info(f"Measured {len(stats)} filters on {entries} entries of {f}.")
+
+    return stats
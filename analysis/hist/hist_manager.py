@@ -1,11 +1,20 @@
 import ROOT
-from glob import glob
 import os
 import json
+import resource
 
-from .hist_process import HistMaker
-from main_setup.batch import create_job_script, create_submit_script
-from config.weights import get_weights
+from .hist_process import HistMaker, run_jobs, build_job_library
+from .splitting import split_option
+from .catalog import SampleCatalog
+from .skim import is_fresh, skim_path
+from .compiled import CACHE_DIR
+from .cache import add_cache_key, restore_cached
+from .categorical import fuse_processes
+from .filters import split_clauses
+from .tracker import JobTracker
+from .pilot import fill_queue
+from main_setup.batch import create_job_script, create_pilot_script, create_submit_script
+from config.weights import get_weights, get_weight_factors, get_nominal_weights
 
 import logging
 
@@ -29,10 +38,46 @@ class ProcessManager:
         definitions={}, filters={},
         binnings={}, save_path='',
         selection='Nominal',
+        variations=None,
+        max_events=None,
+        catalog=None,
+        vary=None,
+        skim=None,
+        compiled=False,
+        cache=False,
+        fuse=False,
+        weight_friend=False,
+        cse=False,
+        order_filters=False,
+        engine='rdf',
         nthreads=1
     ):
         """
         Initialize the histogram class.
+        variations = {selection: {definitions, binnings}}
+        If given, all selection variations of a process are
+        processed in the same job (single pass over the input files).
+        max_events: if given, jobs are split into chunks of at most
+        max_events entries, which are merged afterwards (see merge.py).
+        catalog: SampleCatalog used to resolve the file patterns.
+        vary = {variation: [columns]}: systematic variations of columns,
+        derived with RDataFrame Vary in the Nominal selection.
+        skim: skim configuration (see skim.get_skim_config). Samples with
+        fresh skims of all files read the skims instead of ntuples and friends.
+        compiled: compile the expressions of all jobs once into a cached
+        shared library before the jobs are started, instead of JIT
+        compiling them in each job.
+        cache: reuse the results of identical jobs from the result cache
+        (see cache.py) and store the results of new jobs there.
+        fuse: fuse the jobs of processes reading the same files, e.g.
+        W, Wtau and Wnonfid, into one job (see categorical.py).
+        weight_friend: read the nominal weights from the weight friend
+        (see config.weights.get_weights), which has to be in friends.
+        cse: hoist the common subexpressions of the expressions of a job
+        into columns evaluated once per event (see planner.py).
+        order_filters: apply the filter clauses ordered by their measured
+        pass fraction and cost, cached in the catalog (see filters.py).
+        engine: 'rdf' (HistMaker) or 'columnar' (ColumnarHistMaker, without ROOT).
         """
         self.region = region
         self.files = files
@@ -42,99 +87,423 @@ class ProcessManager:
         self.process_selection = filters['process']
         self.hists = binnings
         self.selection = selection
+        self.variations = variations
+        self.max_events = max_events
+        self.vary = vary
+        self.compiled = os.path.abspath(CACHE_DIR) if compiled else None
+        self.cache = cache
+        self.fuse = fuse
+        self.weight_friend = weight_friend
+        self.cse = cse
+        self.order_filters = order_filters
+        self.engine = engine
         self.histograms = []
 
         self.nthreads = nthreads
 
-        for proc in self.files:
-            if isinstance(proc, str):
-                self.samples = glob(proc)
-            else:
-                self.files = proc
+        # resolve the file patterns of the samples
+        self.catalog = catalog if catalog else SampleCatalog()
+        self.files = {
+            proc: self.catalog.resolve_all(patterns)
+            for proc, patterns in files.items()
+        }
+
+        if weight_friend:
+            check_weight_friend(self.files)
+
+        # use the skims if they are up to date for all files of a sample
+        self.skimmed = {}
+        for proc, proc_files in self.files.items():
+            if skim and proc_files and all(
+                is_fresh(f, friends, skim['tag']) for f in proc_files
+            ):
+                logger.info(f"Using skim {skim['tag']} for {proc}.")
+                self.files[proc] = [skim_path(f, skim['tag']) for f in proc_files]
+                self.skimmed[proc] = True
 
         return
     
 
-    def run_local(self):
+    def run_local(self, version, njobs=1, max_memory=None):
         """
-        Collect all histograms and then save them to commong file.
+        Create the histograms locally on a pool of processes.
         """
+        _, option_dicts = self.prepare_jobs(version)
+        if self.cache:
+            option_dicts = [option_dicts[i] for i in restore_cached(option_dicts)]
+        run_local_jobs(option_dicts, njobs, max_memory)
 
-        raise NotImplementedError("This function is not yet implemented.")
+        return
 
 
-    def run_batch(self, version, dolog):
+    def get_selection_options(
+        self, proc, cat, selection, definitions, hists, save_dir
+    ):
         """
-        Create the histograms in batch mode.
-        For this: make one file containing all options
+        Options of one selection variation of a process.
+        """
+        options = {
+            'definitions': definitions,
+            'region_selection': self.region_selection[self.region][selection],
+            'weights': get_weights(
+                proc, selection, factors=False, materialized=self.weight_friend
+            ),
+            'weight_factors': get_weight_factors(proc, selection),
+            'hists': hists,
+            'save_path': save_dir + f'/{proc}_{cat}.root'
+        }
+
+        if self.vary and selection == 'Nominal':
+            options['vary'] = self.vary
+
+        return options
+
+
+    def get_filter_stats(self, option):
+        """
+        Measured pass fraction and cost of the filter clauses of a job.
+        """
+        selections = option['selections'].values() \
+            if 'selections' in option else [option]
+
+        filters = list(option['process_selection'])
+        for sel in selections:
+            filters += list(sel['region_selection'].values())
+        clauses = list(dict.fromkeys(c for f in filters for c in split_clauses(f)))
+
+        return self.catalog.filter_stats(option['files'], option['friends'], clauses)
+
+
+    def prepare_jobs(self, version, build=True):
+        """
+        Prepare the options of all jobs and save them to options.json.
+        build: build the expression library of the jobs, if compiled.
+        Jobs which are fused further build it afterwards.
         """
 
         batch_dir = f'output/{version}/batch_jobs/{self.region}/{self.selection}'
         os.makedirs(batch_dir, exist_ok=True)
         batch_dir_abs = os.path.abspath(batch_dir)
         logger.info(f"Batch directory: {batch_dir_abs}")
-        logger.info("Preparing batch jobs...")
+        logger.info("Preparing jobs...")
 
         option_dicts = []
 
         for i, cat in enumerate(self.process_selection):
             for proc in self.process_selection[cat]:
-                option_dicts.append(
-                    {
-                        'files': self.files[proc],
-                        'cat': cat,
-                        'proc': proc,
-                        'friends': self.friends,
-                        'definitions': self.definitions,
-                        'region_selection': self.region_selection[self.region][self.selection],
-                        'process_selection': self.process_selection[cat][proc],
-                        'weights': get_weights(proc, self.selection),
-                        'nthreads': self.nthreads,
-                        'hists': self.hists,
-                        'save_path': batch_dir_abs+ f'/{proc}_{cat}.root'
-                    }
-                )
-                logger.info(f"Preparing batch job for {proc} in category {cat}")
+                option = {
+                    'files': self.files[proc],
+                    'cat': cat,
+                    'proc': proc,
+                    'friends': [] if self.skimmed.get(proc) else self.friends,
+                    'process_selection': self.process_selection[cat][proc],
+                    'nthreads': self.nthreads,
+                    'engine': self.engine,
+                    'region': self.region,
+                    'variation': self.selection,
+                }
+                if self.cse:
+                    option['cse'] = self.cse
+
+                if self.variations is None:
+                    option.update(
+                        self.get_selection_options(
+                            proc, cat, self.selection,
+                            self.definitions, self.hists, batch_dir_abs
+                        )
+                    )
+                else:
+                    option['selections'] = {}
+                    for variation, settings in self.variations.items():
+                        save_dir = os.path.join(
+                            os.path.dirname(batch_dir_abs), variation
+                        )
+                        os.makedirs(save_dir, exist_ok=True)
+                        option['selections'][variation] = \
+                            self.get_selection_options(
+                                proc, cat, variation,
+                                settings['definitions'],
+                                settings['binnings'],
+                                save_dir
+                            )
+
+                if self.order_filters:
+                    option['filter_stats'] = self.get_filter_stats(option)
 
-        # save options to a json file
-        options_file = os.path.join(batch_dir, 'options.json')
-        with open(options_file, 'w') as f:
-            json.dump(option_dicts, f, indent=4)
-        logger.info(f"Saved options to {options_file}")
+                entries = self.catalog.entries(option['files'])
+                if self.max_events:
+                    option_dicts += split_option(option, entries, self.max_events)
+                else:
+                    option['entries'] = sum(entries.values())
+                    option_dicts.append(option)
+                logger.info(f"Preparing job for {proc} in category {cat}")
 
-        # create the job script
-        n_processes = len(option_dicts)
+        if self.fuse:
+            fused, rest = fuse_processes(option_dicts)
+            option_dicts = rest + fused
 
-        job_script = os.path.join(batch_dir, f"job.sh")
-        submit_script = os.path.join(batch_dir, f"submit.sub")
-        job_dir = os.path.abspath(__file__).replace('hist_manager.py', '')
+        if self.compiled and build:
+            build_job_library(option_dicts, self.compiled)
 
-        options_file_abs = os.path.abspath(options_file)
-        job_script_abs = os.path.abspath(job_script)
+        if self.cache:
+            for option in option_dicts:
+                add_cache_key(option)
 
-        create_job_script(job_script, options_file_abs, job_dir)
-        create_submit_script(dolog, submit_script, job_script_abs, n_processes)
+        write_options(batch_dir, option_dicts)
 
-        # make sure the scripts are executable
-        os.chmod(job_script, 0o755)
-        os.chmod(submit_script, 0o644)
+        return batch_dir, option_dicts
 
-        logger.info(f"Created job script {job_script} and submit script {submit_script}")
 
-        # submit the job
-        os.system(f"condor_submit {submit_script}")
-        logger.info(f"Submitted job with {n_processes} processes.")
+    def prepare_queue(self, version, chunk_size=1):
+        """
+        Prepare the jobs and put them into the task queue of the
+        pilot workers (see pilot.py). Returns the batch directory.
+        """
+        batch_dir, option_dicts = self.prepare_jobs(version)
+
+        return queue_jobs(batch_dir, option_dicts, self.cache, chunk_size)
+
+
+    def run_pilots(self, version, dolog, n_pilots):
+        """
+        Submit pilot workers, which pull the jobs from a shared queue
+        instead of running one job each.
+        """
+        batch_dir = self.prepare_queue(version)
+        submit_pilots(batch_dir, dolog, n_pilots)
+
         return
 
 
-    def run(self, local=True):
+    def run_batch(self, version, dolog):
+        """
+        Create the histograms in batch mode.
+        For this: make one file containing all options
+        """
+        batch_dir, option_dicts = self.prepare_jobs(version)
+        submit_jobs(batch_dir, option_dicts, dolog, self.cache, self.engine)
+
+        return
+
+
+    def run(self, version, dolog=False, local=True, njobs=1):
         """
         Run the histogram creation process.
         """
         if local:
-            self.run_local()
+            self.run_local(version, njobs)
         else:
-            self.run_batch()
+            self.run_batch(version, dolog)
+
+
+def check_weight_friend(files):
+    """
+    Check that the weight friends of the samples were written with the
+    nominal weights of get_nominal_weights. The first file of each
+    sample is checked. files = {process: [files]}
+    """
+    expected = get_nominal_weights()
+    for proc, proc_files in files.items():
+        if not proc_files:
+            continue
+
+        f_friend = proc_files[0].replace('ntuples', 'friends/weight')
+        tf = ROOT.TFile.Open(f_friend)
+        if not tf or tf.IsZombie():
+            raise FileNotFoundError(f"Weight friend {f_friend} not found.")
+        named = tf.Get('weights')
+        written = json.loads(named.GetTitle()) if named else None
+        tf.Close()
+
+        if written != expected:
+            raise ValueError(
+                f"Nominal weights of the weight friend {f_friend} differ from"
+                f" get_nominal_weights: {written}. Rerun corrections/correct.py"
+                f" --weights --overwrite."
+            )
+
+    return
+
+
+def write_options(batch_dir, option_dicts):
+    """
+    Save the options of the jobs of a batch directory to options.json.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    options_file = os.path.join(batch_dir, 'options.json')
+    with open(options_file, 'w') as f:
+        json.dump(option_dicts, f, indent=4)
+    logger.info(f"Saved options to {options_file}")
+
+    return options_file
+
+
+def queue_jobs(batch_dir, option_dicts, cache=False, chunk_size=1):
+    """
+    Put the jobs of a batch directory into the task queue of the
+    pilot workers (see pilot.py). Returns the batch directory.
+    """
+    indices = restore_cached(option_dicts) if cache else None
+    fill_queue(batch_dir, option_dicts, indices, chunk_size)
+
+    return batch_dir
+
+
+def submit_pilots(batch_dir, dolog, n_pilots):
+    """
+    Submit pilot workers pulling the jobs of a batch directory.
+    """
+    job_script = os.path.join(batch_dir, "pilot.sh")
+    submit_script = os.path.join(batch_dir, "submit_pilots.sub")
+    job_dir = os.path.abspath(__file__).replace('hist_manager.py', '')
+
+    create_pilot_script(job_script, os.path.abspath(batch_dir), job_dir)
+    create_submit_script(
+        dolog, submit_script, os.path.abspath(job_script), n_pilots
+    )
+    os.chmod(job_script, 0o755)
+
+    os.system(f"condor_submit {submit_script}")
+    logger.info(f"Submitted {n_pilots} pilot workers for {batch_dir}.")
+
+    return
+
+
+def submit_jobs(batch_dir, option_dicts, dolog, cache=False, engine='rdf'):
+    """
+    Submit the jobs of the options.json in a batch directory,
+    one condor process per job.
+    """
+    options_file = os.path.join(batch_dir, 'options.json')
+
+    # only submit the jobs without cached results
+    indices = None
+    if cache:
+        indices = restore_cached(option_dicts)
+        if not indices:
+            logger.info("All jobs are cached. Nothing to submit.")
+            return
+
+    # create the job script
+    n_processes = len(option_dicts) if indices is None else len(indices)
+    if not n_processes:
+        return
+
+    job_script = os.path.join(batch_dir, f"job.sh")
+    submit_script = os.path.join(batch_dir, f"submit.sub")
+    job_dir = os.path.abspath(__file__).replace('hist_manager.py', '')
+
+    options_file_abs = os.path.abspath(options_file)
+    job_script_abs = os.path.abspath(job_script)
+
+    script = 'columnar.py' if engine == 'columnar' else 'hist_process.py'
+    create_job_script(job_script, options_file_abs, job_dir, script)
+    create_submit_script(
+        dolog, submit_script, job_script_abs, n_processes, indices
+    )
+
+    # make sure the scripts are executable
+    os.chmod(job_script, 0o755)
+    os.chmod(submit_script, 0o644)
+
+    logger.info(f"Created job script {job_script} and submit script {submit_script}")
+
+    # submit the jobs and record their ids for the monitoring
+    tracker = JobTracker(batch_dir)
+    tracker.reset(dolog)
+    tracker.submit(
+        submit_script,
+        list(range(n_processes)) if indices is None else indices
+    )
+    logger.info(f"Submitted job with {n_processes} processes.")
+
+    return
+
+
+def get_job_size(option):
+    """
+    Expected size of a job, i.e. the number of entries to process.
+    """
+    return option.get('entries', 0)
+
+
+def limit_memory(max_memory):
+    """
+    Limit the memory (address space) of a worker process, given in MB.
+    """
+    if max_memory:
+        limit = int(max_memory) * 1024**2
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_local_job(option, max_memory, conn):
+    """
+    Run a single job in a worker process and send the error (or None).
+    """
+    limit_memory(max_memory)
+
+    error = None
+    try:
+        run_jobs([option])
+    except Exception as e:
+        error = repr(e)
+    conn.send(error)
+    conn.close()
+
+
+def run_local_jobs(option_dicts, njobs=1, max_memory=None):
+    """
+    Run the jobs on local processes, at most njobs at a time.
+    The jobs with the most entries are started first, such that the remaining small jobs
+    fill up the idle workers at the end. Every job runs in a fresh process,
+    whose exit code is checked, such that jobs killed e.g. by a segfault
+    or the memory limit are reported as failed.
+    """
+    import multiprocessing
+    from multiprocessing.connection import wait
+
+    pending = sorted(option_dicts, key=get_job_size, reverse=True)
+    logger.info(
+        f"Running {len(option_dicts)} jobs locally on {njobs} processes"
+        f" with a memory limit of {max_memory} MB per process."
+    )
+
+    failed = []
+    running = {}
+    finished = 0
+    while pending or running:
+        while pending and len(running) < njobs:
+            option = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=run_local_job, args=(option, max_memory, sender)
+            )
+            process.start()
+            sender.close()
+            running[process.sentinel] = (process, receiver, option)
+
+        for sentinel in wait(list(running)):
+            process, receiver, option = running.pop(sentinel)
+            process.join()
+            try:
+                error = receiver.recv()
+            except EOFError:
+                # killed before sending a result
+                error = f"Process exited with code {process.exitcode}"
+            receiver.close()
+            finished += 1
+
+            proc, cat = option['proc'], option['cat']
+            if error:
+                logger.error(f"Job for {proc} in category {cat} failed: {error}")
+                failed.append((proc, cat))
+            else:
+                logger.info(
+                    f"Finished job for {proc} in category {cat}"
+                    f" ({finished}/{len(option_dicts)})."
+                )
 
+    if failed:
+        logger.error(f"{len(failed)} jobs failed: {failed}")
 
-# TODO: add method to run the histograms such that a max number of events is processed in one job
\ No newline at end of file
+    return failed
@@ -1,8 +1,25 @@
 import ROOT
-from glob import glob
+import os
 import sys
 import logging
 import json
+from math import prod
+
+# run as batch script from this directory or imported from the package
+try:
+    from .columns import find_columns, get_selection_expressions
+    from .compiled import get_calls, compiled_calls, build_library, CACHE_DIR
+    from .cache import store_result
+    from .metrics import start_metrics, job_metrics, job_info, write_metrics, sidecar_path, output_size
+    from .planner import plan_expressions, order_definitions
+    from .filters import order_filters
+except ImportError:
+    from columns import find_columns, get_selection_expressions
+    from compiled import get_calls, compiled_calls, build_library, CACHE_DIR
+    from cache import store_result
+    from metrics import start_metrics, job_metrics, job_info, write_metrics, sidecar_path, output_size
+    from planner import plan_expressions, order_definitions
+    from filters import order_filters
 
 
 logging.basicConfig(
@@ -14,11 +31,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# time of the first entry of an event loop, which separates the
+# JIT compilation at the start of the loop from the processing
+ROOT.gInterpreter.Declare("""
+#include <atomic>
+#include <chrono>
+#include <deque>
+#include <functional>
+
+namespace hist_timing {
+    std::deque<std::atomic<long long>> first_entry;
+
+    long long now() {
+        return std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::steady_clock::now().time_since_epoch()
+        ).count();
+    }
+
+    int new_clock() {
+        first_entry.emplace_back(0);
+        return first_entry.size() - 1;
+    }
+
+    long long get_first_entry(int id) {
+        return first_entry[id].load();
+    }
+
+    std::function<void(ULong64_t &)> on_first_entry(int id) {
+        return [id](ULong64_t &) {
+            long long unset = 0;
+            first_entry[id].compare_exchange_strong(unset, now());
+        };
+    }
+}
+""")
+
 
 class HistMaker:
     """
     Class to setup rdf for specific process w/ baseselection.
     Then, different additional selections can be applied and the histograms built.
+    Several selections (variations) can branch off the same dataframe,
+    such that all of them are filled in one pass over the input files.
     """
 
     def __init__(
@@ -26,16 +80,57 @@ class HistMaker:
         definitions={}, 
         region_selection={}, process_selection={},
         weights={},
-        nthreads=1
+        nthreads=1,
+        selection='Nominal',
+        selections=None,
+        entry_range=None,
+        prune_branches=False,
+        compiled=None,
+        categorical=False,
+        cse=False,
+        filter_stats=None
     ):
         """
         Initialize the histogram class.
+        selections = {name: {definitions, region_selection, weights,
+        weight_factors}}
+        If not given, a single selection is built from the
+        definitions, region_selection and weights arguments.
+        weight_factors = {name: factor} are variations given as
+        multiplicative factors on the nominal weight.
+        vary = {variation: [columns]} are systematic (up/dn) variations of
+        input columns, filled in the same event loop via RDataFrame Vary.
+        entry_range = [start, stop] restricts the processed entries.
+        prune_branches: disable all branches (and friends) not referenced by
+        the selections; the histogram variables have to be given as 'hists'
+        in the selections.
+        compiled: path of the expression library built before the jobs
+        (see build_job_library), whose functions are used instead of JIT
+        compiling the expressions. True to only collect the functions.
+        categorical: the selections differ only in mutually exclusive
+        region selection clauses (see categorical.py). Instead of one
+        branch per selection, each histogram is filled once with an
+        additional axis of the selection index and split up afterwards.
+        cse: hoist the common subexpressions of the columns and filters of
+        all selections into columns on the common node (see planner.py).
+        filter_stats = {clause: [pass fraction, cost]}: if given, the
+        filters are split into their clauses and applied cheapest and
+        most selective first (see filters.py).
         """
 
+        if selections is None:
+            selections = {
+                selection: {
+                    'definitions': definitions,
+                    'region_selection': region_selection,
+                    'weights': weights,
+                }
+            }
+
         logger.info(
             f"Initializing HistMaker for {proc} in category {cat}"\
             f" with files {files} and friends {friends}"
-            f" and weights {weights}."
+            f" and selections {list(selections.keys())}."
             f" Using {nthreads} threads."
         )
 
@@ -43,30 +138,81 @@ class HistMaker:
         self.category = cat
         self.process = proc
         self.friends = friends
-        self.weights = weights
-        self.region_selection = region_selection
         self.process_selection = process_selection
+        self.selections = {}
         self.histograms = []
-        self.definitions = definitions
+        self.booked = []
+        self.entry_range = entry_range
+        self.compiled = compiled
+        self.categorical = categorical
+        self.categories = None
+        self.cse = cse
+        self.operations = None
+        self.filter_stats = filter_stats
+        self.calls = {}
+        self.functions = []
+        self.branch_bytes = {}
+        self.timing = {}
+        self.start = None
 
-        if nthreads > 1:
+        # ranges are not supported in multi-threaded event loops
+        if nthreads > 1 and entry_range:
+            logger.warning(
+                f"Entry range {entry_range} given. Running single-threaded."
+            )
+        elif nthreads > 1:
             ROOT.EnableImplicitMT(nthreads)
 
-        for proc in self.files:
-            if isinstance(proc, str):
-                self.samples = glob(proc)
-            else:
-                self.files = proc
+        self.friends = self.get_friends()
         self.load_chain()
-        self.create_df()
+        if prune_branches:
+            self.prune_branches(selections)
+        self.create_df(selections)
 
         return
 
 
+    def get_friends(self):
+        """
+        Get the friends to load. The merged friend (friends/merged) is used
+        instead of the single friends it contains, if it is newer than each
+        of them for all files. Friends which are not merged, e.g. the
+        weight friend, are loaded in addition.
+        """
+        if not self.friends:
+            return self.friends
+
+        for file in self.files:
+            if not os.path.isfile(file.replace("ntuples", "friends/merged")):
+                return self.friends
+
+        # check which friends have been merged
+        tf = ROOT.TFile.Open(self.files[0].replace("ntuples", "friends/merged"))
+        merged = tf.Get('friends')
+        merged = merged.GetTitle().split(',') if merged else []
+        tf.Close()
+
+        covered = [f for f in self.friends if f in merged]
+        if not covered:
+            return self.friends
+
+        for file in self.files:
+            mtime = os.path.getmtime(file.replace("ntuples", "friends/merged"))
+            for friend in covered:
+                f_friend = file.replace("ntuples", f"friends/{friend}")
+                if os.path.isfile(f_friend) and os.path.getmtime(f_friend) > mtime:
+                    return self.friends
+
+        logger.info(f"Using merged friend instead of {covered}.")
+        return ['merged'] + [f for f in self.friends if f not in covered]
+
+
     def load_chain(self):
         """
-        Load the dataframe from the ROOT files.
+        Load the dataframe from the ROOT files with the friends
+        in self.friends (see get_friends).
         """
+
         # initialize main chain and friend chains
         chain = ROOT.TChain('ntuple')
         ch_friends = {}
@@ -91,46 +237,429 @@ class HistMaker:
             chain.AddFriend(ch_friends[friend])
         
         self.chain = chain
+        self.ch_friends = ch_friends
         
         return
 
 
-    def create_df(self):
+    def prune_branches(self, selections):
+        """
+        Disable all branches which are not referenced by any expression
+        of the selections. Friends without any needed branch are removed.
+        """
+        expressions = list(self.process_selection)
+        for sel in selections.values():
+            expressions += get_selection_expressions(sel)
+
+        chains = {'ntuple': self.chain, **self.ch_friends}
+
+        needed = {}
+        tree_bytes, enabled_bytes = {}, {}
+        for name, chain in chains.items():
+            chain.LoadTree(0)
+            tree = chain.GetTree()
+            if not tree:
+                logger.warning(f"Could not load tree of {name}. Not pruning.")
+                return
+
+            branches = [b.GetName() for b in tree.GetListOfBranches()]
+            needed[name] = find_columns(expressions, branches)
+
+            # compressed sizes of the first file
+            tree_bytes[name] = tree.GetZipBytes()
+            enabled_bytes[name] = sum(
+                b.GetZipBytes('*') for b in tree.GetListOfBranches()
+                if b.GetName() in needed[name]
+            )
+            if needed[name] and tree.GetEntries():
+                self.branch_bytes[name] = enabled_bytes[name] / tree.GetEntries()
+
+        # rebuild the chain without unneeded friends, the friends are
+        # not chosen again, such that needed covers all of them
+        unneeded = [f for f in self.friends if not needed[f]]
+        if unneeded:
+            # RDataFrame only reads the used columns, only removing
+            # friends saves reads (file opens and metadata)
+            logger.info(
+                f"Removing friends without needed columns: {unneeded}"
+                f" ({sum(tree_bytes[f] for f in unneeded) / 1024**2:.1f} MB"
+                f" in the first file)."
+            )
+            self.friends = [f for f in self.friends if needed[f]]
+            self.load_chain()
+            chains = {'ntuple': self.chain, **self.ch_friends}
+
+        for name, chain in chains.items():
+            chain.SetBranchStatus('*', 0)
+            for branch in needed[name]:
+                chain.SetBranchStatus(branch, 1)
+
+        logger.info(
+            f"Enabled {sum(len(needed[n]) for n in chains)} branches in"
+            f" {len(chains)} trees with"
+            f" {sum(enabled_bytes[n] for n in chains) / 1024**2:.1f} MB"
+            f" in the first file."
+        )
+
+        return
+
+
+    def create_df(self, selections):
         """
         Create a dataframe from the ROOT TChain.
+        The process selection is applied on a common node, from which
+        the region selections branch off.
         """
         # create rdf without selections
         logger.debug('Creating RDataFrame for %s', self.process)
         rdf = ROOT.RDataFrame(self.chain)
+        self.rdf_root = rdf
+
+        if self.entry_range:
+            rdf = rdf.Range(*self.entry_range)
+
+        # systematic variations of input columns
+        vary = {}
+        for sel in selections.values():
+            vary.update(sel.get('vary', {}))
+        rdf = self.vary_columns(rdf, vary)
+
+        # all processed entries, the first one marks the end of the JIT
+        self.entries = rdf.Count()
+        self.clock = ROOT.hist_timing.new_clock()
+        self.entries.OnPartialResult(
+            self.entries.kOnce, ROOT.hist_timing.on_first_entry(self.clock)
+        )
+
+        # filter clauses ordered by their measured pass fraction and cost,
+        # the categories keep their clauses (see define_categories)
+        if self.filter_stats:
+            self.process_selection = order_filters(
+                self.process_selection, self.filter_stats
+            )
+            if not self.categorical:
+                selections = {
+                    name: {
+                        **sel,
+                        'region_selection': {
+                            f'filter_{i}': clause for i, clause in enumerate(
+                                order_filters(
+                                    sel['region_selection'].values(),
+                                    self.filter_stats
+                                )
+                            )
+                        },
+                    }
+                    for name, sel in selections.items()
+                }
+            logger.info(f"Ordered process filters: {self.process_selection}")
+            for name, sel in selections.items():
+                logger.info(
+                    f"Ordered filters of {name}:"
+                    f" {list(sel['region_selection'].values())}"
+                )
+
+        # columns needed by the selections, (name, expression) pairs
+        columns = {}
+        for name, sel in selections.items():
+            columns[name] = [
+                (var+'_weight', expr) for var, expr in sel['weights'].items()
+            ] + list(sel['definitions'].items())
+
+            # multiplicative weight variations are collected in one vector
+            factors = sel.get('weight_factors', {})
+            if factors:
+                expr = 'ROOT::RVecD{' + ', '.join(factors.values()) + '}'
+                columns[name].append(('weight_factors', expr))
+
+        # columns with the same expression in all selections are shared
+        expressions = {}
+        for cols in columns.values():
+            for var, expr in cols:
+                expressions.setdefault(var, set()).add(expr)
+
+        shared = []
+        for cols in columns.values():
+            for var, expr in cols:
+                if len(expressions[var]) == 1 and (var, expr) not in shared:
+                    shared.append((var, expr))
+
+        hoisted = []
+        if self.cse:
+            selections, columns, shared, hoisted = \
+                self.plan(selections, columns, shared)
+
+        if self.compiled:
+            self.compile(rdf, selections, columns, hoisted)
 
         # defining variables necessary for filtering/plotting
-        for var, expr in self.weights.items():
-            logger.debug(f"Defining {var} with {expr}")
-            rdf = rdf.Define(var+'_weight', expr)
+        definitions = [(var, expr, define_kind(var)) for var, expr in shared]
+        if hoisted:
+            definitions = order_definitions(definitions + hoisted)
 
-        for var, expr in self.definitions.items():
+        for var, expr, kind in definitions:
             logger.debug(f"Defining {var} with {expr}")
-            rdf = rdf.Define(var, expr)
+            rdf = rdf.Define(var, self.expression(expr, kind))
 
         # perform selection for corresponding process
         for filter in self.process_selection:
             logger.debug(f"Filtering {filter}")
-            rdf = rdf.Filter(filter)
+            rdf = rdf.Filter(self.expression(filter, 'filter'))
 
-        # perform selection for corresponding (signal) region
-        for sel, expr in self.region_selection.items():
-            rdf = rdf.Filter(expr)
+        self.rdf_base = rdf
 
-        self.rdf = rdf
+        # book the count lazily, it is filled in the same event loop
+        self.count = rdf.Count()
+
+        if self.categorical:
+            self.define_categories(rdf, selections, columns, shared)
+
+        for name, sel in selections.items():
+            node = rdf
+
+            # all categories are filled from one node
+            if self.categorical:
+                node = self.categories['rdf']
+
+            # columns differing between selections are defined per branch
+            for var, expr in columns[name]:
+                if (var, expr) not in shared and not self.categorical:
+                    logger.debug(f"Defining {var} with {expr} for {name}")
+                    node = node.Define(var, self.expression(expr, define_kind(var)))
+
+            # perform selection for corresponding (signal) region
+            for sel_name, expr in sel['region_selection'].items():
+                if not self.categorical:
+                    node = node.Filter(self.expression(expr, 'filter'))
+
+            self.selections[name] = {
+                'rdf': node,
+                'weights': sel['weights'],
+                'weight_factors': list(sel.get('weight_factors', {}).keys()),
+                'vary': bool(sel.get('vary')),
+                'varied': [],
+                'booked': [],
+                'histograms': [],
+            }
+
+        # first selection is the default one
+        self.selection = list(self.selections.keys())[0]
+        self.rdf = self.selections[self.selection]['rdf']
+        self.weights = self.selections[self.selection]['weights']
 
         logger.debug(
             f"Created dataframe for {self.process} with"
-            f" entries: {rdf.Count().GetValue()}"
+            f" {len(self.selections)} selection(s)"
         )
 
         return
     
 
+    def plan(self, selections, columns, shared):
+        """
+        Hoist the subexpressions evaluated several times per event into
+        columns defined once on the common node (see planner.py), e.g. the
+        nominal weight product of all weight variations or the clauses of
+        all selections. Columns defined per selection are not hoisted.
+        Returns the rewritten selections, columns and shared columns and
+        the hoisted columns [(name, expression, kind)].
+        """
+        blocked = {
+            var for cols in columns.values() for var, expr in cols
+            if (var, expr) not in shared
+        }
+
+        # shared columns are evaluated once, the others in each branch
+        expressions = list(self.process_selection)
+        expressions += [expr for _, expr in shared]
+        for name, sel in selections.items():
+            expressions += [
+                expr for var, expr in columns[name] if (var, expr) not in shared
+            ]
+            expressions += list(sel['region_selection'].values())
+
+        # all categories are filled from one node
+        if self.categorical:
+            expressions = list(dict.fromkeys(expressions))
+
+        plan = plan_expressions(expressions, blocked)
+
+        def rewritten(expr):
+            return plan['rewritten'].get(expr, expr)
+
+        self.process_selection = [rewritten(f) for f in self.process_selection]
+        shared = [(var, rewritten(expr)) for var, expr in shared]
+        columns = {
+            name: [(var, rewritten(expr)) for var, expr in cols]
+            for name, cols in columns.items()
+        }
+        selections = {
+            name: {
+                **sel,
+                'region_selection': {
+                    key: rewritten(expr)
+                    for key, expr in sel['region_selection'].items()
+                },
+            }
+            for name, sel in selections.items()
+        }
+
+        self.operations = {
+            'hoisted': len(plan['hoisted']),
+            'before': plan['before'],
+            'after': plan['after'],
+        }
+        logger.info(
+            f"Hoisted {len(plan['hoisted'])} common subexpressions for"
+            f" {self.process}: {plan['after']} instead of {plan['before']}"
+            f" operations per event."
+        )
+
+        return selections, columns, shared, plan['hoisted']
+
+
+    def define_categories(self, rdf, selections, columns, shared):
+        """
+        Define the index of the selection an event belongs to, from one
+        categorical axis per differing region selection clause, e.g. the
+        isolation bins and the charge. The clauses common to all
+        selections are applied once, columns differing between selections
+        are defined with the expression of the respective selection.
+        """
+        names = list(selections)
+        clauses = [sel['region_selection'] for sel in selections.values()]
+
+        axes = {}
+        for key, expr in clauses[0].items():
+            values = []
+            for clause in clauses:
+                if clause[key] not in values:
+                    values.append(clause[key])
+
+            if len(values) == 1:
+                rdf = rdf.Filter(self.expression(expr, 'filter'))
+            else:
+                axes[key] = values
+
+        if not axes:
+            raise ValueError(f"Selections {names} do not differ in any clause.")
+
+        # index along each axis, -1 if no category matches
+        for key, values in axes.items():
+            index = '-1'
+            for i in reversed(range(len(values))):
+                index = f"({self.expression(values[i], 'filter')}) ? {i} : ({index})"
+            rdf = rdf.Define(f'category_{key}', f'int({index})')
+
+        # selection index of each combination of categories
+        table = [-1] * prod(len(values) for values in axes.values())
+        for i, clause in enumerate(clauses):
+            flat = 0
+            for key, values in axes.items():
+                flat = flat * len(values) + values.index(clause[key])
+            table[flat] = i
+
+        flat = '0'
+        for key, values in axes.items():
+            flat = f'({flat}) * {len(values)} + category_{key}'
+        valid = ' && '.join(f'category_{key} >= 0' for key in axes)
+        rdf = rdf.Define(
+            'category',
+            f"static const std::vector<int> table{{{', '.join(map(str, table))}}};"
+            f"return ({valid}) ? table[{flat}] : -1;"
+        )
+        rdf = rdf.Filter('category >= 0')
+
+        # columns with different expressions per selection
+        exprs = {}
+        for i, name in enumerate(names):
+            for var, expr in columns[name]:
+                if (var, expr) not in shared:
+                    exprs.setdefault(var, {}).setdefault(expr, []).append(i)
+
+        for var, groups in exprs.items():
+            groups = list(groups.items())
+            kind = define_kind(var)
+            value = f'({self.expression(groups[-1][0], kind)})'
+            for expr, indices in reversed(groups[:-1]):
+                cond = ' || '.join(f'category == {i}' for i in indices)
+                value = f'({cond}) ? ({self.expression(expr, kind)}) : {value}'
+            logger.debug(f"Defining {var} per category with {value}")
+            rdf = rdf.Define(var, value)
+
+        logger.info(
+            f"Filling {len(names)} selections as categories of"
+            f" {', '.join(f'{k} ({len(v)})' for k, v in axes.items())}."
+        )
+
+        self.categories = {
+            'rdf': rdf,
+            'histos': {},
+            'varied': {},
+            'factors': {},
+        }
+
+        return
+
+
+    def compile(self, rdf, selections, columns, hoisted=[]):
+        """
+        Use the compiled definitions, weights and filters of the library
+        or collect their functions to build it (see compiled.py).
+        columns = {selection: [(name, expression)]} of the defined columns
+        hoisted = [(name, expression, kind)] of the common subexpressions
+        """
+        expressions = [(f, 'filter') for f in self.process_selection]
+        types = {}
+        for var, expr, kind in hoisted:
+            expressions.append((expr, kind))
+            types[var] = 'bool' if kind == 'filter' else 'double'
+        for name, sel in selections.items():
+            for var, expr in columns[name]:
+                expressions.append((expr, define_kind(var)))
+                types[var] = 'ROOT::RVecD' if var == 'weight_factors' else 'double'
+            expressions += [
+                (expr, 'filter') for expr in sel['region_selection'].values()
+            ]
+
+        calls, self.functions = get_calls(rdf, expressions, types)
+        if self.compiled is not True:
+            self.calls = compiled_calls(self.compiled, calls)
+
+        return
+
+
+    def expression(self, expr, kind):
+        """
+        Get the call of the compiled expression, if available.
+        """
+        return self.calls.get((expr, kind), expr)
+
+
+    def vary_columns(self, rdf, vary):
+        """
+        Register up and down variations of input columns with RDataFrame Vary.
+        The shifted columns are named {column}_{variation}{up/dn}, all columns
+        of one variation are varied together.
+        """
+        # columns varied together need the same type
+        columns = sorted({col for cols in vary.values() for col in cols})
+        for col in columns:
+            rdf = rdf.Redefine(col, f'(double){col}')
+
+        for name, cols in vary.items():
+            shifts = ', '.join(
+                f'{{(double){col}_{name}up, (double){col}_{name}dn}}'
+                for col in cols
+            )
+            logger.debug(f"Varying {cols} for variation {name}")
+            rdf = rdf.Vary(
+                cols, f'ROOT::RVec<ROOT::RVecD>{{{shifts}}}', ['up', 'dn'], name
+            )
+
+        return rdf
+
+
     def add_overflow(self, histo, nbins):
         """
         Add overflow to last bin
@@ -152,19 +681,27 @@ class HistMaker:
         return histo
 
 
-    def make_hists(self, hists):
+    def make_hists(self, hists, selection=None):
         """
-        Create histograms from the dataframe.
+        Book histograms on the dataframe.
         hists = {}
+        The histograms are only booked here, such that all of them are
+        filled in a single event loop (see run).
         """
+        if selection is None:
+            selection = self.selection
+        sel = self.selections[selection]
+
+        if self.categorical:
+            return self.make_categorical_hists(hists, selection)
 
-        rdf = self.rdf
+        rdf = sel['rdf']
         vars = rdf.GetColumnNames()
         logger.debug(f"Dataframe of process {self.process} has variables: {vars}")
 
-        # create the cpp objects for the histograms
+        # book the cpp objects for the histograms
         for var in hists:
-            for weight in self.weights:
+            for weight in sel['weights']:
                 hist = hists[var]
 
                 if weight+'_weight' not in vars:
@@ -189,34 +726,540 @@ class HistMaker:
                     ),
                     var,
                     weight+'_weight'
-                ).Clone()
+                )
 
-                if hist['overflow']:
-                    logger.info('Adding overflow.')
-                    histo = self.add_overflow(histo, hist['bins'][0])
+                sel['booked'].append((histo, hist, None))
+                self.booked.append(histo)
+
+                # systematic variations only for the nominal weight
+                if sel['vary'] and weight == 'Nominal':
+                    variations = ROOT.RDF.Experimental.VariationsFor(histo)
+                    sel['varied'].append((variations, hist, var))
+
+        # multiplicative weight variations are filled into one 2D histogram
+        # of observable vs. variation index, split up again in run
+        factors = sel['weight_factors']
+        if factors and 'Nominal_weight' in vars:
+            n = len(factors)
+            rdf = rdf.Define(
+                'factor_index',
+                f'ROOT::RVecD idx({n});'
+                f'for (int i = 0; i < {n}; i++) idx[i] = i + 0.5;'
+                'return idx;'
+            )
+            rdf = rdf.Define('factor_weight', 'Nominal_weight * weight_factors')
+
+            for var in hists:
+                hist = hists[var]
+
+                if var not in vars and 'ntuple.'+var not in vars:
+                    continue
+
+                rdf = rdf.Define(var+'_factor', f'ROOT::RVecD({n}, {var})')
+
+                histo = rdf.Histo2D(
+                    (
+                        f'{var}_weight_factors',
+                        '',
+                        hist['bins'][0],
+                        hist['bins'][1],
+                        hist['bins'][2],
+                        n,
+                        0,
+                        n
+                    ),
+                    var+'_factor',
+                    'factor_index',
+                    'factor_weight'
+                )
+
+                sel['booked'].append((histo, hist, factors))
+                self.booked.append(histo)
+
+        logger.info(
+            f"Booked {len(sel['booked'])} histograms for {self.process}"
+            f" in selection {selection}."
+        )
+
+        return
+
+
+    def make_categorical_hists(self, hists, selection):
+        """
+        Book the histograms of a selection with the selection index as
+        additional axis. Histograms needed by several selections are
+        booked once and split up in run.
+        """
+        sel = self.selections[selection]
+        sel['hists'] = hists
+        categories = self.categories
+        n = len(self.selections)
+
+        rdf = categories['rdf']
+        vars = rdf.GetColumnNames()
+
+        for var, hist in hists.items():
+            if var not in vars and 'ntuple.'+var not in vars:
+                logger.warning(
+                    f"Variable {var} not found in dataframe for {self.process}"
+                )
+                continue
+
+            for weight in sel['weights']:
+                if (var, weight) in categories['histos']:
+                    continue
+
+                histo = rdf.Histo2D(
+                    (
+                        f'{var}_{weight}_categories', '',
+                        hist['bins'][0], hist['bins'][1], hist['bins'][2],
+                        n, 0, n
+                    ),
+                    var, 'category', weight+'_weight'
+                )
+                categories['histos'][(var, weight)] = histo
+                self.booked.append(histo)
+
+                # systematic variations only for the nominal weight
+                if sel['vary'] and weight == 'Nominal':
+                    categories['varied'][var] = \
+                        ROOT.RDF.Experimental.VariationsFor(histo)
+
+            # multiplicative weight variations with the variation index
+            # as second and the selection index as third axis
+            factors = sel['weight_factors']
+            if not factors or var in categories['factors']:
+                continue
+
+            nf = len(factors)
+            if 'factor_index' not in vars:
+                rdf = rdf.Define(
+                    'factor_index',
+                    f'ROOT::RVecD idx({nf});'
+                    f'for (int i = 0; i < {nf}; i++) idx[i] = i + 0.5;'
+                    'return idx;'
+                )
+                rdf = rdf.Define('factor_weight', 'Nominal_weight * weight_factors')
+                rdf = rdf.Define('category_factor', f'ROOT::RVecD({nf}, category)')
+            rdf = rdf.Define(var+'_factor', f'ROOT::RVecD({nf}, {var})')
+            vars = rdf.GetColumnNames()
+
+            histo = rdf.Histo3D(
+                (
+                    f'{var}_weight_factors', '',
+                    hist['bins'][0], hist['bins'][1], hist['bins'][2],
+                    nf, 0, nf, n, 0, n
+                ),
+                var+'_factor', 'factor_index', 'category_factor', 'factor_weight'
+            )
+            categories['factors'][var] = histo
+            self.booked.append(histo)
+
+        # later bookings build on the defined factor columns
+        categories['rdf'] = rdf
+
+        logger.info(
+            f"Booked {len(categories['histos']) + len(categories['factors'])}"
+            f" categorical histograms for {self.process} with selection {selection}."
+        )
+
+        return
+
+
+    def split_categories(self):
+        """
+        Split the categorical histograms into the histograms of each
+        selection, named as in the separate selections.
+        Overflow is added after the split.
+        """
+        categories = self.categories
+
+        def targets(var):
+            for i, sel in enumerate(self.selections.values()):
+                if var in sel.get('hists', {}):
+                    yield i + 1, sel
+
+        def add(sel, histo, var):
+            histo.SetDirectory(ROOT.nullptr)
+            hist = sel['hists'][var]
+            if hist['overflow']:
+                histo = self.add_overflow(histo, hist['bins'][0])
+            sel['histograms'].append(histo)
+
+        for (var, weight), histo in categories['histos'].items():
+            histo2d = histo.GetValue()
+            for index, sel in targets(var):
+                if weight in sel['weights']:
+                    add(sel, histo2d.ProjectionX(f'{var}_{weight}', index, index, 'e'), var)
+
+        # name of varied histograms as in the separate selections
+        for var, variations in categories['varied'].items():
+            for key in variations.GetKeys():
+                if key == 'nominal':
+                    continue
+                name, tag = str(key).split(':')
+                for index, sel in targets(var):
+                    if sel['vary']:
+                        add(sel, variations[key].ProjectionX(
+                            f'{var}_{name}{tag}_Nominal', index, index, 'e'
+                        ), var)
+
+        for var, histo in categories['factors'].items():
+            histo3d = histo.GetValue()
+            for index, sel in targets(var):
+                for i, name in enumerate(sel['weight_factors']):
+                    add(sel, histo3d.ProjectionX(
+                        f'{var}_{name}', i+1, i+1, index, index, 'e'
+                    ), var)
+
+        categories['histos'] = {}
+        categories['varied'] = {}
+        categories['factors'] = {}
+
+        return
+
+
+    def run(self):
+        """
+        Run the event loop (if not done yet) and collect the histograms.
+        Overflow is only added after all histograms are filled.
+        """
+        if not self.booked:
+            return
+
+        self.start_timer()
+
+        if self.categorical:
+            self.split_categories()
+
+        for sel in self.selections.values():
+            for histo, hist, factors in sel['booked']:
+                if factors:
+                    histos = self.split_factors(histo.GetValue(), factors)
+                else:
+                    histos = [histo.GetValue().Clone()]
+
+                for histo in histos:
+                    if hist['overflow']:
+                        logger.debug('Adding overflow.')
+                        histo = self.add_overflow(histo, hist['bins'][0])
+
+                    sel['histograms'].append(histo)
+
+            # name of varied histograms as in the separate selections,
+            # e.g. pfmt_corr_scaleup_Nominal
+            for variations, hist, var in sel['varied']:
+                for key in variations.GetKeys():
+                    if key == 'nominal':
+                        continue
+                    name, tag = str(key).split(':')
+                    histo = variations[key].Clone(f'{var}_{name}{tag}_Nominal')
+                    histo.SetDirectory(ROOT.nullptr)
+
+                    if hist['overflow']:
+                        histo = self.add_overflow(histo, hist['bins'][0])
+
+                    sel['histograms'].append(histo)
+
+            sel['booked'] = []
+            sel['varied'] = []
+
+        self.booked = []
+        self.stop_timer()
+
+        logger.info(
+            f"Filled histograms of {self.process} with"
+            f" {self.count.GetValue()} entries passing the process selection"
+            f" in {self.n_event_loops()} event loop(s)."
+            f" JIT: {self.timing['jit']:.2f} s,"
+            f" event loop: {self.timing['event_loop']:.2f} s."
+        )
+
+        return
+
+
+    def start_timer(self):
+        """
+        Mark the start of the event loop.
+        """
+        if self.start is None:
+            self.start = ROOT.hist_timing.now()
+
+        return
+
+
+    def stop_timer(self):
+        """
+        Split the time of the event loop into the time until the first
+        entry (mostly JIT compilation) and the processing of the entries.
+        """
+        end = ROOT.hist_timing.now()
+        first = ROOT.hist_timing.get_first_entry(self.clock) or end
+
+        self.timing = {
+            'jit': (first - self.start) / 1e9,
+            'event_loop': (end - first) / 1e9,
+            'entries': self.entries.GetValue(),
+        }
+
+        return
+
+
+    def split_factors(self, histo2d, factors):
+        """
+        Split the 2D histogram of the weight factors into one histogram
+        per variation, named like the histograms of the other weights.
+        """
+        var = histo2d.GetName().replace('_weight_factors', '')
+
+        histos = []
+        for i, name in enumerate(factors):
+            histo = histo2d.ProjectionX(f'{var}_{name}', i+1, i+1, 'e')
+            histo.SetDirectory(ROOT.nullptr)
+            histos.append(histo)
+
+        return histos
+
+
+    def n_event_loops(self):
+        """
+        Number of event loops that have been run on this dataframe.
+        """
+        return self.rdf_root.GetNRuns()
 
-                self.histograms.append(histo)
-        
-        return        
-    
 
-    def save_hists(self, outpath, option="RECREATE"):
+    def bytes_read(self, total=None):
+        """
+        Bytes read per input tree and friend: the measured total of the
+        job split up by the compressed size of the enabled branches per
+        entry (see prune_branches). Without total, the estimate from
+        the branch sizes and the processed entries.
+        """
+        entries = self.timing.get('entries', 0)
+        estimate = {
+            name: size * entries for name, size in self.branch_bytes.items()
+        }
+        if total is None:
+            return {name: int(b) for name, b in estimate.items()}
+
+        if not sum(estimate.values()):
+            return {'ntuple': int(total)}
+
+        return {
+            name: int(total * b / sum(estimate.values()))
+            for name, b in estimate.items()
+        }
+
+
+    def save_hists(self, outpath, option="RECREATE", selection=None):
         """
         Save the histograms to a ROOT file.
         """
+        if selection is None:
+            selection = self.selection
+        sel = self.selections[selection]
+
+        # make sure that all booked histograms are filled
+        self.run()
+
         logger.debug(f"Saving histograms to {outpath} with option {option}")
         tf = ROOT.TFile(outpath, option)
 
-        for hist in self.histograms:
+        for hist in sel['histograms']:
             hist.SetDirectory(ROOT.nullptr)
             tf.cd()
             hist.Write()
 
         tf.Close()
-        self.histograms = []
+        sel['histograms'] = []
         return
+
+
+def define_kind(var):
+    """
+    Kind of a defined column for the expression compilation.
+    """
+    return 'factors' if var == 'weight_factors' else 'define'
+
+
+def get_selections(option):
+    """
+    Get the selections of a job option.
+    Jobs with a single selection store it directly in the option.
+    """
+    if 'selections' in option:
+        return option['selections']
+
+    return {option.get('selection', 'Nominal'): option}
+
+
+def build_job_library(options, cache_dir=CACHE_DIR):
+    """
+    Build the expression library of all jobs once before they are
+    started and set its path as 'compiled' of the options. The functions
+    are collected from the dataframes of the jobs on their first file,
+    jobs with the same expressions, e.g. split jobs, are set up once.
+    Expressions missing in the library (e.g. of files with other column
+    types) and jobs without library (e.g. if the compilation fails) are
+    JIT compiled.
+    """
+    options = [o for o in options if o.get('engine') != 'columnar']
+
+    # keys which do not change the expressions of a job
+    skipped = [
+        'files', 'entry_range', 'entries', 'cache', 'compiled',
+        'save_path', 'merge_path', 'proc', 'cat',
+    ]
+
+    def expressions_key(d):
+        return {k: v for k, v in d.items() if k not in skipped}
+
+    jobs = {}
+    for option in options:
+        if not option['files']:
+            continue
+        key = expressions_key(option)
+        if 'selections' in option:
+            key['selections'] = {
+                name: expressions_key(sel)
+                for name, sel in option['selections'].items()
+            }
+        jobs.setdefault(json.dumps(key, sort_keys=True), option)
+
+    functions = []
+    for option in jobs.values():
+        hist = HistMaker(
+            files=option['files'][:1],
+            cat=option['cat'],
+            proc=option['proc'],
+            friends=option['friends'],
+            process_selection=option['process_selection'],
+            selections=get_selections(option),
+            compiled=True,
+            categorical=option.get('categorical', False),
+            cse=option.get('cse', False),
+            filter_stats=option.get('filter_stats')
+        )
+        functions += hist.functions
+
+    library = build_library(functions, cache_dir) if functions else None
+    for option in options:
+        option['compiled'] = library
+
+    logger.info(
+        f"Built the expression library {library} of {len(options)} jobs"
+        f" from {len(jobs)} distinct jobs."
+    )
+
+    return library
+
+
+def run_graphs(hist_makers):
+    """
+    Run the event loops of several HistMakers concurrently
+    and collect their histograms.
+    """
+    handles = [hm.booked[0] for hm in hist_makers if hm.booked]
+    for hm in hist_makers:
+        hm.start_timer()
+
+    if len(handles) > 1:
+        logger.info(f"Running {len(handles)} computation graphs concurrently.")
+        ROOT.RDF.RunGraphs(handles)
+
+    for hm in hist_makers:
+        hm.run()
+
+    return
     
 
+def run_jobs(options, nthreads=None):
+    """
+    Run the jobs given by a list of option dicts within one process.
+    The event loops of all jobs are run concurrently.
+    Returns the timing of each job.
+    """
+    # jobs of the columnar engine do not need ROOT
+    if options and options[0].get('engine') == 'columnar':
+        try:
+            from .columnar import run_jobs as run_columnar_jobs
+        except ImportError:
+            from columnar import run_jobs as run_columnar_jobs
+        return run_columnar_jobs(options)
+
+    start = start_metrics()
+    bytes_start = ROOT.TFile.GetFileBytesRead()
+
+    hist_makers = []
+    for option in options:
+        if nthreads:
+            option['nthreads'] = nthreads
+
+        selections = get_selections(option)
+
+        hist = HistMaker(
+            files=option['files'],
+            cat=option['cat'],
+            proc=option['proc'],
+            friends=option['friends'],
+            process_selection=option['process_selection'],
+            nthreads=option['nthreads'],
+            selections=selections,
+            entry_range=option.get('entry_range'),
+            prune_branches=True,
+            compiled=option.get('compiled'),
+            categorical=option.get('categorical', False),
+            cse=option.get('cse', False),
+            filter_stats=option.get('filter_stats')
+        )
+        for name, sel in selections.items():
+            hist.make_hists(sel['hists'], name)
+        hist_makers.append(hist)
+
+    # fill all histograms of all jobs in one go
+    run_graphs(hist_makers)
+    bytes_process = ROOT.TFile.GetFileBytesRead() - bytes_start
+
+    # the measured bytes are shared by the jobs in proportion to
+    # their estimated reads
+    estimates = [sum(hist.bytes_read().values()) for hist in hist_makers]
+
+    for option, hist, estimate in zip(options, hist_makers, estimates):
+        save_paths = []
+        for name, sel in get_selections(option).items():
+            # outputs may be hard links into the result cache
+            if os.path.lexists(sel['save_path']):
+                os.remove(sel['save_path'])
+            hist.save_hists(sel['save_path'], 'recreate', name)
+            save_paths.append(sel['save_path'])
+        store_result(option)
+        logger.info(
+            f"Job for {option['proc']} in category {option['cat']} finished"
+            f" after {hist.n_event_loops()} event loop(s)."
+        )
+
+        # jobs in one process share the wall time, memory and file reads
+        write_metrics(sidecar_path(save_paths[0]), job_metrics(
+            start,
+            **job_info(option),
+            engine='rdf',
+            event_loops=hist.n_event_loops(),
+            jit=hist.timing['jit'],
+            event_loop=hist.timing['event_loop'],
+            entries=hist.timing['entries'],
+            bytes_read=hist.bytes_read(
+                bytes_process * estimate / sum(estimates) if sum(estimates)
+                else bytes_process / len(options)
+            ),
+            bytes_read_process=bytes_process,
+            output_bytes=output_size(save_paths),
+            jobs_in_process=len(options),
+            operations=hist.operations,
+        ))
+
+    return [hist.timing for hist in hist_makers]
+
+
 if __name__=='__main__':
     # for batch submission or local usage
     args = sys.argv
@@ -228,22 +1271,8 @@ if __name__=='__main__':
         options = json.load(f)
     logger.info(f"Loaded options from {options_file} for process {proc}")
 
-    # create the histogram maker
-    option = options[int(proc)]
-    if len(args) > 3:
-        option['nthreads'] = int(args[3])
-
-
-    hist = HistMaker(
-        files=option['files'],
-        cat=option['cat'],
-        proc=proc,
-        friends=option['friends'],
-        definitions=option['definitions'],
-        region_selection=option['region_selection'],
-        process_selection=option['process_selection'],
-        weights=option['weights'],
-        nthreads=option['nthreads']
-    )
-    hist.make_hists(option['hists'])
-    hist.save_hists(option['save_path'], 'recreate')
\ No newline at end of file
+    # several jobs can be given as comma separated list
+    indices = [int(i) for i in proc.split(',')]
+    nthreads = int(args[3]) if len(args) > 3 else None
+
+    run_jobs([options[i] for i in indices], nthreads)
@@ -0,0 +1,147 @@
+import ROOT
+from glob import glob
+import os
+import json
+import shutil
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_merge_targets(version):
+    """
+    Collect the partial outputs of all split jobs of a version.
+    Returns a dict {merged file: [partial files]}.
+    """
+    targets = {}
+    for options_file in glob(f'output/{version}/batch_jobs/*/*/options.json'):
+        with open(options_file, 'r') as f:
+            options = json.load(f)
+
+        for option in options:
+            selections = option['selections'].values() \
+                if 'selections' in option else [option]
+            for sel in selections:
+                if 'merge_path' not in sel:
+                    continue
+                targets.setdefault(sel['merge_path'], []).append(sel['save_path'])
+
+    return targets
+
+
+def check_file(f):
+    """
+    Check that the file exists, can be opened and is not a zombie.
+    """
+    if not os.path.isfile(f):
+        return False
+
+    tf = ROOT.TFile.Open(f, 'read')
+    if not tf:
+        return False
+
+    ok = not tf.IsZombie() and not tf.TestBit(ROOT.TFile.kRecovered)
+    tf.Close()
+
+    return ok
+
+
+def merge_histograms(inputs, output):
+    """
+    Sum the histograms with the same name in the input files
+    and save them to the output file.
+    """
+    merger = ROOT.TFileMerger(False, False)
+    merger.SetFastMethod(True)
+    merger.SetPrintLevel(0)
+    merger.OutputFile(output, 'RECREATE')
+
+    for f in inputs:
+        merger.AddFile(f)
+
+    if not merger.Merge():
+        raise RuntimeError(f"Merging {len(inputs)} files into {output} failed.")
+
+    return output
+
+
+def merge_job(args):
+    return merge_histograms(*args)
+
+
+def tree_merge(targets, njobs=1, fan_in=8):
+    """
+    Merge the inputs of all targets by a parallel tree reduction.
+    In each round, groups of fan_in files of all targets are merged in
+    parallel, until one file per target is left.
+    """
+    from multiprocessing import Pool
+
+    current = {output: list(inputs) for output, inputs in targets.items()}
+    tmp_dirs = {output: output.replace('.root', '_merge') for output in targets}
+
+    with Pool(njobs) as pool:
+        n_round = 0
+        while any(len(inputs) > 1 for inputs in current.values()):
+            tasks = []
+            for output, inputs in current.items():
+                if len(inputs) <= fan_in:
+                    # last merge of this target goes to the output directly
+                    if len(inputs) > 1:
+                        tasks.append((output, inputs, output))
+                    continue
+
+                os.makedirs(tmp_dirs[output], exist_ok=True)
+                for i in range(0, len(inputs), fan_in):
+                    tmp = os.path.join(tmp_dirs[output], f'round{n_round}_{i}.root')
+                    tasks.append((output, inputs[i:i+fan_in], tmp))
+
+            logger.info(f"Merge round {n_round}: {len(tasks)} merges.")
+
+            merged = pool.map(
+                merge_job, [(inputs, out) for _, inputs, out in tasks]
+            )
+
+            for output in current:
+                if len(current[output]) > 1:
+                    current[output] = []
+            for (output, _, _), out in zip(tasks, merged):
+                current[output].append(out)
+
+            n_round += 1
+
+    # single inputs are copied, temporary files removed
+    for output, inputs in current.items():
+        if inputs[0] != output:
+            shutil.copyfile(inputs[0], output)
+        shutil.rmtree(tmp_dirs[output], ignore_errors=True)
+
+    return
+
+
+def run_merge(version, njobs=1, fan_in=8):
+    """
+    Merge the partial outputs of all split jobs.
+    All expected partial outputs are checked before merging.
+    """
+    targets = get_merge_targets(version)
+    logger.info(
+        f"Merging partial outputs into {len(targets)} files"
+        f" with {njobs} processes."
+    )
+
+    complete = {}
+    for output, inputs in targets.items():
+        bad = [f for f in inputs if not check_file(f)]
+        if bad:
+            logger.error(
+                f"Missing or broken partial outputs for {output}: {bad}."
+                " Skipping."
+            )
+            continue
+        complete[output] = inputs
+
+    tree_merge(complete, njobs, fan_in)
+    logger.info(f"Merged {len(complete)}/{len(targets)} files.")
+
+    return [output for output in targets if output not in complete]
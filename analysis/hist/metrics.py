@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import resource
+import logging
+from glob import glob
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.metrics.json'
+
+
+def sidecar_path(output):
+    """
+    Path of the metrics sidecar next to an output file.
+    """
+    return os.path.splitext(output)[0] + SUFFIX
+
+
+def start_metrics():
+    """
+    Wall and CPU time at the start of a job.
+    """
+    return {'wall': time.time(), 'cpu': time.process_time()}
+
+
+def peak_rss_mb():
+    # kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def output_size(paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+
+def job_metrics(start, **fields):
+    """
+    Metrics of a job started at start (see start_metrics) with the
+    job specific fields, e.g. event loops, JIT time and bytes read.
+    Peak RSS, wall and CPU time are those of the whole process.
+    """
+    metrics = {
+        'wall': time.time() - start['wall'],
+        'cpu': time.process_time() - start['cpu'],
+        'peak_rss_mb': peak_rss_mb(),
+        'host': os.uname().nodename,
+    }
+    metrics.update(fields)
+
+    return metrics
+
+
+def job_info(option):
+    """
+    Identification of a histogram job in its metrics.
+    """
+    return {
+        'proc': option['proc'],
+        'cat': option['cat'],
+        'region': option.get('region', ''),
+        'variation': option.get('variation', ''),
+        'files': len(option['files']),
+        'entry_range': option.get('entry_range'),
+        'nthreads': option.get('nthreads', 1),
+    }
+
+
+def write_metrics(path, metrics):
+    """
+    Write the metrics sidecar of a job.
+    """
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(metrics, f, indent=4)
+    os.replace(tmp, path)
+
+    return
+
+
+def collect_metrics(directory):
+    """
+    Collect all metrics sidecars below a directory.
+    """
+    records = []
+    for path in glob(os.path.join(directory, '**', f'*{SUFFIX}'), recursive=True):
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Could not read metrics {path}.")
+            continue
+
+        record['path'] = path
+        records.append(record)
+
+    return records
+
+
+def job_name(record):
+    if 'proc' in record:
+        return f"{record.get('region', '')}/{record.get('variation', '')}" \
+               f"/{record['proc']}_{record['cat']}"
+    if 'correction' in record:
+        return f"{record['correction']}/{os.path.basename(record['input'])}"
+    return record['path']
+
+
+def print_table(title, records):
+    print(title)
+    print(
+        f"{'job':<60} {'wall':>8} {'cpu':>8} {'rss MB':>8} {'loops':>5}"
+        f" {'JIT':>7} {'entries':>11} {'read MB':>9} {'out MB':>7}"
+    )
+    for r in records:
+        print(
+            f"{job_name(r)[-60:]:<60} {r['wall']:>8.1f} {r['cpu']:>8.1f}"
+            f" {r['peak_rss_mb']:>8.0f} {r.get('event_loops', 0):>5}"
+            f" {r.get('jit', 0.):>7.2f} {r.get('entries', 0):>11}"
+            f" {sum(r.get('bytes_read', {}).values()) / 1024**2:>9.1f}"
+            f" {r.get('output_bytes', 0) / 1024**2:>7.1f}"
+        )
+    print()
+
+    return
+
+
+def report_metrics(version, n=10, directories=[]):
+    """
+    Aggregate the metrics of the jobs in output/{version}/batch_jobs
+    (and further directories, e.g. of the corrections) and list the
+    slowest and most memory-hungry jobs.
+    """
+    records = []
+    for directory in [f'output/{version}/batch_jobs'] + directories:
+        records += collect_metrics(directory)
+
+    if not records:
+        logger.warning(f"No job metrics found for version {version}.")
+        return records
+
+    total_wall = sum(r['wall'] for r in records)
+    total_cpu = sum(r['cpu'] for r in records)
+    total_read = sum(sum(r.get('bytes_read', {}).values()) for r in records)
+    print(
+        f"{len(records)} jobs: {total_wall / 3600:.2f} h wall,"
+        f" {total_cpu / 3600:.2f} h CPU, {total_read / 1024**3:.2f} GB read,"
+        f" max RSS {max(r['peak_rss_mb'] for r in records):.0f} MB\n"
+    )
+
+    print_table(
+        f"Slowest {n} jobs:",
+        sorted(records, key=lambda r: r['wall'], reverse=True)[:n]
+    )
+    print_table(
+        f"Most memory-hungry {n} jobs:",
+        sorted(records, key=lambda r: r['peak_rss_mb'], reverse=True)[:n]
+    )
+
+    return records
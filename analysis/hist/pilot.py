@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import socket
+import multiprocessing
+import logging
+
+# run as batch script from this directory or imported from the package
+try:
+    from .hist_process import run_jobs
+except ImportError:
+    from hist_process import run_jobs
+
+
+logger = logging.getLogger(__name__)
+
+LEASE = 900
+POLL = 30
+
+
+def queue_dirs(batch_dir):
+    """
+    Directories of the task queue next to the options.json.
+    A task moves from todo to claimed to done (or failed).
+    """
+    queue = os.path.join(batch_dir, 'queue')
+
+    return {
+        state: os.path.join(queue, state)
+        for state in ['todo', 'claimed', 'done', 'failed']
+    }
+
+
+def fill_queue(batch_dir, option_dicts, indices=None, chunk_size=1):
+    """
+    Put the jobs with the given indices into the queue, in chunks of
+    chunk_size jobs. The largest jobs are claimed first.
+    """
+    dirs = queue_dirs(batch_dir)
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+        for f in os.listdir(d):
+            os.remove(os.path.join(d, f))
+
+    if indices is None:
+        indices = range(len(option_dicts))
+    indices = sorted(
+        indices, key=lambda i: option_dicts[i].get('entries', 0), reverse=True
+    )
+
+    chunks = [indices[i:i+chunk_size] for i in range(0, len(indices), chunk_size)]
+    for n, chunk in enumerate(chunks):
+        # write and rename, such that no worker reads a partial task
+        task = os.path.join(dirs['todo'], f'task_{n:05d}.json')
+        with open(task + '.tmp', 'w') as f:
+            json.dump(chunk, f)
+        os.replace(task + '.tmp', task)
+
+    logger.info(f"Queued {len(indices)} jobs in {len(chunks)} tasks in {batch_dir}.")
+
+    return len(chunks)
+
+
+def list_tasks(directory):
+    return sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+
+
+def claim_task(dirs):
+    """
+    Claim the next task by moving it from todo to claimed.
+    The rename is atomic, such that only one worker gets each task.
+    Returns the path of the claimed task or None.
+    """
+    for task in list_tasks(dirs['todo']):
+        todo = os.path.join(dirs['todo'], task)
+        claimed = os.path.join(dirs['claimed'], task)
+        try:
+            # the lease starts now, the rename keeps the modification time
+            os.utime(todo)
+            os.rename(todo, claimed)
+        except FileNotFoundError:
+            # claimed by another worker
+            continue
+
+        return claimed
+
+    return None
+
+
+def requeue_expired(dirs, lease=LEASE):
+    """
+    Move claimed tasks without heartbeat for longer than the lease
+    back to todo, e.g. of workers which died or got stuck.
+    """
+    now = time.time()
+    for task in list_tasks(dirs['claimed']):
+        claimed = os.path.join(dirs['claimed'], task)
+        try:
+            if now - os.path.getmtime(claimed) < lease:
+                continue
+            os.rename(claimed, os.path.join(dirs['todo'], task))
+        except FileNotFoundError:
+            # finished or requeued in the meantime
+            continue
+
+        logger.warning(f"Lease of {task} expired. Requeued.")
+
+    return
+
+
+def execute_task(options, indices, conn):
+    """
+    Run the jobs of a task in the child process of the worker and send
+    the error (or None) to the worker.
+    """
+    error = None
+    try:
+        run_jobs([options[i] for i in indices])
+    except Exception as e:
+        error = repr(e)
+    conn.send(error)
+    conn.close()
+
+
+def run_task(dirs, claimed, options, lease=LEASE):
+    """
+    Run the jobs of a claimed task and move it to done or failed.
+    The jobs run in a child process, since the event loop holds the GIL
+    for its whole duration: the worker renews the lease meanwhile. If the
+    lease is lost anyway (e.g. the worker was suspended), the task is
+    stopped, such that no task is run twice at the same time.
+    """
+    with open(claimed, 'r') as f:
+        indices = json.load(f)
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(
+        target=execute_task, args=(options, indices, sender)
+    )
+    child.start()
+    sender.close()
+
+    while True:
+        child.join(lease / 4)
+        if not child.is_alive():
+            break
+        try:
+            os.utime(claimed)
+        except FileNotFoundError:
+            logger.error(
+                f"Lease of {os.path.basename(claimed)} lost. Stopping the task."
+            )
+            child.terminate()
+            child.join()
+            return
+
+    try:
+        error = receiver.recv()
+    except EOFError:
+        # killed before sending a result
+        error = f"Task process exited with code {child.exitcode}"
+    receiver.close()
+
+    state = 'failed' if error else 'done'
+    if error:
+        logger.error(f"Task {os.path.basename(claimed)} failed: {error}")
+
+    target = os.path.join(dirs[state], os.path.basename(claimed))
+    try:
+        os.rename(claimed, target)
+    except FileNotFoundError:
+        logger.error(f"Lease of {os.path.basename(claimed)} lost after the task.")
+        return
+
+    if error:
+        with open(target.replace('.json', '.err'), 'w') as f:
+            f.write(error)
+
+    return
+
+
+def run_pilot(batch_dirs, worker='', lease=LEASE, poll=POLL):
+    """
+    Pilot worker: claim and run tasks of the queues until all of them
+    are empty. ROOT is only loaded once for all tasks of the worker,
+    each task runs in a forked child process (see run_task).
+    Workers wait for the tasks claimed by others, which are requeued if
+    their lease expires.
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    n_tasks = 0
+
+    for batch_dir in batch_dirs:
+        with open(os.path.join(batch_dir, 'options.json'), 'r') as f:
+            options = json.load(f)
+        dirs = queue_dirs(batch_dir)
+
+        while True:
+            requeue_expired(dirs, lease)
+
+            claimed = claim_task(dirs)
+            if claimed:
+                logger.info(f"Worker {worker} claimed {claimed}.")
+                run_task(dirs, claimed, options, lease)
+                n_tasks += 1
+                continue
+
+            if not list_tasks(dirs['claimed']):
+                break
+            time.sleep(poll)
+
+    logger.info(f"Worker {worker} finished after {n_tasks} tasks.")
+
+    return n_tasks
+
+
+def run_local_pilots(batch_dirs, n_workers, lease=LEASE, poll=POLL):
+    """
+    Run the pilot workers as local processes.
+    Returns the failed tasks {batch directory: [task]}.
+    """
+    logger.info(f"Running {n_workers} local pilot workers.")
+    # no pool, whose daemonic workers could not start the task processes
+    workers = [
+        multiprocessing.Process(
+            target=run_pilot, args=(batch_dirs, f'local{i}', lease, poll)
+        )
+        for i in range(n_workers)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    failed = {}
+    for batch_dir in batch_dirs:
+        tasks = list_tasks(queue_dirs(batch_dir)['failed'])
+        if tasks:
+            logger.error(f"{len(tasks)} tasks in {batch_dir} failed.")
+            failed[batch_dir] = tasks
+
+    return failed
+
+
+if __name__ == '__main__':
+    # pilot worker on the batch system: python pilot.py <batch_dir> [worker]
+    batch_dir = sys.argv[1]
+    worker = sys.argv[2] if len(sys.argv) > 2 else ''
+
+    run_pilot([batch_dir], worker)
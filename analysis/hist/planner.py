@@ -0,0 +1,344 @@
+import re
+import logging
+from collections import Counter
+
+# run as batch script from this directory or imported from the package
+try:
+    from .expressions import parse, to_cpp
+    from .columns import get_identifiers
+except ImportError:
+    from expressions import parse, to_cpp
+    from columns import get_identifiers
+
+logger = logging.getLogger(__name__)
+
+# names of the columns of the hoisted subexpressions
+PREFIX = 'cse_'
+
+# operators with a boolean result, hoisted subexpressions are filters
+BOOLEAN = ['&&', '||', '==', '!=', '<', '>', '<=', '>=', '!']
+
+
+def normalize(tree):
+    """
+    Hashable form of a syntax tree (see expressions.Parser), with chains
+    of multiplications flattened into ('prod', factors).
+    """
+    kind = tree[0]
+
+    if kind == 'call':
+        return ('call', tree[1], tuple(normalize(a) for a in tree[2]))
+
+    if kind in ['unary', 'cast']:
+        return (kind, tree[1], normalize(tree[2]))
+
+    if kind == 'ternary':
+        return ('ternary',) + tuple(normalize(t) for t in tree[1:])
+
+    if kind == 'binary' and tree[1] == '*':
+        factors = []
+        for child in tree[2:]:
+            child = normalize(child)
+            factors += child[1] if child[0] == 'prod' else [child]
+        return ('prod', tuple(factors))
+
+    if kind == 'binary':
+        return ('binary', tree[1], normalize(tree[2]), normalize(tree[3]))
+
+    return tree
+
+
+def denormalize(tree):
+    """
+    Syntax tree of the normalized form, products as chains of binary '*'.
+    """
+    kind = tree[0]
+
+    if kind == 'prod':
+        factors = [denormalize(f) for f in tree[1]]
+        result = factors[0]
+        for factor in factors[1:]:
+            result = ('binary', '*', result, factor)
+        return result
+
+    if kind == 'call':
+        return ('call', tree[1], [denormalize(a) for a in tree[2]])
+
+    if kind in ['unary', 'cast']:
+        return (kind, tree[1], denormalize(tree[2]))
+
+    if kind == 'ternary':
+        return ('ternary',) + tuple(denormalize(t) for t in tree[1:])
+
+    if kind == 'binary':
+        return ('binary', tree[1], denormalize(tree[2]), denormalize(tree[3]))
+
+    return tree
+
+
+def children(tree):
+    kind = tree[0]
+    if kind == 'prod':
+        return tree[1]
+    if kind == 'call':
+        return tree[2]
+    if kind in ['unary', 'cast']:
+        return [tree[2]]
+    if kind == 'ternary':
+        return tree[1:]
+    if kind == 'binary':
+        return tree[2:]
+    return []
+
+
+def cost(tree):
+    """
+    Number of operations (operators and function calls) of a tree.
+    """
+    if tree[0] in ['num', 'col']:
+        return 0
+
+    ops = len(tree[1]) - 1 if tree[0] == 'prod' else 1
+    return ops + sum(cost(c) for c in children(tree))
+
+
+def columns(tree):
+    if tree[0] == 'col':
+        return {tree[1]}
+
+    result = set()
+    for child in children(tree):
+        result |= columns(child)
+    return result
+
+
+def unconditional(tree):
+    """
+    Subtrees evaluated whenever the tree is evaluated. The branches of
+    ternaries and the right hand side of && and || are skipped, such that
+    guarded expressions, e.g. divisions, are not hoisted out of the guard.
+    """
+    yield tree
+
+    kind = tree[0]
+    if kind == 'ternary':
+        subtrees = [tree[1]]
+    elif kind == 'binary' and tree[1] in ['&&', '||']:
+        subtrees = [tree[2]]
+    else:
+        subtrees = children(tree)
+
+    for child in subtrees:
+        yield from unconditional(child)
+
+
+def rewrite(tree, replace):
+    """
+    Apply replace to the subtrees in unconditional positions, top down.
+    replace returns the new subtree or None to descend into the subtree.
+    """
+    new = replace(tree)
+    if new is not None:
+        return new
+
+    kind = tree[0]
+
+    if kind == 'prod':
+        return ('prod', tuple(rewrite(f, replace) for f in tree[1]))
+
+    if kind == 'call':
+        return ('call', tree[1], tuple(rewrite(a, replace) for a in tree[2]))
+
+    if kind in ['unary', 'cast']:
+        return (kind, tree[1], rewrite(tree[2], replace))
+
+    if kind == 'ternary':
+        return ('ternary', rewrite(tree[1], replace), tree[2], tree[3])
+
+    if kind == 'binary':
+        right = tree[3] if tree[1] in ['&&', '||'] else rewrite(tree[3], replace)
+        return ('binary', tree[1], rewrite(tree[2], replace), right)
+
+    return tree
+
+
+def common_factors(trees, blocked):
+    """
+    Factors shared by several products, which save the most multiplications
+    if multiplied once: (size - 1) * (number of products - 1).
+    The set is grown greedily by the factor shared with most of the
+    products containing the set so far.
+    trees = [(tree, number of evaluations)]
+    """
+    candidates = [
+        Counter(sub[1]) for tree, n in trees for sub in unconditional(tree)
+        for _ in range(n) if sub[0] == 'prod'
+    ]
+
+    factors = Counter()
+    best, best_gain = None, 0
+    while True:
+        counts = Counter()
+        for product in candidates:
+            for factor, n in product.items():
+                if n > factors[factor] and not columns(factor) & blocked:
+                    counts[factor] += 1
+
+        if not counts:
+            break
+        factor, n = counts.most_common(1)[0]
+        if n < 2:
+            break
+
+        factors[factor] += 1
+        candidates = [p for p in candidates if p[factor] >= factors[factor]]
+
+        gain = (sum(factors.values()) - 1) * (len(candidates) - 1)
+        if gain > best_gain:
+            best, best_gain = Counter(factors), gain
+
+    return best
+
+
+def common_subtree(trees, blocked):
+    """
+    Subtree evaluated several times, which saves the most operations
+    if evaluated once: (evaluations - 1) * cost.
+    trees = [(tree, number of evaluations)]
+    """
+    counts = Counter()
+    for tree, n in trees:
+        for sub in unconditional(tree):
+            counts[sub] += n
+
+    best, best_gain = None, 0
+    for sub, n in counts.items():
+        gain = (n - 1) * cost(sub)
+        if gain > best_gain and not columns(sub) & blocked:
+            best, best_gain = sub, gain
+
+    return best
+
+
+def replace_factors(factors, name):
+    """
+    Replacement of the factors in the products containing all of them.
+    """
+    def replace(tree):
+        if tree[0] != 'prod':
+            return None
+
+        product = Counter(tree[1])
+        if any(product[f] < n for f, n in factors.items()):
+            return None
+
+        rest = Counter(factors)
+        result = []
+        for factor in tree[1]:
+            if rest[factor] > 0:
+                rest[factor] -= 1
+                if ('col', name) not in result:
+                    result.append(('col', name))
+            else:
+                result.append(factor)
+
+        return result[0] if len(result) == 1 else ('prod', tuple(result))
+
+    return replace
+
+
+def plan_expressions(expressions, blocked=set(), prefix=PREFIX):
+    """
+    Eliminate the common subexpressions of C++ expressions, e.g. the
+    product of the nominal weight factors in all weight variations or
+    the clauses shared by several selections. Shared factors of products
+    (in any order) and shared subtrees are hoisted into new columns
+    {prefix}{i} until nothing is saved anymore.
+    Expressions given several times are evaluated several times per event,
+    e.g. the same filter in several selections.
+    Subexpressions of the columns in blocked are not hoisted, e.g. columns
+    defined differently per selection. Expressions which cannot be parsed
+    are kept as they are.
+    Returns {'rewritten': {expression: new expression},
+    'hoisted': [(column, expression, kind)] in the order of definition,
+    'before': operations per event, 'after': operations per event}.
+    """
+    evaluations = Counter(expressions)
+    trees = {}
+    for expr in evaluations:
+        try:
+            trees[expr] = normalize(parse(expr))
+        except ValueError as e:
+            logger.debug(f"Not planning '{expr}': {e}")
+
+    original = dict(trees)
+    hoisted = {}
+    while True:
+        pool = [(t, evaluations[expr]) for expr, t in trees.items()]
+        pool += [(t, 1) for t in hoisted.values()]
+
+        name = f'{prefix}{len(hoisted)}'
+        factors = common_factors(pool, blocked)
+        if factors:
+            tree = ('prod', tuple(factors.elements()))
+            replace = replace_factors(factors, name)
+        else:
+            tree = common_subtree(pool, blocked)
+            if tree is None:
+                break
+            replace = lambda t, tree=tree, name=name: ('col', name) if t == tree else None
+
+        trees = {expr: rewrite(t, replace) for expr, t in trees.items()}
+        hoisted = {n: rewrite(t, replace) for n, t in hoisted.items()}
+        hoisted[name] = tree
+
+    definitions = []
+    for name, tree in hoisted.items():
+        kind = 'filter' if tree[0] in ['binary', 'unary'] and tree[1] in BOOLEAN \
+            else 'define'
+        definitions.append((name, to_cpp(denormalize(tree)), kind))
+
+    # number the columns in the order of definition
+    definitions = order_definitions(definitions)
+    names = {name: f'{prefix}{i}' for i, (name, _, _) in enumerate(definitions)}
+    pattern = re.compile(rf'\b{prefix}\d+\b')
+
+    def renamed(expr):
+        return pattern.sub(lambda m: names[m.group(0)], expr)
+
+    return {
+        'rewritten': {
+            expr: renamed(to_cpp(denormalize(tree))) for expr, tree in trees.items()
+            if tree != original[expr]
+        },
+        'hoisted': [
+            (names[name], renamed(expr), kind) for name, expr, kind in definitions
+        ],
+        'before': sum(cost(t) * evaluations[expr] for expr, t in original.items()),
+        'after': sum(cost(t) * evaluations[expr] for expr, t in trees.items())
+            + sum(cost(t) for t in hoisted.values()),
+    }
+
+
+def order_definitions(definitions):
+    """
+    Order definitions (column, expression, ...) such that each column is
+    defined after the columns it references.
+    """
+    names = {d[0] for d in definitions}
+    pending = list(definitions)
+    ordered = []
+    defined = set()
+    while pending:
+        ready = [
+            d for d in pending
+            if get_identifiers(d[1]) & names <= defined | {d[0]}
+        ]
+        if not ready:
+            raise ValueError(f"Circular definitions: {[d[0] for d in pending]}")
+
+        ordered += ready
+        defined |= {d[0] for d in ready}
+        pending = [d for d in pending if d[0] not in defined]
+
+    return ordered
@@ -1,17 +1,94 @@
+import os
 import logging
 
 import config as cfg
 
-from .hist_manager import ProcessManager
+from .hist_manager import (
+    ProcessManager, run_local_jobs, write_options, queue_jobs, submit_jobs, submit_pilots
+)
+from .merge import run_merge
+from .catalog import SampleCatalog
+from .cache import restore_cached
+from .tracker import monitor_jobs
+from .pilot import run_local_pilots
+from .skim import get_skim_config, is_fresh, skim_path, skim_job
 from .qcd import extrapolate_all
+from .categorical import fuse_categories, fuse_processes
+from .hist_process import build_job_library
+from .compiled import CACHE_DIR
 
 logger = logging.getLogger(__name__)
 
+FRIENDS = ['sf', 'xy', 'pu', 'ptweight', 'xsec', 'lepton', 'met_punom']
+
+
+def get_friends(args):
+    """
+    Friends read by the jobs, including the nominal weights
+    (corrections/correct.py --weights) if they are used.
+    """
+    return FRIENDS + ['weight'] if args.weightFriend else FRIENDS
+
+
+def run_catalog():
+    """
+    Refresh the sample catalog for all regions.
+    """
+    catalog = SampleCatalog()
+    for region in ['Z', 'Wp', 'Wm']:
+        logger.info(f"Updating sample catalog for region {region}...")
+        catalog.update(cfg.samples.get_samples(region), FRIENDS)
+
+
+def run_skim(args):
+    """
+    Produce the skims of all samples, using the loosest selection
+    of all regions and variations of the corresponding channel.
+    """
+    from multiprocessing import Pool
+
+    logger.info("Running the skimming mode.")
+
+    region_selections = cfg.selections.get_region_selections(args)
+    catalog = SampleCatalog()
+    friends = get_friends(args)
+
+    tasks = {}
+    for region in region_selections:
+        skim = get_skim_config(
+            region_selections, region, args.vary, args.weightFriend
+        )
+        logger.info(
+            f"Skim {skim['tag']} of region {region} keeps"
+            f" {len(skim['columns'])} columns."
+        )
+        logger.debug(f"Skim selection: {skim['selection']}")
+
+        for patterns in cfg.samples.get_samples(region).values():
+            for f in catalog.resolve_all(patterns):
+                if f in tasks or is_fresh(f, friends, skim['tag']):
+                    continue
+                tasks[f] = (
+                    f, friends, skim['selection'], skim['columns'],
+                    skim_path(f, skim['tag'])
+                )
+
+    logger.info(f"Skimming {len(tasks)} files with {args.jobs} processes.")
+
+    with Pool(args.jobs, maxtasksperchild=1) as pool:
+        for f_out, error in pool.imap_unordered(skim_job, tasks.values()):
+            if error:
+                logger.error(f"Skimming into {f_out} failed: {error}")
+
 
 def run_production(args):
     logger.info("Running the histogram production mode.")
 
     region_selections = cfg.selections.get_region_selections(args)
+    local_jobs = []
+    pilot_dirs = []
+    categorical_jobs = {}
+    catalog = SampleCatalog()
 
     for region in region_selections:
         logger.info(f"Processing region {region}...")
@@ -20,30 +97,179 @@ def run_production(args):
         samples = cfg.samples.get_samples(region)
         process_selections = cfg.selections.get_process_selection(region)
 
-        for variation in region_selections[region]:
-
-            histograms = cfg.binnings.get_histograms(region, variation)
-            definitions = cfg.definitions.get_definitions(variation)
-
-            process_manager = ProcessManager(
-                region=region,
-                files=samples,
-                filters={
-                    "region": region_selections,
-                    "process": process_selections,
-                },
-                definitions=definitions,
-                selection=variation,
-                binnings=histograms,
-                friends=['sf', 'xy', 'pu', 'ptweight', 'xsec', 'xy', 'lepton', 'met_punom'],
-                nthreads=1
-            )
-
-            if args.local:
-                process_manager.run_local()
+        filters = {
+            "region": region_selections,
+            "process": process_selections,
+        }
+        friends = get_friends(args)
+
+        # pt variations as systematic variations of the nominal columns
+        vary = cfg.definitions.get_momentum_variations(region) \
+            if args.vary else None
+
+        # fresh skims are read instead of the ntuples
+        skim = get_skim_config(
+            region_selections, region, args.vary, args.weightFriend
+        )
+
+        # the jobs of the W regions are fused after all are prepared,
+        # the processes only after the categories
+        categorical = args.categorical and not args.singlePass \
+            and region in ['Wp', 'Wm']
+        fuse = args.fuseProcesses and not categorical
+
+        if args.singlePass:
+            # all selection variations are filled in one pass per sample
+            variations = {}
+            for variation in region_selections[region]:
+                variations[variation] = {
+                    'definitions': cfg.definitions.get_definitions(variation),
+                    'binnings': cfg.binnings.get_histograms(region, variation),
+                }
+
+            process_managers = [
+                ProcessManager(
+                    region=region,
+                    files=samples,
+                    filters=filters,
+                    selection='single_pass',
+                    variations=variations,
+                    max_events=args.maxEvents,
+                    catalog=catalog,
+                    vary=vary,
+                    skim=skim,
+                    compiled=args.compile,
+                    cache=args.cache,
+                    fuse=fuse,
+                    weight_friend=args.weightFriend,
+                    cse=args.cse,
+                    order_filters=args.orderFilters,
+                    engine=args.engine,
+                    friends=friends,
+                    nthreads=1
+                )
+            ]
+
+        else:
+            process_managers = []
+            for variation in region_selections[region]:
+
+                histograms = cfg.binnings.get_histograms(region, variation)
+                definitions = cfg.definitions.get_definitions(variation)
+
+                process_managers.append(
+                    ProcessManager(
+                        region=region,
+                        files=samples,
+                        filters=filters,
+                        definitions=definitions,
+                        selection=variation,
+                        binnings=histograms,
+                        max_events=args.maxEvents,
+                        catalog=catalog,
+                        vary=vary,
+                        skim=skim,
+                        compiled=args.compile,
+                        cache=args.cache,
+                        fuse=fuse,
+                        weight_friend=args.weightFriend,
+                        cse=args.cse,
+                        order_filters=args.orderFilters,
+                        engine=args.engine,
+                        friends=friends,
+                        nthreads=1
+                    )
+                )
+
+        for process_manager in process_managers:
+            if categorical:
+                batch_dir, option_dicts = process_manager.prepare_jobs(
+                    args.version, build=False
+                )
+                categorical_jobs[batch_dir] = option_dicts
+            elif args.pilot and args.local:
+                pilot_dirs.append(process_manager.prepare_queue(args.version))
+            elif args.pilot:
+                process_manager.run_pilots(args.version, args.log, args.pilot)
+            elif args.local:
+                _, option_dicts = process_manager.prepare_jobs(args.version)
+                local_jobs += option_dicts
             else:
                 process_manager.run_batch(args.version, args.log)
 
+    if categorical_jobs:
+        local_jobs += run_categorical(categorical_jobs, args, pilot_dirs)
+
+    # resubmit failed jobs until all are done
+    if args.monitor and not args.local:
+        monitor_jobs(args.version)
+
+    if args.local:
+        # local pilot workers pull the jobs of all queues
+        if args.pilot:
+            run_local_pilots(pilot_dirs, args.pilot)
+
+        # all local jobs share one pool of processes
+        else:
+            if args.cache:
+                local_jobs = [local_jobs[i] for i in restore_cached(local_jobs)]
+            run_local_jobs(local_jobs, args.jobs, args.maxMemory)
+
+        # partial outputs of split jobs can be merged right away
+        if args.maxEvents:
+            run_merge(args.version, args.jobs)
+
+
+def run_categorical(jobs, args, pilot_dirs):
+    """
+    Fuse the jobs of the W regions, which differ only in the isolation
+    bin and the charge, into one job per sample (see categorical.py).
+    jobs = {batch directory: option dicts}. The fused jobs get their
+    own batch directory, the remaining jobs stay in theirs.
+    Returns the jobs to run locally.
+    """
+    all_jobs = [option for option_dicts in jobs.values() for option in option_dicts]
+    fused, rest = fuse_categories(all_jobs, cache=args.cache)
+
+    remaining = {id(option) for option in rest}
+    batches = {f'output/{args.version}/batch_jobs/W/categorical': fused}
+    for batch_dir, option_dicts in jobs.items():
+        batches[batch_dir] = [o for o in option_dicts if id(o) in remaining]
+
+    # processes on the same files are fused within each directory
+    if args.fuseProcesses:
+        for batch_dir, option_dicts in batches.items():
+            fused_procs, rest_procs = fuse_processes(option_dicts, args.cache)
+            batches[batch_dir] = rest_procs + fused_procs
+
+    # one expression library for the jobs of all directories
+    if args.compile:
+        build_job_library(
+            [o for option_dicts in batches.values() for o in option_dicts],
+            os.path.abspath(CACHE_DIR)
+        )
+
+    local_jobs = []
+    for batch_dir, option_dicts in batches.items():
+        # the options of each directory are rewritten, such that
+        # fused jobs are not merged twice
+        write_options(batch_dir, option_dicts)
+        if not option_dicts:
+            continue
+
+        if args.pilot and args.local:
+            pilot_dirs.append(queue_jobs(batch_dir, option_dicts, args.cache))
+        elif args.pilot:
+            queue_jobs(batch_dir, option_dicts, args.cache)
+            submit_pilots(batch_dir, args.log, args.pilot)
+        elif args.local:
+            local_jobs += option_dicts
+        else:
+            submit_jobs(batch_dir, option_dicts, args.log, args.cache, args.engine)
+
+    return local_jobs
+
+
 # TODO: remove dependencies (friends, paths,...)
 
 
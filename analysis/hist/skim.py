@@ -0,0 +1,158 @@
+import os
+import re
+import json
+import hashlib
+import logging
+
+import config as cfg
+
+from .columns import find_columns
+from .hist_process import HistMaker
+
+logger = logging.getLogger(__name__)
+
+
+def get_loosest_selection(selections):
+    """
+    Combine several region selections into the loosest common selection.
+    Clauses present in all selections are required, the remaining clauses
+    of each selection are combined with a logical or.
+    """
+    clauses = [list(sel.values()) for sel in selections]
+    common = [c for c in clauses[0] if all(c in cl for cl in clauses)]
+
+    alternatives = []
+    for cl in clauses:
+        rest = [c for c in cl if c not in common]
+
+        # one selection only needs the common clauses
+        if not rest:
+            return ' && '.join(common)
+
+        alternative = '(' + ' && '.join(rest) + ')'
+        if alternative not in alternatives:
+            alternatives.append(alternative)
+
+    return ' && '.join(common + ['(' + ' || '.join(alternatives) + ')'])
+
+
+def get_skim_config(region_selections, region, vary=False, weight_friend=False):
+    """
+    Get selection, columns and tag of the skim for the channel of a region.
+    The skim covers all regions and variations sharing this channel.
+    weight_friend: the weights are read from the weight friend.
+    """
+    channel = cfg.samples.get_channel(region)
+    regions = [
+        r for r in region_selections if cfg.samples.get_channel(r) == channel
+    ]
+
+    selections = []
+    expressions = []
+    for r in regions:
+        process_selections = cfg.selections.get_process_selection(r)
+        for cat in process_selections.values():
+            for proc, filters in cat.items():
+                expressions += filters
+
+        for variation, selection in region_selections[r].items():
+            selections.append(selection)
+            expressions += list(selection.values())
+            expressions += list(cfg.definitions.get_definitions(variation).values())
+            expressions += list(cfg.binnings.get_histograms(r, variation).keys())
+
+            for cat in process_selections.values():
+                for proc in cat:
+                    expressions += list(cfg.weights.get_weights(
+                        proc, variation, materialized=weight_friend
+                    ).values())
+
+        if not vary:
+            continue
+
+        # events passing the selection with varied columns are kept as well
+        for name, cols in cfg.definitions.get_momentum_variations(r).items():
+            for tag in ['up', 'dn']:
+                for col in cols:
+                    expressions += [col, f'{col}_{name}{tag}']
+
+                for selection in list(region_selections[r].values()):
+                    selections.append({
+                        key: re.sub(
+                            r'\b(' + '|'.join(cols) + r')\b',
+                            rf'\1_{name}{tag}',
+                            clause
+                        )
+                        for key, clause in selection.items()
+                    })
+
+    skim = {
+        'selection': get_loosest_selection(selections),
+        'columns': find_columns(expressions),
+    }
+    skim['tag'] = hashlib.sha1(
+        json.dumps(skim, sort_keys=True).encode()
+    ).hexdigest()[:10]
+
+    return skim
+
+
+def skim_path(f, tag):
+    """
+    Path of the skim of an ntuple file.
+    """
+    return f.replace('ntuples', f'skims/{tag}')
+
+
+def is_fresh(f, friends, tag):
+    """
+    Check whether the skim of a file exists and is newer than
+    the ntuple and all of its friends.
+    """
+    f_skim = skim_path(f, tag)
+    if not os.path.isfile(f_skim):
+        return False
+
+    mtime = os.path.getmtime(f_skim)
+    inputs = [f] + [f.replace('ntuples', f'friends/{friend}') for friend in friends]
+
+    return all(os.path.isfile(i) and os.path.getmtime(i) <= mtime for i in inputs)
+
+
+def make_skim(f, friends, selection, columns, f_out):
+    """
+    Apply the skim selection to one ntuple file and save the needed
+    columns of the ntuple and its friends to a single tree.
+    """
+    hist = HistMaker(
+        files=[f],
+        cat='skim',
+        proc=f,
+        friends=friends,
+        selections={
+            'skim': {
+                'definitions': {},
+                'region_selection': {'skim': selection},
+                'weights': {},
+            }
+        }
+    )
+
+    available = [str(c) for c in hist.rdf.GetColumnNames()]
+    cols = [
+        c for c in columns if c in available or 'ntuple.'+c in available
+    ]
+
+    os.makedirs(os.path.dirname(f_out), exist_ok=True)
+    f_tmp = f_out.replace('.root', '_tmp.root')
+    hist.rdf.Snapshot('ntuple', f_tmp, cols)
+    os.replace(f_tmp, f_out)
+
+    return f_out
+
+
+def skim_job(args):
+    try:
+        return make_skim(*args), None
+    except Exception as e:
+        return args[-1], repr(e)
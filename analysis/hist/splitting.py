@@ -0,0 +1,83 @@
+import os
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def split_files(files, entries, max_events):
+    """
+    Split the files into chunks with at most max_events entries.
+    Files with more entries are split into entry ranges.
+    Returns a list of (files, entry_range) tuples.
+    """
+    chunks = []
+    current, n_current = [], 0
+
+    for file in files:
+        n = entries[file]
+
+        if n > max_events:
+            for start in range(0, n, max_events):
+                chunks.append(([file], [start, min(start + max_events, n)]))
+            continue
+
+        if current and n_current + n > max_events:
+            chunks.append((current, None))
+            current, n_current = [], 0
+
+        current.append(file)
+        n_current += n
+
+    if current:
+        chunks.append((current, None))
+
+    return chunks
+
+
+def part_path(path, i):
+    """
+    Path of the i-th partial output of a job.
+    The partial outputs are kept in a subdirectory, such that they are not
+    picked up together with the merged outputs.
+    """
+    part_dir = os.path.join(os.path.dirname(path), 'parts')
+    os.makedirs(part_dir, exist_ok=True)
+    name = os.path.basename(path).replace('.root', f'_part{i}.root')
+
+    return os.path.join(part_dir, name)
+
+
+def split_option(option, entries, max_events):
+    """
+    Split the job given by an option dict into several jobs
+    with at most max_events entries each.
+    entries = {file: number of entries}, e.g. from the sample catalog.
+    The final output path of each partial output is kept as merge_path.
+    """
+    chunks = split_files(option['files'], entries, max_events)
+
+    logger.info(
+        f"Splitting job for {option['proc']} in category {option['cat']}"
+        f" with {sum(entries.values())} entries into {len(chunks)} jobs."
+    )
+
+    options = []
+    for i, (chunk, entry_range) in enumerate(chunks):
+        opt = copy.deepcopy(option)
+        opt['files'] = chunk
+        opt['entry_range'] = entry_range
+
+        if entry_range:
+            opt['entries'] = entry_range[1] - entry_range[0]
+        else:
+            opt['entries'] = sum(entries[f] for f in chunk)
+
+        selections = opt['selections'].values() if 'selections' in opt else [opt]
+        for sel in selections:
+            sel['merge_path'] = sel['save_path']
+            sel['save_path'] = part_path(sel['save_path'], i)
+
+        options.append(opt)
+
+    return options
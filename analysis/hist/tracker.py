@@ -0,0 +1,315 @@
+import ROOT
+import os
+import re
+import json
+import time
+import shlex
+import subprocess
+import logging
+from glob import glob
+
+from .merge import check_file
+from main_setup.batch import create_submit_script
+
+logger = logging.getLogger(__name__)
+
+# the condor commands can be replaced, e.g. by condor_stub.py for testing
+COMMANDS = {
+    'submit': os.environ.get('CONDOR_SUBMIT', 'condor_submit'),
+    'q': os.environ.get('CONDOR_Q', 'condor_q'),
+    'rm': os.environ.get('CONDOR_RM', 'condor_rm'),
+}
+
+# condor JobStatus codes
+HELD = 5
+
+MEMORY = 2000
+WALLTIME = 7200
+MAX_MEMORY = 16000
+MAX_WALLTIME = 48 * 3600
+
+
+def run_command(command, *args):
+    """
+    Run a condor command and return its output.
+    """
+    result = subprocess.run(
+        shlex.split(command) + [str(a) for a in args],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"{command} failed with exit code {result.returncode}:"
+            f" {result.stderr.strip()}"
+        )
+
+    return result.stdout
+
+
+def expected_histograms(selection):
+    """
+    Names of the histograms a selection of a job writes.
+    """
+    weights = list(selection['weights']) + list(selection.get('weight_factors', {}))
+
+    return [f'{var}_{weight}' for var in selection['hists'] for weight in weights]
+
+
+def validate_output(option):
+    """
+    Check the output files of a job and the histograms in them.
+    Returns None if the outputs are fine, otherwise the reason.
+    """
+    selections = option['selections'].values() \
+        if 'selections' in option else [option]
+
+    for sel in selections:
+        path = sel['save_path']
+        if not check_file(path):
+            return f"missing or broken output {path}"
+
+        tf = ROOT.TFile.Open(path, 'read')
+        keys = {key.GetName() for key in tf.GetListOfKeys()}
+        tf.Close()
+
+        missing = [h for h in expected_histograms(sel) if h not in keys]
+        if missing:
+            return f"{len(missing)} histograms missing in {path}, e.g. {missing[:3]}"
+
+    return None
+
+
+class JobTracker:
+    """
+    Keep track of the condor jobs of one options.json.
+    The jobs are recorded in jobs.json next to the options as
+    {index: {cluster, process, status, attempts, memory, walltime}}.
+    """
+
+    def __init__(self, batch_dir, commands=None, max_retries=3):
+        self.batch_dir = batch_dir
+        self.jobs_file = os.path.join(batch_dir, 'jobs.json')
+        self.commands = dict(COMMANDS, **(commands or {}))
+        self.max_retries = max_retries
+
+        with open(os.path.join(batch_dir, 'options.json'), 'r') as f:
+            self.options = json.load(f)
+
+        self.jobs = {}
+        self.dolog = False
+        if os.path.isfile(self.jobs_file):
+            with open(self.jobs_file, 'r') as f:
+                content = json.load(f)
+            self.jobs = {int(i): job for i, job in content['jobs'].items()}
+            self.dolog = content['log']
+
+        return
+
+
+    def reset(self, dolog=False):
+        """
+        Forget the jobs of previous submissions.
+        """
+        self.jobs = {}
+        self.dolog = dolog
+        self.save()
+
+        return
+
+
+    def save(self):
+        """
+        Save the job records to jobs.json.
+        """
+        tmp = self.jobs_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'log': self.dolog, 'jobs': self.jobs}, f, indent=4)
+        os.replace(tmp, self.jobs_file)
+
+        return
+
+
+    def submit(self, submit_script, indices, memory=MEMORY, walltime=WALLTIME):
+        """
+        Submit the jobs with the given indices and record their ids.
+        The submit script has to queue the indices in the given order.
+        """
+        output = run_command(self.commands['submit'], submit_script)
+        match = re.search(r'submitted to cluster (\d+)', output)
+        if not match:
+            raise RuntimeError(f"Could not parse the submit output: {output}")
+        cluster = int(match.group(1))
+
+        for process, i in enumerate(indices):
+            attempts = self.jobs.get(i, {}).get('attempts', 0)
+            self.jobs[i] = {
+                'cluster': cluster,
+                'process': process,
+                'status': 'submitted',
+                'attempts': attempts + 1,
+                'memory': memory,
+                'walltime': walltime,
+            }
+        self.save()
+
+        logger.info(f"Submitted {len(indices)} jobs to cluster {cluster}.")
+
+        return cluster
+
+
+    def query(self):
+        """
+        Get the status of the queued jobs, {(cluster, process): JobStatus}.
+        """
+        clusters = sorted({
+            job['cluster'] for job in self.jobs.values()
+            if job['status'] == 'submitted'
+        })
+        if not clusters:
+            return {}
+
+        output = run_command(
+            self.commands['q'], *clusters, '-af', 'ClusterId', 'ProcId', 'JobStatus'
+        )
+
+        queued = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 3:
+                queued[(int(fields[0]), int(fields[1]))] = int(fields[2])
+
+        return queued
+
+
+    def poll(self):
+        """
+        Update the status of the jobs. Jobs which left the queue are done
+        if their outputs are valid. Held jobs are removed and failed.
+        """
+        queued = self.query()
+
+        for i, job in self.jobs.items():
+            if job['status'] != 'submitted':
+                continue
+
+            job_id = (job['cluster'], job['process'])
+            if queued.get(job_id) == HELD:
+                run_command(self.commands['rm'], f'{job_id[0]}.{job_id[1]}')
+                job['status'] = 'failed'
+                job['reason'] = 'held'
+            elif job_id not in queued:
+                reason = validate_output(self.options[i])
+                job['status'] = 'failed' if reason else 'done'
+                if reason:
+                    job['reason'] = reason
+
+            if job['status'] == 'failed':
+                logger.warning(
+                    f"Job {i} ({self.options[i]['proc']},"
+                    f" {self.options[i]['cat']}) in {self.batch_dir} failed:"
+                    f" {job['reason']}"
+                )
+
+        self.save()
+
+        return
+
+
+    def resubmit(self):
+        """
+        Resubmit the failed jobs with twice the memory and walltime.
+        Jobs which failed max_retries times are given up.
+        """
+        resubmit = {}
+        for i, job in self.jobs.items():
+            if job['status'] != 'failed':
+                continue
+
+            if job['attempts'] > self.max_retries:
+                logger.error(f"Job {i} in {self.batch_dir} failed too often.")
+                job['status'] = 'abandoned'
+                continue
+
+            resources = (
+                min(2 * job['memory'], MAX_MEMORY),
+                min(2 * job['walltime'], MAX_WALLTIME),
+            )
+            resubmit.setdefault(resources, []).append(i)
+
+        self.save()
+
+        job_script = os.path.abspath(os.path.join(self.batch_dir, 'job.sh'))
+        for (memory, walltime), indices in resubmit.items():
+            submit_script = os.path.join(
+                self.batch_dir, f'submit_{memory}MB_{walltime}s.sub'
+            )
+            create_submit_script(
+                self.dolog, submit_script, job_script, len(indices),
+                indices, memory, walltime
+            )
+            logger.info(
+                f"Resubmitting {len(indices)} jobs with {memory} MB"
+                f" and {walltime} s."
+            )
+            self.submit(submit_script, indices, memory, walltime)
+
+        return
+
+
+    def summary(self):
+        """
+        Number of jobs per status.
+        """
+        counts = {}
+        for job in self.jobs.values():
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+
+        return counts
+
+
+    def is_finished(self):
+        """
+        Check if no job is queued or waiting for resubmission.
+        """
+        return all(
+            job['status'] in ['done', 'abandoned'] for job in self.jobs.values()
+        )
+
+
+def monitor_jobs(version, interval=60, commands=None, max_retries=3):
+    """
+    Monitor all submitted jobs of a version until they are done or
+    given up. Failed jobs are resubmitted.
+    Returns the (batch directory, index) of all abandoned jobs.
+    """
+    trackers = [
+        JobTracker(os.path.dirname(f), commands, max_retries)
+        for f in glob(f'output/{version}/batch_jobs/*/*/jobs.json')
+    ]
+    logger.info(f"Monitoring the jobs of {len(trackers)} batch directories.")
+
+    while True:
+        for tracker in trackers:
+            if not tracker.is_finished():
+                tracker.poll()
+                tracker.resubmit()
+
+        if all(tracker.is_finished() for tracker in trackers):
+            break
+
+        counts = {}
+        for tracker in trackers:
+            for status, n in tracker.summary().items():
+                counts[status] = counts.get(status, 0) + n
+        logger.info(f"Job status: {counts}")
+
+        time.sleep(interval)
+
+    abandoned = [
+        (tracker.batch_dir, i)
+        for tracker in trackers for i, job in tracker.jobs.items()
+        if job['status'] == 'abandoned'
+    ]
+    logger.info(f"All jobs finished, {len(abandoned)} given up.")
+
+    return abandoned
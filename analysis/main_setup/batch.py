@@ -1,4 +1,4 @@
-def create_job_script(job_script, input_file, job_dir):
+def create_job_script(job_script, input_file, job_dir, script='hist_process.py'):
     with open(job_script, 'w') as f:
         f.write("#!/bin/bash\n")
         f.write("echo 'Starting batch job'\n")
@@ -7,10 +7,28 @@ def create_job_script(job_script, input_file, job_dir):
             "LCG_105/x86_64-el9-gcc11-opt/setup.sh\n"
         )
         f.write(f'cd {job_dir}\n')
-        f.write(f"python hist_process.py {input_file} $1")
+        f.write(f"python {script} {input_file} $1")
 
 
-def create_submit_script(dolog, submit_script, job_script, n_processes):
+def create_pilot_script(job_script, batch_dir, job_dir):
+    # pilot workers run the queued jobs of a batch directory
+    with open(job_script, 'w') as f:
+        f.write("#!/bin/bash\n")
+        f.write("echo 'Starting pilot worker'\n")
+        f.write(
+            "source /cvmfs/sft.cern.ch/lcg/views/"\
+            "LCG_105/x86_64-el9-gcc11-opt/setup.sh\n"
+        )
+        f.write(f'cd {job_dir}\n')
+        f.write(f"python pilot.py {batch_dir} $1")
+
+
+def create_submit_script(
+    dolog, submit_script, job_script, n_processes,
+    indices=None, memory=2000, walltime=7200
+):
+    # indices: only submit the jobs with these indices of the options file
+    # memory in MB, walltime in seconds
     import os
 
     log_dir = os.path.dirname(submit_script)+ '/logs'
@@ -18,7 +36,10 @@ def create_submit_script(dolog, submit_script, job_script, n_processes):
 
     with open(submit_script, 'w') as f:
         f.write(f'executable = {job_script}\n')
-        f.write('arguments = $(Process)\n')
+        if indices is None:
+            f.write('arguments = $(Process)\n')
+        else:
+            f.write('arguments = $(JobIndex)\n')
         f.write('\n')
         f.write('# Output/Error/Log files\n')
         if dolog:
@@ -31,9 +52,9 @@ def create_submit_script(dolog, submit_script, job_script, n_processes):
             f.write(f'Log    = /dev/null\n')
         f.write('\n')
         f.write('# job requirements\n')
-        f.write('+RequestWalltime = 3600*2\n')
+        f.write(f'+RequestWalltime = {walltime}\n')
         f.write('RequestCPUs = 1\n')
-        f.write('RequestMemory = 2000\n')
+        f.write(f'RequestMemory = {memory}\n')
         f.write('request_disk = 5000000\n')
         f.write('Requirements = TARGET.ProvidesEKPResources =?= True\n')
         f.write('accounting_group = cms.higgs\n')
@@ -41,4 +62,7 @@ def create_submit_script(dolog, submit_script, job_script, n_processes):
         f.write('docker_image = cverstege/alma9-gridjob\n')
         f.write('getenv = True\n')
 
-        f.write(f'queue {n_processes}\n')
+        if indices is None:
+            f.write(f'queue {n_processes}\n')
+        else:
+            f.write(f'queue JobIndex in ({", ".join(map(str, indices))})\n')
@@ -8,6 +8,18 @@ def parse_args():
         description="Parser for analysis setup",
         formatter_class=RawTextHelpFormatter
     )
+    parser.add_argument(
+        '--catalog',
+        action='store_true',
+        default=False,
+        help="refresh the sample catalog (file lists, entries, friends)"
+    )
+    parser.add_argument(
+        '--skim',
+        action='store_true',
+        default=False,
+        help="produce skims of the ntuples&friends with the loosest region selection"
+    )
     parser.add_argument(
         '-H',
         '--histograms',
@@ -33,6 +45,87 @@ def parse_args():
         default=False,
         help='skip pt correction histogram production'
     )
+    parser.add_argument(
+        '--vary',
+        action='store_true',
+        default=False,
+        help='derive pt correction variations with RDataFrame Vary in the Nominal jobs'
+    )
+    parser.add_argument(
+        '--singlePass',
+        action='store_true',
+        default=False,
+        help='fill all selection variations of a sample in one event loop'
+    )
+    parser.add_argument(
+        '--categorical',
+        action='store_true',
+        default=False,
+        help='fill the isolation bins and charges of the W regions in one pass with categorical axes'
+    )
+    parser.add_argument(
+        '--fuseProcesses',
+        action='store_true',
+        default=False,
+        help='fill the processes reading the same files (e.g. W, Wtau, Wnonfid) in one job'
+    )
+    parser.add_argument(
+        '--weightFriend',
+        action='store_true',
+        default=False,
+        help='read the nominal weights from the weight friend (corrections/correct.py --weights)'
+    )
+    parser.add_argument(
+        '--cse',
+        action='store_true',
+        default=False,
+        help='evaluate the subexpressions shared by the weights and selections of a job once per event'
+    )
+    parser.add_argument(
+        '--orderFilters',
+        action='store_true',
+        default=False,
+        help='apply the filters ordered by their pass fraction and cost, measured on the first file of each sample'
+    )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        default=False,
+        help='compile the expressions once into a cached library instead of JIT compiling them in each job'
+    )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default='rdf',
+        choices=['rdf', 'columnar'],
+        help='histogram engine: RDataFrame or columnar numpy/uproot without ROOT'
+    )
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        default=False,
+        help='reuse histogram results of unchanged jobs from output/cache'
+    )
+    parser.add_argument(
+        '--maxEvents',
+        type=int,
+        default=None,
+        help='split histogram jobs into chunks of at most this many entries'
+    )
+    parser.add_argument(
+        '--merge',
+        action='store_true',
+        default=False,
+        help='merge the partial outputs of split histogram jobs'
+    )
+    parser.add_argument(
+        '--metrics',
+        nargs='*',
+        default=None,
+        metavar='DIR',
+        help="list the slowest and most memory-hungry jobs from their metrics;"
+             " further directories (e.g. the correction friends) can be given"
+    )
     parser.add_argument(
         '--qcd',
         action='store_true',
@@ -72,6 +165,31 @@ def parse_args():
         default=False,
         help="run locally"
     )
+    parser.add_argument(
+        '--monitor',
+        action='store_true',
+        default=False,
+        help="monitor the batch jobs, validate their outputs and resubmit failed jobs"
+    )
+    parser.add_argument(
+        '--pilot',
+        type=int,
+        default=None,
+        help="number of pilot workers pulling the jobs from a shared queue instead of one job per process"
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help="number of parallel processes when running locally"
+    )
+    parser.add_argument(
+        '--maxMemory',
+        type=int,
+        default=None,
+        help="memory limit per local process in MB"
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
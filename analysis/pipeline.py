@@ -6,10 +6,26 @@ main_logger = logging.getLogger(__name__)
 
 def run_pipeline(args):
 
+    if args.catalog:
+        from hist import run_catalog
+        run_catalog()
+
+    if args.skim:
+        from hist import run_skim
+        run_skim(args)
+
     if args.histograms:
         from hist import run_production
         run_production(args)
 
+    if args.merge:
+        from hist import run_merge
+        run_merge(args.version, args.jobs)
+
+    if args.metrics is not None:
+        from hist import report_metrics
+        report_metrics(args.version, directories=args.metrics)
+
     if args.qcd:
         from hist import run_qcd
         run_qcd(args.version)
@@ -76,6 +76,30 @@ def main():
         correction_handler.prepare()
         correction_handler.run()
 
+    if args.weights:
+        from src.weights.weight_correction import WeightCorrection
+        correction_handler = WeightCorrection(
+            inpath=config.inpath,
+            correction='weight',
+            args = args
+        )
+        main_logger.info("Writing nominal weights.")
+
+        correction_handler.prepare(config.nominal_weights, config.weight_friends)
+        correction_handler.run()
+
+    if args.mergefriends:
+        from src.friends.friend_merger import FriendMerger
+        correction_handler = FriendMerger(
+            inpath=config.inpath,
+            correction='merged',
+            args = args
+        )
+        main_logger.info("Merging friends.")
+
+        correction_handler.prepare(config.merged_friends, config.merged_drop)
+        correction_handler.run()
+
     if args.recoil:
         main_logger.info("Applying recoil correction.")
         # correction_handler.apply_recoil_correction()
@@ -1 +1,21 @@
-inpath = '/ceph/jdriesch/CROWN_samples/test/ntuples/2022/*/*/*.root'
\ No newline at end of file
+import os
+
+# can be pointed to a synthetic dataset (see analysis/bench/synthetic.py)
+inpath = os.environ.get(
+    'CORRECTIONS_INPATH', '/ceph/jdriesch/CROWN_samples/test/ntuples/2022/*/*/*.root'
+)
+
+# friends merged into one friend (friends/merged) and columns not needed downstream
+merged_friends = ['sf', 'xy', 'pu', 'ptweight', 'xsec', 'lepton', 'met_punom']
+merged_drop = ['val_*', 'err_*']
+
+# nominal event weights materialized into the weight friend (friends/weight),
+# as get_nominal_weights in analysis/config/weights.py (highiso: isolation
+# sidebands). The expressions are stored in the friend and checked by the
+# analysis, which refuses friends written with other expressions.
+base_weight = 'genweight*sumwWeight*crossSectionPerEventWeight*pog_puweight*ptweight*5010'
+nominal_weights = {
+    'weight_nominal': base_weight + '*sf_trk*sf_sta*sf_id*sf_iso*sf_trg*sf_prefire',
+    'weight_nominal_highiso': base_weight + '*sf_trk*sf_sta*sf_id*sf_highiso_iso*sf_highiso_trg*sf_prefire',
+}
+weight_friends = ['sf', 'pu', 'ptweight', 'xsec']
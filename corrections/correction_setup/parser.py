@@ -32,6 +32,16 @@ def setup():
         action="store_true",
         help="Apply muon scale and resolution correction"
     )
+    parser.add_argument(
+        "--weights",
+        action="store_true",
+        help="Write the nominal event weights into a friend"
+    )
+    parser.add_argument(
+        "--mergefriends",
+        action="store_true",
+        help="Merge the friends of each ntuple into one friend"
+    )
     parser.add_argument(
         "--recoil",
         action="store_true",
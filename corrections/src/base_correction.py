@@ -1,5 +1,8 @@
 import ROOT
 import os
+import json
+import time
+import resource
 import logging
 import glob
 
@@ -10,6 +13,8 @@ class BaseCorrection:
         self.overwrite = args.overwrite
         self.logger = logging.getLogger(__name__)
         self.nthreads = args.jobs
+        # root node of the dataframe of the current job, for the job metrics
+        self.rdf = None
 
 
     def execute(self):
@@ -63,13 +68,56 @@ class BaseCorrection:
         return self.execute(*args)
 
 
+    def measure_job(self, args):
+        """
+        Run a job and write its performance metrics next to its output
+        (same name with .metrics.json), if the output has been written.
+        Wall time, CPU time and peak RSS are those of the worker process.
+        """
+        f_in = args[0] if isinstance(args, (list, tuple)) else args
+        f_out = f_in.replace("ntuples", f"friends/{self.correction}")
+
+        start, cpu_start = time.time(), time.process_time()
+        bytes_start = ROOT.TFile.GetFileBytesRead()
+        self.rdf = None
+
+        result = self.job_wrapper(args)
+
+        if not os.path.isfile(f_out) or os.path.getmtime(f_out) < start:
+            return result
+
+        tf = ROOT.TFile.Open(f_out)
+        tree = tf.Get('ntuple') if tf else None
+        entries = tree.GetEntries() if tree else 0
+        if tf:
+            tf.Close()
+
+        metrics = {
+            'correction': self.correction,
+            'input': f_in,
+            'wall': time.time() - start,
+            'cpu': time.process_time() - cpu_start,
+            # kB on linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'host': os.uname().nodename,
+            'event_loops': self.rdf.GetNRuns() if self.rdf else 0,
+            'entries': entries,
+            'bytes_read': {'total': ROOT.TFile.GetFileBytesRead() - bytes_start},
+            'output_bytes': os.path.getsize(f_out),
+        }
+        with open(os.path.splitext(f_out)[0] + '.metrics.json', 'w') as f:
+            json.dump(metrics, f, indent=4)
+
+        return result
+
+
     def run_multicore(self, arguments, nthreads):
         from multiprocessing import Pool, RLock
         from tqdm import tqdm
 
         pool = Pool(nthreads, initargs=(RLock(),), initializer=tqdm.set_lock)
         for _ in tqdm(
-            pool.imap_unordered(self.job_wrapper, arguments),
+            pool.imap_unordered(self.measure_job, arguments),
             total=len(arguments),
             desc="Total progess",
             dynamic_ncols=True,
@@ -43,6 +43,7 @@ class BosonPtCorrection(BaseCorrection):
 
         # load dataframe
         rdf = ROOT.RDataFrame('ntuple', f_in)
+        self.rdf = rdf
     
         # check if signal
         is_sigw = ("/WtoLNu" in f_in and "mmet" in f_in)
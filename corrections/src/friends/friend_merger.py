@@ -0,0 +1,117 @@
+import ROOT
+import os
+from fnmatch import fnmatch
+
+from src.base_correction import BaseCorrection
+
+
+class FriendMerger(BaseCorrection):
+    """
+    Class to merge the friends of an ntuple into one friend file.
+    """
+
+    def prepare(self, friends, drop=[]):
+        """
+        Prepare the merging.
+        friends: friends to be merged, earlier friends take precedence
+        for columns present in several friends.
+        drop: patterns of columns which are not needed downstream.
+        """
+        self.friends = friends
+        self.drop = drop
+
+        return
+
+
+    def run(self):
+        """
+        Run the merging.
+        """
+
+        arguments = self.infiles
+        self.logger.info(
+            f"Merging friends {self.friends} of {len(arguments)} files with "\
+            f"{self.nthreads} cores."
+        )
+        self.run_multicore(arguments, self.nthreads)
+        self.logger.info("Finished merging friends.")
+
+
+    def job_wrapper(self, args):
+        return self.execute(args)
+
+
+    def get_entries(self, f):
+        """
+        Get the number of entries of the ntuple in a file.
+        """
+        tf = ROOT.TFile.Open(f, 'read')
+        tree = tf.Get('ntuple')
+        entries = tree.GetEntries()
+        branches = [b.GetName() for b in tree.GetListOfBranches()]
+        tf.Close()
+
+        return entries, branches
+
+
+    def execute(self, f_in):
+        """
+        Merge the friends of the input file.
+        """
+
+        # check if file is already there
+        f_out = self.check_file(f_in)
+        if not f_out:
+            return
+
+        entries, _ = self.get_entries(f_in)
+
+        # check that all friends are there and aligned with the ntuple
+        columns = []
+        for friend in self.friends:
+            f_friend = f_in.replace("ntuples", f"friends/{friend}")
+            if not self.check_zombie(f_friend):
+                self.logger.warning(
+                    f"Friend {friend} of {f_in} not found. Skipping."
+                )
+                return
+
+            entries_friend, branches = self.get_entries(f_friend)
+            if entries_friend != entries:
+                self.logger.warning(
+                    f"Friend {friend} of {f_in} has {entries_friend} entries"\
+                    f" instead of {entries}. Skipping."
+                )
+                return
+
+            columns += [
+                b for b in branches if b not in columns
+                and not any(fnmatch(b, pattern) for pattern in self.drop)
+            ]
+
+        # first friend as main tree, others as friends
+        f_first = f_in.replace("ntuples", f"friends/{self.friends[0]}")
+        chain = ROOT.TChain('ntuple')
+        chain.Add(f_first)
+
+        friend_chains = []
+        for friend in self.friends[1:]:
+            chain_friend = ROOT.TChain('ntuple')
+            chain_friend.Add(f_in.replace("ntuples", f"friends/{friend}"))
+            chain.AddFriend(chain_friend)
+            friend_chains.append(chain_friend)
+
+        rdf = ROOT.RDataFrame(chain)
+        self.rdf = rdf
+
+        f_tmp = f_out.replace('.root', '_tmp.root')
+        rdf.Snapshot("ntuple", f_tmp, columns)
+
+        # keep track of the merged friends
+        tf = ROOT.TFile(f_tmp, 'update')
+        ROOT.TNamed('friends', ','.join(self.friends)).Write()
+        tf.Close()
+
+        os.replace(f_tmp, f_out)
+
+        return
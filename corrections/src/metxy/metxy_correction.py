@@ -49,6 +49,7 @@ class METXYCorrection(BaseCorrection):
 
         # load dataframe
         rdf = ROOT.RDataFrame('ntuple', f_in)
+        self.rdf = rdf
 
         # check if data
         is_data = (rdf.Sum("is_data").GetValue()>0)
@@ -139,6 +139,7 @@ class ScaleFactorCorrection(BaseCorrection):
         
         # load data in dataframe
         rdf = ROOT.RDataFrame("ntuple", f_in)
+        self.rdf = rdf
 
         # check if one or two muons
         isdilepton = ("/mm/" in f_in)
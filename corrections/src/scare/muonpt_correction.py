@@ -279,6 +279,7 @@ class MuonPtCorrection(BaseCorrection):
         # load rdf
         chain = self.load_chains(f_in, ["metxy"])
         rdf = ROOT.RDataFrame(chain)
+        self.rdf = rdf
 
         # check if data
         is_data = (rdf.Sum("is_data").GetValue()>0)
@@ -0,0 +1,80 @@
+import ROOT
+import os
+import json
+
+from src.base_correction import BaseCorrection
+
+
+class WeightCorrection(BaseCorrection):
+    """
+    Class to materialize the nominal event weights into a friend, such that
+    the histogram jobs read one weight column instead of all its factors.
+    """
+
+    def prepare(self, weights, friends):
+        """
+        Prepare the weight computation.
+        weights: {column: product of the nominal weight}
+        friends: friends providing the factors of the products.
+        """
+        self.weights = weights
+        self.friends = friends
+
+        return
+
+
+    def run(self):
+        """
+        Run the weight computation.
+        """
+
+        arguments = self.infiles
+        self.logger.info(
+            f"Writing nominal weights {list(self.weights)} of {len(arguments)}"\
+            f" files with {self.nthreads} cores."
+        )
+        self.run_multicore(arguments, self.nthreads)
+        self.logger.info("Finished writing nominal weights.")
+
+
+    def job_wrapper(self, args):
+        return self.execute(args)
+
+
+    def execute(self, f_in):
+        """
+        Write the nominal weights of the input file.
+        """
+
+        # check if file is already there
+        f_out = self.check_file(f_in)
+        if not f_out:
+            return
+
+        for friend in self.friends:
+            f_friend = f_in.replace("ntuples", f"friends/{friend}")
+            if not self.check_zombie(f_friend):
+                self.logger.warning(
+                    f"Friend {friend} of {f_in} not found. Skipping."
+                )
+                return
+
+        chain = self.load_chains(f_in, self.friends)
+        rdf = ROOT.RDataFrame(chain)
+        self.rdf = rdf
+
+        # data is not weighted, as in the analysis
+        for column, weight in self.weights.items():
+            rdf = rdf.Define(column, f"is_data ? 1. : double({weight})")
+
+        f_tmp = f_out.replace('.root', '_tmp.root')
+        rdf.Snapshot("ntuple", f_tmp, list(self.weights))
+
+        # keep track of the expressions, which the analysis checks
+        tf = ROOT.TFile(f_tmp, 'update')
+        ROOT.TNamed('weights', json.dumps(self.weights, sort_keys=True)).Write()
+        tf.Close()
+
+        os.replace(f_tmp, f_out)
+
+        return